@@ -29,7 +29,8 @@ feature:
 
 """
 
-import logging
+import logging, threading
+from contextlib import contextmanager
 from collections.abc import MutableMapping, MutableSequence, Sequence, Mapping
 from copy import copy,deepcopy
 from crow.config.exceptions import *
@@ -40,7 +41,7 @@ from crow._superdebug import superdebug
 __all__=[ 'expand', 'strcalc', 'from_config', 'dict_eval', 'strref',
           'list_eval', 'multidict', 'Eval', 'user_error_message',
           'stricalc', 'strucalc', 'iexpand', 'uexpand', 'striref',
-          'struref' ]
+          'struref', 'recording_reads', 'is_recording_reads' ]
 _logger=logging.getLogger('crow.config')
 
 class user_error_message(str):
@@ -166,6 +167,57 @@ def from_config(key,val,globals,locals,path):
         raise CalcRecursionTooDeep(
             f'{path}: !{key} {type(val).__name__}')
 
+########################################################################
+
+# Reads recorded in this thread: a stack of lists, one per expression
+# being evaluated, below the list given to recording_reads.
+_recording=threading.local()
+
+@contextmanager
+def recording_reads(reads):
+    """!Appends (container,key,raw) to the reads list for each value this
+    thread reads from a dict_eval or list_eval in the with block.  The
+    raw value is the unevaluated one.  Values read by the expressions
+    evaluated for those reads are included, even if they were cached
+    before.  Other threads are unaffected."""
+    stack=getattr(_recording,'stack',None)
+    if stack is None:
+        stack=_recording.stack=list()
+    stack.append(reads)
+    try:
+        yield reads
+    finally:
+        stack.pop()
+
+def is_recording_reads():
+    """!True if this thread is in a recording_reads block"""
+    return bool(getattr(_recording,'stack',None))
+
+def _record_read(container,key,raw,reads,get,reevaluate):
+    """!Records a read of container[key], whose raw value is raw, for
+    recording_reads, and returns get().  The reads dict maps keys to
+    the reads made while evaluating their expressions; an expression
+    whose reads are not known yet is evaluated in a new recording.  If
+    its value was cached already, reevaluate() evaluates it again
+    without touching the cache, so the reads are known."""
+    stack=_recording.stack
+    stack[-1].append(( container, key, raw ))
+    if not hasattr(raw,'_result'):
+        return get()
+    if key in reads:
+        stack[-1].extend(reads[key])
+        return get()
+    found=list()
+    with recording_reads(found):
+        if hasattr(container._raw_cache()[key],'_result'):
+            value=get()
+        else:
+            reevaluate()
+            value=get()
+    reads[key]=found
+    stack[-1].extend(found)
+    return value
+
 class multidict(MutableMapping):
     """!This is a dict-like object that makes multiple dicts act as one.
     Its methods look over the dicts in order, returning the result
@@ -236,6 +288,7 @@ class dict_eval(MutableMapping):
         self.__cache=copy(child)
         self.__globals={} if globals is None else globals
         self.__is_validated=False
+        self.__reads=dict()
         self._path=path
     def __contains__(self,k):   return k in self.__child
     def __len__(self):          return len(self.__child)
@@ -256,10 +309,12 @@ class dict_eval(MutableMapping):
         self._is_validated=False
         if key is None:
             #print(f'{self._path}: reset')
+            self.__reads=dict()
             self.__cache=dict(self.__child)
             #if 'ecflow_def' in self:
             #    print(f'ecflow_def = {self.__cache["ecflow_def"]!r}')
         else:
+            self.__reads.pop(key,None)
             self.__cache[key]=self.__child[key]
     def _raw_child(self):       return self.__child
     def _has_raw(self,key):     return key in self.__child
@@ -300,7 +355,10 @@ class dict_eval(MutableMapping):
             assert(isinstance(v,expand))
         self.__child[k]=v
         self.__cache[k]=v
-    def __delitem__(self,k): del(self.__child[k], self.__cache[k])
+        self.__reads.pop(k,None)
+    def __delitem__(self,k):
+        del(self.__child[k], self.__cache[k])
+        self.__reads.pop(k,None)
     def __iter__(self):
         for k in self.__child.keys(): yield k
     def _inherit(self,stage,memo=None):
@@ -352,6 +410,14 @@ class dict_eval(MutableMapping):
             if key not in self.__child:
                 raise KeyError(f'{self._path}: no {key} in {list(self.keys())}')
             self.__cache[key]=self.__child[key]
+        if is_recording_reads():
+            return _record_read(
+                self,key,self.__child[key],self.__reads,
+                lambda: self.__evaluate(key),
+                lambda: from_config(key,self.__child[key],self.__globals,self,
+                                    f'{self._path}.{key}'))
+        return self.__evaluate(key)
+    def __evaluate(self,key):
         val=self.__cache[key]
         if hasattr(val,'_result'):
             immediate=hasattr(val,'_is_immediate')
@@ -416,6 +482,7 @@ class list_eval(MutableSequence):
         self.__cache=list(child)
         self.__locals=locals
         self.__globals={}
+        self.__reads=dict()
         self._path=path
     def _raw_cache(self):       return self.__cache
     def __len__(self):          return len(self.__child)
@@ -457,6 +524,7 @@ class list_eval(MutableSequence):
         self.__cache=deepcopy(other.__cache,memo)
     def _invalidate_cache(self,index=None):
         _logger.debug(f'{self._path}: invalidate cache')
+        self.__reads=dict()
         if index is None:
             self.__cache=copy(self.__child)
         else:
@@ -464,12 +532,23 @@ class list_eval(MutableSequence):
     def __setitem__(self,k,v):
         self.__child[k]=v
         self.__cache[k]=v
+        self.__reads=dict()
     def __delitem__(self,k):
         del(self.__child[k], self.__cache[k])
+        self.__reads=dict()
     def insert(self,i,o):
         self.__child.insert(i,o)
         self.__cache.insert(i,o)
+        self.__reads=dict()
     def __getitem__(self,index):
+        if is_recording_reads() and isinstance(index,int):
+            return _record_read(
+                self,index,self.__child[index],self.__reads,
+                lambda: self.__evaluate(index),
+                lambda: from_config(index,self.__child[index],self.__globals,
+                                    self.__locals,f'{self._path}[{index}]'))
+        return self.__evaluate(index)
+    def __evaluate(self,index):
         val=self.__cache[index]
         if hasattr(val,'_result'):
             immediate=hasattr(val,'_is_immediate')
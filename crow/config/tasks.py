@@ -17,7 +17,8 @@ from collections import namedtuple, OrderedDict, Sequence
 from collections.abc import Mapping, Sequence
 from copy import copy, deepcopy
 from crow.config.exceptions import *
-from crow.config.eval_tools import dict_eval, strcalc, multidict, from_config, update_globals
+from crow.config.eval_tools import dict_eval, strcalc, multidict, from_config, update_globals, \
+     is_recording_reads
 from crow.tools import to_timedelta, typecheck, NamedConstant, MISSING
 from crow._superdebug import superdebug
 
@@ -308,7 +309,10 @@ class SuiteView(Mapping):
 
     def __getitem__(self,key):
         assert(isinstance(key,str))
-        if key in self.__cache: return self.__cache[key]
+        if key in self.__cache:
+            if is_recording_reads():
+                self.viewed[key] # so recording_reads sees the read
+            return self.__cache[key]
         if key not in self.viewed:
             raise KeyError(f'{key}: not in {", ".join([k for k in self.keys()])}')
         val=self.viewed[key]
@@ -866,7 +870,7 @@ class TaskArrayElement(dict_eval):
             for k,v in dimensions.items():
                 dimensions_to_dimidx[k]=[n for n in range(len(v))]
             dict_iter=subdict_iter(dimensions_to_dimidx)
-        for more_dimidx in dict_iter:
+        for array_index,more_dimidx in enumerate(dict_iter,1):
             child_dimidx=copy(dimidx)
             child_dimidx.update(more_dimidx)
             child_dimval=dict()
@@ -878,6 +882,9 @@ class TaskArrayElement(dict_eval):
             t['dimlist']=dict_eval(dimensions)
             t['dimval']=dict_eval(child_dimval)
             t['dimidx']=dict_eval(child_dimidx)
+            # Position among this element's tasks, for job arrays:
+            t['array_element']=self._path
+            t['array_index']=array_index
             name=t.Name
             t._path=f'{parent._path}.{name}'
             for k,v in self._raw_child().items():
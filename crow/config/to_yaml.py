@@ -184,7 +184,8 @@ yaml.add_representer(crow.sysenv.JobResourceSpec,
                      represent_JobResourceSpec)
 
 def represent_JobRankSpec(dumper,data):
-    return dumper.represent_data(dict(data))
+    return dumper.represent_data(dict([
+        (k, list(v) if isinstance(v,tuple) else v) for k,v in data.items() ]))
 yaml.add_representer(crow.sysenv.JobRankSpec,represent_JobRankSpec)
 
 ########################################################################
@@ -0,0 +1,22 @@
+"""!Tracks the data that the jobs (actors) of a workflow deliver and
+obtain.
+
+Each actor has input and output slots, described in the suite by
+!InputSlot and !OutputSlot.  The Dataflow database stores them, the
+connection from each input slot to the output slot it reads, and, for
+each cycle, whether each message has been delivered.  Delivered files
+may be kept once each in a content-addressed BlobStore.  Consumers
+block until their data is available with wait_for.  The
+utils/crow_dataflow_*_sh.py scripts use it from job scripts."""
+
+from .store import Dataflow, Slot, InputSlot, OutputSlot, Message, \
+     InputMessage, OutputMessage
+from .blobs import BlobStore
+from .wait import wait_for
+from .exceptions import DataflowError, NoSuchSlot, AmbiguousMessage, \
+     DataNotAvailable
+
+__all__=[ 'Dataflow', 'Slot', 'InputSlot', 'OutputSlot', 'Message',
+          'InputMessage', 'OutputMessage', 'DataflowError', 'NoSuchSlot',
+          'AmbiguousMessage', 'DataNotAvailable', 'BlobStore',
+          'wait_for' ]
@@ -0,0 +1,177 @@
+"""!A content-addressed store of delivered files.
+
+Many output slots deliver identical files, such as fix files and
+climatology, every cycle.  A BlobStore keeps one copy of each distinct
+file, named by the SHA-256 hash of its contents, and makes each slot
+location a hard link or symbolic link to it.  The hash is computed
+while the file is copied into the store, so the data is read only
+once.  If the store already has a blob with that hash, the new copy
+is discarded.
+
+Blobs are shared by many locations, so they are read-only.  A new
+delivery to a location replaces the link; it never changes the blob.
+
+Blobs no longer used by any message in the database are removed by
+BlobStore.gc, usually through Dataflow.collect_garbage."""
+
+f'This module requires python 3.6 or newer.'
+
+import os, re, time, errno, hashlib, logging, tempfile
+from contextlib import suppress
+
+from crow.dataflow.exceptions import DataflowError
+
+__all__=[ 'BlobStore', 'BLOB_LINKS', 'GC_MIN_AGE' ]
+
+_logger=logging.getLogger('crow.dataflow')
+
+## Ways to make a slot location refer to a blob
+BLOB_LINKS=[ 'hardlink', 'symlink' ]
+
+## Blobs and temporary files younger than this many seconds are never
+## garbage collected, since a delivery may not have recorded them yet
+GC_MIN_AGE=3600
+
+_DIGEST=re.compile('^[0-9a-f]{64}$')
+
+class BlobStore(object):
+    """!A directory of files named by the SHA-256 of their contents.
+
+    @param directory the top directory of the store; created if missing
+    @param link how locations refer to blobs: "hardlink" or "symlink".
+      A hard link that fails, for example because the location is on
+      another filesystem, becomes a symbolic link.
+    @param blocksize bytes read at a time while hashing"""
+    def __init__(self,directory,link='hardlink',blocksize=1048576):
+        if link not in BLOB_LINKS:
+            raise DataflowError(f'{link}: blob link must be one of: '
+                                f'{", ".join(BLOB_LINKS)}')
+        self.directory=os.path.abspath(directory)
+        self.link=link
+        self.blocksize=int(blocksize)
+        self.tmpdir=os.path.join(self.directory,'tmp')
+        os.makedirs(self.tmpdir,exist_ok=True)
+
+    def path(self,digest):
+        """!The file that holds the blob with the given digest"""
+        return os.path.join(self.directory,digest[0:2],digest[2:])
+
+    def has(self,digest):
+        return os.path.exists(self.path(digest))
+
+    def store(self,filename):
+        """!Adds a copy of a file to the store, unless the store already
+        has one with the same contents.  Returns the digest."""
+        sha=hashlib.sha256()
+        with open(filename,'rb') as in_fd:
+            istat=os.fstat(in_fd.fileno())
+            out_fd=tempfile.NamedTemporaryFile(
+                prefix='_tmp_blob.',dir=self.tmpdir,delete=False)
+            try:
+                with out_fd:
+                    data=in_fd.read(self.blocksize)
+                    while data:
+                        sha.update(data)
+                        out_fd.write(data)
+                        data=in_fd.read(self.blocksize)
+                digest=sha.hexdigest()
+                blob=self.path(digest)
+                if os.path.exists(blob):
+                    # Keep it from garbage collection until this
+                    # delivery is recorded.
+                    os.utime(blob)
+                    _logger.debug(f'{filename}: already stored as {digest}')
+                    return digest
+                os.makedirs(os.path.dirname(blob),exist_ok=True)
+                os.chmod(out_fd.name,istat.st_mode&0o7555)
+                os.rename(out_fd.name,blob)
+                _logger.debug(f'{filename}: stored as {digest}')
+                return digest
+            finally:
+                with suppress(FileNotFoundError): os.unlink(out_fd.name)
+
+    def materialize(self,digest,location):
+        """!Makes location a link to the blob, replacing whatever was
+        there.  Returns "hardlink" or "symlink".
+
+        @raise DataflowError if the store has no such blob"""
+        blob=self.path(digest)
+        if not os.path.exists(blob):
+            raise DataflowError(f'{digest}: no such blob in {self.directory}')
+        to_dir=os.path.dirname(os.path.abspath(location))
+        os.makedirs(to_dir,exist_ok=True)
+        linkpath=os.path.join(to_dir,f'_tmp_{os.path.basename(location)}'
+                              f'.blob.{os.getpid()}')
+        with suppress(FileNotFoundError): os.unlink(linkpath)
+        how=self.link
+        try:
+            if how=='hardlink':
+                try:
+                    os.link(blob,linkpath)
+                except OSError as e:
+                    if e.errno not in [ errno.EXDEV, errno.EPERM,
+                                        errno.EMLINK, errno.ENOTSUP ]:
+                        raise
+                    _logger.debug(f'{location}: cannot hardlink: {e}')
+                    how='symlink'
+            if how=='symlink':
+                os.symlink(blob,linkpath)
+            # rename does nothing if location is already this link, so
+            # the temporary link is removed below.
+            os.rename(linkpath,location)
+        finally:
+            with suppress(FileNotFoundError): os.unlink(linkpath)
+        _logger.debug(f'{location}: {how} to {blob}')
+        return how
+
+    def deliver(self,filename,location):
+        """!Stores a file and makes location a link to it.  Returns the
+        digest."""
+        digest=self.store(filename)
+        self.materialize(digest,location)
+        return digest
+
+    def digests(self):
+        """!Iterates over the digests of all blobs in the store"""
+        for subdir in sorted(os.listdir(self.directory)):
+            path=os.path.join(self.directory,subdir)
+            if len(subdir)!=2 or not os.path.isdir(path): continue
+            for name in sorted(os.listdir(path)):
+                if _DIGEST.match(subdir+name):
+                    yield subdir+name
+
+    def gc(self,referenced,min_age=GC_MIN_AGE,dry_run=False):
+        """!Deletes blobs whose digests are not in referenced, and
+        temporary files left by failed deliveries.  Files modified in
+        the last min_age seconds are kept.
+
+        Locations that are hard links keep their data; symbolic links
+        to deleted blobs are left dangling.
+
+        @param referenced the digests still in use
+        @param min_age seconds
+        @param dry_run if True, only report what would be deleted
+        @returns the list of deleted digests"""
+        referenced=set(referenced)
+        cutoff=time.time()-min_age
+        removed=list()
+        for digest in list(self.digests()):
+            if digest in referenced: continue
+            path=self.path(digest)
+            with suppress(FileNotFoundError):
+                if os.stat(path).st_mtime>cutoff: continue
+                if not dry_run: os.unlink(path)
+                removed.append(digest)
+        for name in os.listdir(self.tmpdir):
+            path=os.path.join(self.tmpdir,name)
+            with suppress(FileNotFoundError):
+                if os.stat(path).st_mtime<=cutoff and not dry_run:
+                    _logger.info(f'{path}: delete stale temporary file')
+                    os.unlink(path)
+        _logger.info(f'{self.directory}: '
+                     f'{"would delete" if dry_run else "deleted"} '
+                     f'{len(removed)} unreferenced blobs')
+        return removed
+
+    def __repr__(self):
+        return f'BlobStore({self.directory!r},link={self.link!r})'
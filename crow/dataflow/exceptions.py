@@ -0,0 +1,5 @@
+from crow.exceptions import CROWException
+class DataflowError(CROWException): pass
+class NoSuchSlot(DataflowError): pass
+class AmbiguousMessage(DataflowError): pass
+class DataNotAvailable(DataflowError): pass
@@ -0,0 +1,855 @@
+"""!The SQLite database behind crow.dataflow.
+
+The database holds three kinds of records:
+
+* slots --- the input and output slots of each actor (job), with their
+  metadata.  Metadata values may be lists, meaning the slot holds one
+  message per value, as with an OutputSlot with "fhr: [0, 3, 6]".
+* connections --- the output slot each input slot reads, and the
+  cycle offset at which it reads it.
+* messages --- one record per output slot, cycle, and combination of
+  metadata values, with the file that holds the data and the time it
+  became available.
+
+Many jobs of one workflow update the same database at once, so each
+connection uses write-ahead logging, which lets readers run during a
+write, and a busy timeout, so writers wait for each other instead of
+failing with "database is locked".  Writes take the lock at the start
+of their transaction (BEGIN IMMEDIATE), so two writers never deadlock
+upgrading a read lock.
+
+Jobs that deliver many files at once use Dataflow.deliver_many and
+obtain_many.  These copy the files in a pool of threads and record
+all of them in one transaction.
+
+A Dataflow may keep delivered files in a BlobStore, which stores each
+distinct file once and links slot locations to it.  The messages
+table records the blob of each message, so collect_garbage can delete
+blobs that no remaining cycle uses.  The store's directory is saved
+in the database, so every job that opens it uses the same store.
+
+Connections are reused: all Dataflow objects for one file in one
+thread of one process share a connection.  Every query is a constant
+string, so the sqlite3 module's per-connection statement cache
+prepares each one only once."""
+
+f'This module requires python 3.6 or newer.'
+
+import os, json, stat, time, sqlite3, logging, datetime, threading, \
+       tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from crow.tools import typecheck, to_timedelta, deliver_file
+from crow.dataflow.exceptions import *
+from crow.dataflow.blobs import BlobStore, GC_MIN_AGE
+
+__all__=[ 'Dataflow', 'Slot', 'InputSlot', 'OutputSlot', 'Message',
+          'InputMessage', 'OutputMessage', 'BUSY_TIMEOUT',
+          'STATEMENT_CACHE_SIZE', 'MAX_COPY_THREADS' ]
+
+_logger=logging.getLogger('crow.dataflow')
+
+## Seconds a connection waits for another writer before failing
+BUSY_TIMEOUT=600
+
+## Number of prepared statements kept per connection
+STATEMENT_CACHE_SIZE=256
+
+## Most files copied at once by the bulk delivery methods
+MAX_COPY_THREADS=16
+
+SCHEMA_VERSION=2
+
+_EPOCH=datetime.datetime(1970,1,1)
+
+########################################################################
+
+_SCHEMA=[
+'''CREATE TABLE IF NOT EXISTS crow_dataflow_info (
+     name TEXT PRIMARY KEY,
+     value TEXT NOT NULL )''',
+'''CREATE TABLE IF NOT EXISTS slots (
+     pk INTEGER PRIMARY KEY,
+     flow TEXT NOT NULL CHECK ( flow IN ( 'I', 'O' ) ),
+     actor TEXT NOT NULL,
+     slot TEXT NOT NULL,
+     location TEXT,
+     UNIQUE ( actor, slot, flow ) )''',
+'''CREATE INDEX IF NOT EXISTS slots_by_name ON slots ( slot, flow )''',
+'''CREATE TABLE IF NOT EXISTS slot_meta (
+     slot INTEGER NOT NULL REFERENCES slots ( pk ) ON DELETE CASCADE,
+     name TEXT NOT NULL,
+     value TEXT NOT NULL,
+     is_list INTEGER NOT NULL DEFAULT 0,
+     PRIMARY KEY ( slot, name ) )''',
+'''CREATE INDEX IF NOT EXISTS slot_meta_by_value
+     ON slot_meta ( name, value, is_list )''',
+'''CREATE TABLE IF NOT EXISTS connections (
+     input INTEGER PRIMARY KEY REFERENCES slots ( pk ) ON DELETE CASCADE,
+     output INTEGER NOT NULL REFERENCES slots ( pk ) ON DELETE CASCADE,
+     rel_time REAL NOT NULL DEFAULT 0 )''',
+'''CREATE INDEX IF NOT EXISTS connections_by_output
+     ON connections ( output )''',
+'''CREATE TABLE IF NOT EXISTS messages (
+     cycle INTEGER NOT NULL,
+     actor TEXT NOT NULL,
+     slot TEXT NOT NULL,
+     flow TEXT NOT NULL,
+     meta TEXT NOT NULL,
+     output INTEGER NOT NULL REFERENCES slots ( pk ) ON DELETE CASCADE,
+     location TEXT NOT NULL,
+     available REAL,
+     blob TEXT,
+     PRIMARY KEY ( cycle, actor, slot, flow, meta ) )''',
+'''CREATE INDEX IF NOT EXISTS messages_by_output
+     ON messages ( output, cycle )''',
+]
+
+_GET_INFO='SELECT value FROM crow_dataflow_info WHERE name=?'
+_SET_INFO='INSERT OR REPLACE INTO crow_dataflow_info ( name, value ) ' \
+          'VALUES ( ?, ? )'
+
+_GET_SLOT='SELECT pk, flow, actor, slot, location FROM slots ' \
+          'WHERE actor=? AND slot=? AND flow=?'
+_GET_SLOT_BY_PK='SELECT pk, flow, actor, slot, location FROM slots ' \
+                'WHERE pk=?'
+_ADD_SLOT='INSERT INTO slots ( flow, actor, slot, location ) ' \
+          'VALUES ( ?, ?, ?, ? )'
+_UPDATE_SLOT='UPDATE slots SET location=? WHERE pk=?'
+_DEL_META='DELETE FROM slot_meta WHERE slot=?'
+_ADD_META='INSERT INTO slot_meta ( slot, name, value, is_list ) ' \
+          'VALUES ( ?, ?, ?, ? )'
+_GET_META='SELECT name, value FROM slot_meta WHERE slot=? ORDER BY name'
+_ALL_OUTPUTS='SELECT pk, flow, actor, slot, location FROM slots ' \
+             "WHERE flow='O' ORDER BY actor, slot"
+_ALL_SLOTS='SELECT pk, flow, actor, slot, location FROM slots ' \
+           'ORDER BY flow DESC, actor, slot'
+
+_CONNECT='INSERT OR REPLACE INTO connections ( input, output, rel_time ) ' \
+         'VALUES ( ?, ?, ? )'
+_GET_CONNECTION='SELECT output, rel_time FROM connections WHERE input=?'
+
+_ADD_MESSAGE='INSERT OR IGNORE INTO messages ( cycle, actor, slot, flow, ' \
+             'meta, output, location, available ) ' \
+             "VALUES ( ?, ?, ?, 'O', ?, ?, ?, NULL )"
+_SET_AVAILABLE='UPDATE messages SET available=?, blob=? WHERE cycle=? AND ' \
+               "actor=? AND slot=? AND flow='O' AND meta=?"
+_GET_AVAILABLE='SELECT available FROM messages WHERE cycle=? AND ' \
+               "actor=? AND slot=? AND flow='O' AND meta=?"
+_DEL_CYCLE='DELETE FROM messages WHERE cycle=?'
+_ALL_MESSAGES='SELECT cycle, actor, slot, flow, meta, location, ' \
+              'available, blob FROM messages ORDER BY cycle, actor, slot, meta'
+_ALL_BLOBS='SELECT DISTINCT blob FROM messages WHERE blob IS NOT NULL'
+
+## Changes from each schema version to the next
+_MIGRATIONS={
+    1: [ 'ALTER TABLE messages ADD COLUMN blob TEXT' ],
+}
+
+########################################################################
+
+_CONNECTIONS=dict()
+_CONNECTIONS_LOCK=threading.Lock()
+
+def _connect(filename,timeout):
+    """!Returns the connection to filename for this thread and process,
+    opening it and creating the schema if needed."""
+    key=( os.path.abspath(filename), os.getpid(), threading.get_ident() )
+    with _CONNECTIONS_LOCK:
+        con=_CONNECTIONS.get(key,None)
+        if con is not None: return con
+    con=sqlite3.connect(filename,timeout=timeout,isolation_level=None,
+                        cached_statements=STATEMENT_CACHE_SIZE)
+    con.execute(f'PRAGMA busy_timeout={int(timeout*1000)}')
+    mode=con.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    if mode.lower()!='wal':
+        _logger.warning(f'{filename}: cannot use write-ahead logging; '
+                        f'journal mode is {mode}')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('PRAGMA foreign_keys=ON')
+    with _transaction(con):
+        for statement in _SCHEMA:
+            con.execute(statement)
+        row=con.execute(_GET_INFO,('schema_version',)).fetchone()
+        version=SCHEMA_VERSION if row is None else int(row[0])
+        while version in _MIGRATIONS:
+            _logger.info(f'{filename}: upgrade dataflow schema from '
+                         f'version {version}')
+            for statement in _MIGRATIONS[version]:
+                con.execute(statement)
+            version+=1
+        if version!=SCHEMA_VERSION:
+            raise DataflowError(f'{filename}: dataflow schema version '
+                                f'{row[0]} is not {SCHEMA_VERSION}')
+        con.execute(_SET_INFO,('schema_version',str(SCHEMA_VERSION)))
+    with _CONNECTIONS_LOCK:
+        _CONNECTIONS[key]=con
+    return con
+
+@contextmanager
+def _transaction(con):
+    """!Runs the body in a write transaction, which takes the database
+    lock immediately.  Rolls back on exceptions."""
+    con.execute('BEGIN IMMEDIATE')
+    try:
+        yield con
+    except BaseException:
+        con.execute('ROLLBACK')
+        raise
+    con.execute('COMMIT')
+
+def _obtain_file(location,filename):
+    """!Copies delivered data to a local file that its owner can write.
+    Blob store files are read-only, and deliver_file keeps their
+    permissions."""
+    deliver_file(location,filename)
+    mode=os.stat(filename).st_mode
+    if not mode&stat.S_IWUSR:
+        os.chmod(filename,mode|stat.S_IWUSR)
+
+def _copy_all(copies,max_workers):
+    """!Runs each (function,source,destination) in a thread pool.
+    Returns a list with the function's result for each copy that
+    worked, and the exception for each one that failed."""
+    def copy(args):
+        function,source,destination=args
+        try:
+            return function(source,destination)
+        except (OSError,DataflowError) as e:
+            _logger.error(f'{source} => {destination}: {e}')
+            return e
+    if not copies: return []
+    workers=max(1,min(len(copies),max_workers or MAX_COPY_THREADS))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(copy,copies))
+
+def _cycle_key(cycle):
+    if not isinstance(cycle,datetime.datetime):
+        raise TypeError(f'cycle must be a datetime, not a '
+                        f'{type(cycle).__name__}')
+    if cycle.tzinfo is not None:
+        cycle=cycle.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return int((cycle-_EPOCH).total_seconds())
+
+def _cycle_from_key(key):
+    return _EPOCH+datetime.timedelta(seconds=key)
+
+def _meta_key(meta):
+    return json.dumps(meta,sort_keys=True)
+
+def _check_meta(meta):
+    result=OrderedDict()
+    for name in sorted(meta):
+        value=meta[name]
+        if isinstance(value,Sequence) and not isinstance(value,str):
+            value=list(value)
+            items=value
+        else:
+            items=[ value ]
+        for item in items:
+            if type(item) not in [ int, float, bool, str ]:
+                raise TypeError(f'{name}: metadata must be int, float, bool, '
+                                f'str, or a list of them; not a '
+                                f'{type(item).__name__}')
+        result[name]=value
+    return result
+
+def _expand_meta(meta):
+    """!Iterates over every combination of the values of list-valued
+    metadata, yielding dicts of scalar metadata."""
+    meta=dict(meta)
+    for name in sorted(meta):
+        if isinstance(meta[name],list):
+            for value in meta[name]:
+                yield from _expand_meta(dict(meta,**{name:value}))
+            return
+    yield meta
+
+def _matches(meta,search):
+    for name,value in search.items():
+        if name not in meta: return False
+        have=meta[name]
+        if isinstance(have,list):
+            if value not in have: return False
+        elif have!=value:
+            return False
+    return True
+
+########################################################################
+
+class Slot(object):
+    """!An input or output slot of an actor, as stored in a Dataflow.
+    Slots are created by Dataflow methods, not directly."""
+    def __init__(self,dataflow,pk,flow,actor,slot,location):
+        self.dataflow=dataflow
+        self.pk=pk
+        self.flow=flow
+        self.actor=actor
+        self.slot=slot
+        self.location=location
+        self.__meta=None
+
+    def get_meta(self):
+        """!The slot's metadata, as a dict.  List values mean the slot
+        has one message per item."""
+        if self.__meta is None:
+            self.__meta={ name:json.loads(value) for name,value in
+                          self.dataflow._execute(_GET_META,(self.pk,)) }
+        return dict(self.__meta)
+
+    def __eq__(self,other):
+        return isinstance(other,Slot) and other.pk==self.pk and \
+            other.dataflow.filename==self.dataflow.filename
+    def __hash__(self):
+        return hash((self.pk,self.dataflow.filename))
+
+    def __str__(self):
+        return f'{self.flow}:{self.actor}.{self.slot}'
+    def __repr__(self):
+        return f'{type(self).__name__}({self.actor!r},{self.slot!r},' \
+               f'meta={self.get_meta()!r})'
+
+class OutputSlot(Slot):
+    """!A slot whose actor delivers data.  The location is a str.format
+    template for the file that holds each message, with the cycle,
+    actor, slot, and metadata as arguments."""
+    def at(self,cycle,meta=None):
+        """!The OutputMessage of this slot at the given cycle.  The meta
+        picks one value of each list in the slot's metadata."""
+        return OutputMessage(self,cycle,meta)
+
+class InputSlot(Slot):
+    """!A slot whose actor obtains data from a connected output slot."""
+    def __init__(self,*args):
+        super().__init__(*args)
+        self.__output=None
+
+    def connect_to(self,output,rel_time=None):
+        """!Makes this slot read the given OutputSlot, rel_time (a
+        timedelta or anything to_timedelta accepts) from this slot's
+        cycle."""
+        typecheck('output',output,OutputSlot)
+        rel_time=to_timedelta(rel_time) if rel_time else datetime.timedelta()
+        self.dataflow._write(_CONNECT,( self.pk, output.pk,
+                                        rel_time.total_seconds() ))
+        self.__output=None
+
+    def get_output_slot(self):
+        """!Returns (OutputSlot,rel_time) for the connected output slot,
+        or (None,None) if there is none."""
+        if self.__output is None:
+            row=self.dataflow._execute(_GET_CONNECTION,(self.pk,)).fetchone()
+            if row is None: return None,None
+            output=self.dataflow._slot_from_row(
+                self.dataflow._execute(_GET_SLOT_BY_PK,(row[0],)).fetchone())
+            self.__output=( output, datetime.timedelta(seconds=row[1]) )
+        return self.__output
+
+    def at(self,cycle,meta=None):
+        """!The InputMessage of this slot at the given cycle."""
+        return InputMessage(self,cycle,meta)
+
+########################################################################
+
+class Message(object):
+    """!The data of one slot at one cycle.  If the slot's metadata has
+    lists, and no meta was given to pick one value from each, the
+    message stands for all of them; use expand() to get each one."""
+    def __init__(self,slot,cycle,meta=None):
+        self.slot_object=slot
+        self.cycle=cycle
+        self.__meta=slot.get_meta()
+        if meta:
+            for name,value in meta.items():
+                if name not in self.__meta:
+                    raise NoSuchSlot(f'{slot}: no metadata {name}')
+                have=self.__meta[name]
+                if isinstance(have,list) and value not in have or \
+                   not isinstance(have,list) and value!=have:
+                    raise NoSuchSlot(f'{slot}: {name}={value!r} is not '
+                                     f'one of its values')
+                self.__meta[name]=value
+
+    flow=property(lambda self: self.slot_object.flow)
+    actor=property(lambda self: self.slot_object.actor)
+    slot=property(lambda self: self.slot_object.slot)
+    dataflow=property(lambda self: self.slot_object.dataflow)
+
+    def get_meta(self):
+        return dict(self.__meta)
+
+    def is_ambiguous(self):
+        return any([ isinstance(v,list) for v in self.__meta.values() ])
+
+    def expand(self):
+        """!Iterates over a message for each combination of metadata
+        values."""
+        for meta in _expand_meta(self.__meta):
+            yield type(self)(self.slot_object,self.cycle,meta)
+
+    def _check_unique(self):
+        if self.is_ambiguous():
+            raise AmbiguousMessage(f'{self}: metadata has lists; pick one '
+                                   'value of each, or use expand()')
+
+    def __str__(self):
+        meta=' '.join([ f'{k}={v!r}' for k,v in sorted(self.__meta.items()) ])
+        return f'{self.slot_object}@{self.cycle:%Y-%m-%dt%H:%M:%S}' + \
+               (f' {meta}' if meta else '')
+    def __repr__(self):
+        return f'{type(self).__name__}({str(self)!r})'
+
+class OutputMessage(Message):
+    def location(self):
+        """!Path of the file that holds this message's data"""
+        self._check_unique()
+        return self.slot_object.location.format(
+            cycle=self.cycle,actor=self.actor,slot=self.slot,
+            **self.get_meta())
+
+    def _key(self):
+        return ( _cycle_key(self.cycle), self.actor, self.slot,
+                 _meta_key(self.get_meta()) )
+
+    def availability_time(self):
+        """!Time (seconds since the epoch) at which the data was
+        delivered, or None if it has not been"""
+        self._check_unique()
+        row=self.dataflow._execute(_GET_AVAILABLE,self._key()).fetchone()
+        return row[0] if row else None
+
+    def _mark_available(self,con,when,blob=None):
+        cycle,actor,slot,meta=self._key()
+        con.execute(_ADD_MESSAGE,( cycle, actor, slot, meta,
+                                   self.slot_object.pk, self.location() ))
+        con.execute(_SET_AVAILABLE,( when, blob, cycle, actor, slot, meta ))
+
+    def set_available(self,when=None,blob=None):
+        """!Records that the data is in location(), at time when
+        (default: now).  The blob is the digest of the data in the
+        dataflow's BlobStore, if location() links to one."""
+        self._check_unique()
+        when=time.time() if when is None else when
+        with self.dataflow._write_transaction() as con:
+            self._mark_available(con,when,blob)
+
+    def deliver(self,filename):
+        """!Copies a local file to location() with deliver_file, or
+        through the dataflow's BlobStore if it has one, and marks the
+        data available."""
+        blobs=self.dataflow.blob_store
+        if blobs is not None:
+            self.set_available(blob=blobs.deliver(filename,self.location()))
+            return
+        deliver_file(filename,self.location(),
+                     hardlink=self.dataflow.hardlink)
+        self.set_available()
+
+    @contextmanager
+    def open(self,mode='rb'):
+        """!Context manager that opens the data.  Reading opens
+        location().  Writing ('w' or 'wb') goes to a temporary file,
+        which replaces location() and is marked available when the
+        with block ends without an exception."""
+        location=self.location()
+        if 'w' not in mode:
+            with open(location,mode) as fd:
+                yield fd
+            return
+        dirname=os.path.dirname(os.path.abspath(location))
+        os.makedirs(dirname,exist_ok=True)
+        fd=tempfile.NamedTemporaryFile(
+            mode,dir=dirname,prefix=os.path.basename(location)+'.',
+            delete=False)
+        blob=None
+        try:
+            with fd:
+                yield fd
+            if self.dataflow.blob_store is None:
+                os.replace(fd.name,location)
+            else:
+                blob=self.dataflow.blob_store.deliver(fd.name,location)
+        finally:
+            if os.path.exists(fd.name): os.unlink(fd.name)
+        self.set_available(blob=blob)
+
+class InputMessage(Message):
+    def output_message(self):
+        """!The OutputMessage this input reads: the connected output
+        slot at this cycle plus the connection's offset, with the
+        metadata the two slots share."""
+        self._check_unique()
+        output,rel_time=self.slot_object.get_output_slot()
+        if output is None:
+            raise NoSuchSlot(f'{self.slot_object}: not connected to an '
+                             'output slot')
+        out_meta=output.get_meta()
+        meta={ k:v for k,v in self.get_meta().items() if k in out_meta }
+        return output.at(self.cycle+rel_time,meta)
+
+    def availability_time(self):
+        return self.output_message().availability_time()
+
+    def location(self):
+        return self.output_message().location()
+
+    def obtain(self,filename):
+        """!Copies the data to a local file.
+
+        @raise DataNotAvailable if it has not been delivered"""
+        output=self.output_message()
+        if not output.availability_time():
+            raise DataNotAvailable(f'{self}: {output} is not available')
+        _obtain_file(output.location(),filename)
+
+    @contextmanager
+    def open(self,mode='rb'):
+        """!Context manager that opens the data for reading.
+
+        @raise DataNotAvailable if it has not been delivered"""
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise DataflowError(f'{self}: input messages are read-only')
+        output=self.output_message()
+        if not output.availability_time():
+            raise DataNotAvailable(f'{self}: {output} is not available')
+        with output.open(mode) as fd:
+            yield fd
+
+########################################################################
+
+class Dataflow(object):
+    """!The dataflow database of a workflow: its slots, their
+    connections, and the messages delivered to them.
+
+    @param filename the SQLite database file; created if missing
+    @param timeout seconds to wait for other writers
+    @param hardlink if True, delivered files on the same filesystem
+      as their location are hard linked instead of copied.  Only safe
+      when jobs do not modify files after delivering them.
+    @param blob_store a BlobStore or directory that holds delivered
+      files instead of their locations.  Default: the one given to
+      use_blob_store, if any."""
+    def __init__(self,filename,timeout=BUSY_TIMEOUT,hardlink=False,
+                 blob_store=None):
+        self.filename=filename
+        self.timeout=timeout
+        self.hardlink=bool(hardlink)
+        self._con()
+        if blob_store is None:
+            directory=self._get_info('blob_store')
+            if directory:
+                blob_store=BlobStore(directory,
+                                     self._get_info('blob_link'))
+        elif not isinstance(blob_store,BlobStore):
+            blob_store=BlobStore(blob_store)
+        self.blob_store=blob_store
+
+    def _con(self):
+        return _connect(self.filename,self.timeout)
+
+    def _execute(self,sql,args=()):
+        return self._con().execute(sql,args)
+
+    def _write_transaction(self):
+        return _transaction(self._con())
+
+    def _write(self,sql,args=()):
+        with self._write_transaction() as con:
+            return con.execute(sql,args)
+
+    def _get_info(self,name):
+        row=self._execute(_GET_INFO,(name,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        """!Closes this thread's connection to the database.  Other
+        Dataflow objects for the same file will reopen it."""
+        key=( os.path.abspath(self.filename), os.getpid(),
+              threading.get_ident() )
+        with _CONNECTIONS_LOCK:
+            con=_CONNECTIONS.pop(key,None)
+        if con is not None:
+            con.close()
+
+    def _slot_from_row(self,row):
+        pk,flow,actor,slot,location=row
+        cls=OutputSlot if flow=='O' else InputSlot
+        return cls(self,pk,flow,actor,slot,location)
+
+    # ------------------------------------------------------------------
+    # Slots
+
+    def _add_slot(self,flow,actor,slot,location,meta):
+        meta=_check_meta(meta or {})
+        with self._write_transaction() as con:
+            row=con.execute(_GET_SLOT,(actor,slot,flow)).fetchone()
+            if row is None:
+                pk=con.execute(_ADD_SLOT,(flow,actor,slot,location)).lastrowid
+            else:
+                pk=row[0]
+                con.execute(_UPDATE_SLOT,(location,pk))
+                con.execute(_DEL_META,(pk,))
+            for name,value in meta.items():
+                con.execute(_ADD_META,( pk, name, json.dumps(value),
+                                        int(isinstance(value,list)) ))
+        return self._slot_from_row((pk,flow,actor,slot,location))
+
+    def add_output_slot(self,actor,slot,location,meta=None):
+        """!Adds or replaces an output slot.
+
+        @param actor the actor's path, like "family.task"
+        @param slot the slot name
+        @param location str.format template of the data files
+        @param meta metadata dict; values are int, float, bool, str,
+          or lists of them"""
+        return self._add_slot('O',actor,slot,str(location),meta)
+
+    def add_input_slot(self,actor,slot,meta=None):
+        """!Adds or replaces an input slot.  See add_output_slot."""
+        return self._add_slot('I',actor,slot,None,meta)
+
+    def get_slot(self,flow,actor,slot):
+        """!Returns the slot, or raises NoSuchSlot."""
+        row=self._execute(_GET_SLOT,(actor,slot,flow)).fetchone()
+        if row is None:
+            raise NoSuchSlot(f'{flow}:{actor}.{slot}: no such slot')
+        return self._slot_from_row(row)
+
+    def _find_slot(self,flow,actor,slot,meta):
+        sql='SELECT pk, flow, actor, slot, location FROM slots WHERE flow=?'
+        args=[ flow ]
+        if actor:
+            sql+=' AND actor=?'
+            args.append(actor)
+        if slot:
+            sql+=' AND slot=?'
+            args.append(slot)
+        meta=meta or {}
+        for name in sorted(meta):
+            # Scalars are found in the index; lists are checked below.
+            sql+=' AND pk IN ( SELECT slot FROM slot_meta WHERE name=? ' \
+                 'AND ( value=? OR is_list=1 ) )'
+            args.extend([ name, json.dumps(meta[name]) ])
+        sql+=' ORDER BY actor, slot'
+        for row in self._execute(sql,args).fetchall():
+            found=self._slot_from_row(row)
+            if _matches(found.get_meta(),meta):
+                yield found
+
+    def find_output_slot(self,actor=None,slot=None,meta=None):
+        """!Iterates over output slots that match the actor and slot
+        names, if given, and have all of the metadata values in meta."""
+        return self._find_slot('O',actor,slot,meta)
+
+    def find_input_slot(self,actor=None,slot=None,meta=None):
+        """!Iterates over input slots.  See find_output_slot."""
+        return self._find_slot('I',actor,slot,meta)
+
+    # ------------------------------------------------------------------
+    # Bulk delivery
+
+    def availability_times(self,messages):
+        """!Returns the availability_time() of each InputMessage or
+        OutputMessage, all read in one transaction so they are
+        consistent with each other."""
+        outputs=[ m.output_message() if isinstance(m,InputMessage) else m
+                  for m in messages ]
+        for output in outputs: output._check_unique()
+        con=self._con()
+        con.execute('BEGIN')
+        try:
+            rows=[ con.execute(_GET_AVAILABLE,output._key()).fetchone()
+                   for output in outputs ]
+        finally:
+            con.execute('COMMIT')
+        return [ row[0] if row else None for row in rows ]
+
+    def deliver_many(self,cycle,deliveries,max_workers=None):
+        """!Delivers many local files at once.  The files are copied
+        with deliver_file by a pool of threads, and then all copies that
+        worked are marked available in one transaction.
+
+        @param cycle the cycle of the messages
+        @param deliveries list of (OutputSlot, meta, local path), where
+          meta picks one value of each list in the slot's metadata
+        @param max_workers most files to copy at once (default:
+          MAX_COPY_THREADS)
+        @returns the list of OutputMessage objects
+        @raise DataflowError after marking the rest available, if any
+          copy failed"""
+        messages=list()
+        copies=list()
+        for slot,meta,local in deliveries:
+            typecheck('slot',slot,OutputSlot)
+            message=slot.at(cycle,meta)
+            message._check_unique()
+            messages.append(message)
+            if self.blob_store is not None:
+                copy=self.blob_store.deliver
+            else:
+                copy=partial(deliver_file,hardlink=self.hardlink)
+            copies.append(( copy, local, message.location() ))
+        results=_copy_all(copies,max_workers)
+        blobs=self.blob_store is not None
+        when=time.time()
+        with self._write_transaction() as con:
+            for message,result in zip(messages,results):
+                if not isinstance(result,Exception):
+                    message._mark_available(con,when,
+                                            result if blobs else None)
+        failed=[ result for result in results
+                 if isinstance(result,Exception) ]
+        _logger.info(f'{self.filename}: delivered '
+                     f'{len(messages)-len(failed)} of {len(messages)} files')
+        if failed:
+            raise DataflowError(f'{len(failed)} of {len(messages)} '
+                                f'deliveries failed; first: {failed[0]}') \
+                                from failed[0]
+        return messages
+
+    def obtain_many(self,obtains,max_workers=None):
+        """!Copies the data of many InputMessages to local files at
+        once, with a pool of threads.
+
+        @param obtains list of (InputMessage, local path)
+        @param max_workers most files to copy at once
+        @raise DataNotAvailable before copying anything, if any message
+          is not available
+        @raise DataflowError if any copy failed"""
+        obtains=list(obtains)
+        missing=[ message for (message,local),when in zip(
+            obtains,self.availability_times([ m for m,l in obtains ]))
+                  if not when ]
+        if missing:
+            raise DataNotAvailable(f'{len(missing)} messages are not '
+                                   f'available; first: {missing[0]}')
+        results=_copy_all([ ( _obtain_file, message.location(), local )
+                            for message,local in obtains ],max_workers)
+        failed=[ result for result in results
+                 if isinstance(result,Exception) ]
+        if failed:
+            raise DataflowError(f'{len(failed)} of {len(obtains)} copies '
+                                f'failed; first: {failed[0]}') from failed[0]
+
+    # ------------------------------------------------------------------
+    # Suites
+
+    def add_slot_view(self,view):
+        """!Adds the slot described by an InputSlotView or OutputSlotView
+        from crow.config.  An input slot is connected to the output slot
+        its Out message refers to, which must already be in the
+        database.  Returns the Slot."""
+        from crow.config.tasks import SlotView, InputSlotView, \
+             OutputSlotView, SLOT_SPECIALS
+        typecheck('view',view,SlotView)
+        meta=dict()
+        for name in view:
+            if name in SLOT_SPECIALS: continue
+            value=view[name]
+            if type(value) in [ int, float, bool, str ]:
+                meta[name]=value
+            elif isinstance(value,Sequence) and not isinstance(value,str) \
+                 and all([ type(v) in [ int, float, bool, str ]
+                           for v in value ]):
+                meta[name]=list(value)
+        actor=view.get_actor_path()
+        name=view.get_slot_name()
+        if isinstance(view,OutputSlotView):
+            return self.add_output_slot(actor,name,view.get_slot_location(),
+                                        meta)
+        result=self.add_input_slot(actor,name,meta)
+        output=view.get_output_slot(meta)
+        if isinstance(output,OutputSlotView):
+            rel_time=output.path[0]-view.path[0]
+            result.connect_to(self.get_slot('O',output.get_actor_path(),
+                                            output.get_slot_name()),rel_time)
+        else:
+            _logger.warning(f'{result}: Out is a {type(output).__name__}, '
+                            'not an output slot; not connected')
+        return result
+
+    def add_suite(self,suite):
+        """!Adds all slots in a Suite or other SuiteView, output slots
+        first so input slots can be connected to them.  Returns the
+        number of slots added."""
+        from crow.config import SuiteView
+        typecheck('suite',suite,SuiteView)
+        views=[ view for view in suite.walk_task_tree()
+                if view.is_output_slot() or view.is_input_slot() ]
+        views.sort(key=lambda view: not view.is_output_slot())
+        for view in views:
+            self.add_slot_view(view)
+        return len(views)
+
+    # ------------------------------------------------------------------
+    # Cycles
+
+    def add_cycle(self,cycle):
+        """!Adds a record, not yet available, for each message of each
+        output slot at the given cycle."""
+        key=_cycle_key(cycle)
+        outputs=[ self._slot_from_row(row) for row in
+                  self._execute(_ALL_OUTPUTS).fetchall() ]
+        with self._write_transaction() as con:
+            for output in outputs:
+                for message in output.at(cycle).expand():
+                    con.execute(_ADD_MESSAGE,(
+                        key, output.actor, output.slot,
+                        _meta_key(message.get_meta()), output.pk,
+                        message.location() ))
+
+    def del_cycle(self,cycle):
+        """!Deletes all message records of the given cycle.  Their
+        blobs stay in the BlobStore until collect_garbage."""
+        self._write(_DEL_CYCLE,(_cycle_key(cycle),))
+
+    # ------------------------------------------------------------------
+    # Blob store
+
+    def use_blob_store(self,directory,link='hardlink'):
+        """!Makes this and all later Dataflow objects for this database
+        deliver files through a BlobStore in the given directory.
+        Files already delivered are unchanged.
+
+        @param link "hardlink" or "symlink": how slot locations refer
+          to blobs"""
+        blob_store=BlobStore(directory,link)
+        with self._write_transaction() as con:
+            con.execute(_SET_INFO,('blob_store',blob_store.directory))
+            con.execute(_SET_INFO,('blob_link',blob_store.link))
+        self.blob_store=blob_store
+        return blob_store
+
+    def collect_garbage(self,min_age=GC_MIN_AGE,dry_run=False):
+        """!Deletes blobs that no message in the database uses, such
+        as those of cycles removed by del_cycle.  See BlobStore.gc.
+
+        @returns the list of deleted digests"""
+        if self.blob_store is None:
+            raise DataflowError(f'{self.filename}: no blob store')
+        referenced=[ row[0] for row in self._execute(_ALL_BLOBS) ]
+        return self.blob_store.gc(referenced,min_age,dry_run)
+
+    def dump(self,fd):
+        """!Writes a human-readable listing of the database to fd."""
+        for row in self._execute(_ALL_SLOTS).fetchall():
+            slot=self._slot_from_row(row)
+            fd.write(f'{slot} meta={slot.get_meta()!r}')
+            if slot.flow=='O':
+                fd.write(f' location={slot.location!r}\n')
+            else:
+                output,rel_time=slot.get_output_slot()
+                fd.write(f' from {output} at {rel_time}\n')
+        for cycle,actor,slot,flow,meta,location,available,blob in \
+                self._execute(_ALL_MESSAGES).fetchall():
+            when='not available' if not available else \
+                datetime.datetime.fromtimestamp(available).strftime(
+                    'available %Y-%m-%dt%H:%M:%S')
+            fd.write(f'{flow}:{actor}.{slot}@'
+                     f'{_cycle_from_key(cycle):%Y-%m-%dt%H:%M:%S} '
+                     f'meta={meta} {location} {when}'
+                     + (f' blob={blob}' if blob else '') + '\n')
@@ -0,0 +1,222 @@
+"""!Waits for messages to become available.
+
+The wait_for function blocks until every message is delivered.  It
+re-reads the availability from the database only when another
+connection has changed the database, which the database reports
+through PRAGMA data_version.  Between reads it sleeps, waking early
+when inotify reports a change to the database (its write-ahead log)
+or a file finished in a directory data is delivered to.  Hence a
+delivery on the same node is seen almost at once, and waiting jobs
+cost almost nothing while nothing changes.  A burst of events, such
+as a delivery's file and database writes, causes one re-read once the
+events stop, or after min_interval if they do not.
+
+Where inotify is unavailable (not Linux, or too many watches), and
+for changes made on other nodes of a parallel filesystem, which
+inotify cannot see, the sleep between checks grows exponentially from
+min_interval to max_interval."""
+
+f'This module requires python 3.6 or newer.'
+
+import os, time, errno, select, logging, ctypes, ctypes.util
+from contextlib import suppress
+
+from crow.dataflow.exceptions import *
+from crow.dataflow.store import Slot, Message, InputMessage
+
+__all__=[ 'wait_for', 'MIN_INTERVAL', 'MAX_INTERVAL', 'SETTLE_INTERVAL' ]
+
+_logger=logging.getLogger('crow.dataflow')
+
+## Seconds to wait before the first re-check
+MIN_INTERVAL=0.5
+
+## Longest wait, in seconds, between checks
+MAX_INTERVAL=30
+
+# Events from inotify(7)
+_IN_MODIFY=0x2
+_IN_CLOSE_WRITE=0x8
+_IN_MOVED_TO=0x80
+_IN_CREATE=0x100
+
+## Events in the database directory: any write to the database or
+## its write-ahead log
+_DATABASE_MASK=_IN_MODIFY|_IN_CLOSE_WRITE|_IN_MOVED_TO|_IN_CREATE
+
+## Events in a delivery directory: a file is complete.  Deliveries
+## rename a finished file into place, so partial writes are ignored.
+_OUTPUT_MASK=_IN_CLOSE_WRITE|_IN_MOVED_TO
+
+## Seconds without events after which a burst of events is over
+SETTLE_INTERVAL=0.05
+
+class _Inotify(object):
+    """!Minimal inotify wrapper through ctypes.  Only reports whether
+    any watched directory changed.
+
+    @raise OSError if inotify is not available"""
+    def __init__(self):
+        try:
+            libc=ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+            self._add_watch=libc.inotify_add_watch
+            init=libc.inotify_init1
+        except (OSError,AttributeError) as e:
+            raise OSError(errno.ENOSYS,f'no inotify: {e}')
+        self._add_watch.argtypes=[ ctypes.c_int, ctypes.c_char_p,
+                                   ctypes.c_uint32 ]
+        self.fd=init(os.O_NONBLOCK|os.O_CLOEXEC)
+        if self.fd<0:
+            code=ctypes.get_errno()
+            raise OSError(code,f'inotify_init1: {os.strerror(code)}')
+        self.watched=dict()
+
+    def watch(self,directory,mask):
+        """!Watches the directory for the events in mask.  If the
+        directory does not exist yet, its nearest existing parent is
+        watched for the creation of subdirectories instead."""
+        directory=os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            mask=_IN_CREATE
+            while not os.path.isdir(directory) and \
+                  os.path.dirname(directory)!=directory:
+                directory=os.path.dirname(directory)
+        old=self.watched.get(directory,0)
+        mask|=old
+        if mask==old: return
+        # A new watch of a watched directory replaces its mask.
+        if self._add_watch(self.fd,os.fsencode(directory),mask)<0:
+            code=ctypes.get_errno()
+            raise OSError(code,f'{directory}: inotify_add_watch: '
+                          f'{os.strerror(code)}')
+        self.watched[directory]=mask
+
+    def wait(self,timeout):
+        """!Sleeps until a watched directory changes, or for timeout
+        seconds.  Returns True if something changed."""
+        ready=select.select([ self.fd ],[],[],max(0,timeout))[0]
+        if not ready: return False
+        with suppress(BlockingIOError):
+            while os.read(self.fd,65536): pass
+        return True
+
+    def settle(self,quiet,longest):
+        """!Discards events until none arrive for quiet seconds, or
+        until longest seconds have passed."""
+        end=time.monotonic()+longest
+        while self.wait(min(quiet,end-time.monotonic())):
+            if time.monotonic()>=end: return
+
+    def close(self):
+        if self.fd>=0:
+            os.close(self.fd)
+            self.fd=-1
+
+def _expand(items,cycle):
+    messages=list()
+    for item in items:
+        if isinstance(item,Slot):
+            if cycle is None:
+                raise TypeError(f'{item}: give a cycle to wait for slots')
+            messages.extend(item.at(cycle).expand())
+        elif isinstance(item,Message):
+            messages.extend(item.expand())
+        else:
+            raise TypeError(f'can only wait for slots and messages, not '
+                            f'{type(item).__name__}')
+    return messages
+
+def _directories(dataflow,messages):
+    """!The database directory and each delivery directory, as a list
+    of (directory,mask) pairs."""
+    outputs=set()
+    for message in messages:
+        output=message.output_message() \
+            if isinstance(message,InputMessage) else message
+        outputs.add(os.path.dirname(os.path.abspath(output.location())))
+    database=os.path.dirname(os.path.abspath(dataflow.filename))
+    return [ (database,_DATABASE_MASK) ] + \
+        [ (directory,_OUTPUT_MASK) for directory in sorted(outputs) ]
+
+def _watch_all(inotify,directories):
+    """!Watches the (directory,mask) pairs.  Returns inotify, or None
+    if the watches cannot be made."""
+    if inotify is None: return None
+    try:
+        for directory,mask in directories:
+            inotify.watch(directory,mask)
+    except OSError as e:
+        _logger.info(f'{e}: poll instead of using inotify')
+        inotify.close()
+        return None
+    return inotify
+
+def wait_for(items,timeout=None,cycle=None,min_interval=MIN_INTERVAL,
+             max_interval=MAX_INTERVAL,use_inotify=True):
+    """!Blocks until all messages are available.
+
+    @param items a list of InputMessage, OutputMessage, InputSlot or
+      OutputSlot objects from one Dataflow.  A message or slot whose
+      metadata has lists stands for a message with each value.
+    @param timeout most seconds to wait; None means forever
+    @param cycle the cycle of the slots in items
+    @param min_interval,max_interval seconds between checks when no
+      change is seen
+    @param use_inotify if False, only poll
+    @returns the availability time of each message, in the order
+      of the expanded items
+    @raise DataNotAvailable if the timeout passes first"""
+    messages=_expand(items,cycle)
+    if not messages: return []
+    dataflow=messages[0].dataflow
+    if any([ m.dataflow.filename!=dataflow.filename for m in messages ]):
+        raise DataflowError('wait_for: messages are from different '
+                            'dataflow databases')
+    start=time.monotonic()
+    inotify=None
+    if use_inotify:
+        try:
+            inotify=_Inotify()
+        except OSError as e:
+            _logger.info(f'{e}: poll instead of using inotify')
+    try:
+        if inotify is not None:
+            directories=_directories(dataflow,messages)
+            inotify=_watch_all(inotify,directories)
+        delay=min_interval
+        version=None
+        while True:
+            checked=time.monotonic()
+            new_version=dataflow._execute('PRAGMA data_version').fetchone()[0]
+            if new_version!=version:
+                version=new_version
+                times=dataflow.availability_times(messages)
+                missing=sum([ not when for when in times ])
+                if not missing:
+                    return times
+                _logger.debug(f'{dataflow.filename}: waiting for {missing} '
+                              f'of {len(messages)} messages')
+            if timeout is None:
+                sleep=delay
+            else:
+                remaining=timeout-(time.monotonic()-start)
+                if remaining<=0:
+                    first=next(message for message,when in
+                               zip(messages,times) if not when)
+                    raise DataNotAvailable(
+                        f'{missing} of {len(messages)} messages are not '
+                        f'available after {timeout} seconds; first: {first}')
+                sleep=min(delay,remaining)
+            if inotify is None:
+                time.sleep(sleep)
+            elif inotify.wait(sleep):
+                # Re-read once the burst of events is over, but at most
+                # once per min_interval.
+                inotify.settle(SETTLE_INTERVAL,
+                               min(min_interval,sleep)-
+                               (time.monotonic()-checked))
+                # Delivery directories may have been created.
+                inotify=_watch_all(inotify,directories)
+            delay=min(delay*2,max_interval)
+    finally:
+        if inotify is not None: inotify.close()
@@ -1,5 +1,5 @@
-from .rocoto import to_rocoto
+from .rocoto import to_rocoto, write_rocoto
 from .ecflow import to_ecflow
 from .dummy import to_dummy
 
-__all__=[ 'to_rocoto', 'to_ecflow', 'to_dummy' ]
+__all__=[ 'to_rocoto', 'write_rocoto', 'to_ecflow', 'to_dummy' ]
@@ -0,0 +1,476 @@
+"""!Critical-path and makespan analysis of a simplified job graph.
+
+Given a crow.metascheduler.graph.Graph whose cycles have been
+simplified with Graph.simplify_cycle, this module estimates when each
+task can start and finish, which tasks have slack, and which chain of
+tasks bounds each cycle.  Dependencies between cycles are followed as
+long as both cycles were added to the graph; dependencies on cycles
+outside the graph are assumed to be satisfied at the start of the
+analysis.
+
+The analysis assumes every job succeeds on its first try and starts
+as soon as its trigger allows.  Durations come from a table of
+historical runtimes if one is given, or from the walltime in the
+task's resources otherwise.
+
+Times are reported relative to the first analyzed cycle.  Complete
+conditions are ignored since they only ever shorten the workflow.
+Negated dependencies are assumed to be satisfied, and events are
+assumed to be set when the task that sends them completes."""
+
+f'This module requires python 3.6 or newer.'
+
+import json, logging
+from io import StringIO
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+
+from crow.tools import to_timedelta, str_timedelta, typecheck, ZERO_DT
+from crow.metascheduler.graph import Graph, timeless_path, \
+     make_simplified_graph
+from crow.config import AndDependency, OrDependency, StateDependency, \
+          EventDependency, RUNNING, FAILED, FALSE_DEPENDENCY, validate, \
+          invalidate_cache
+
+__all__=[ 'CriticalPathAnalysis', 'TaskTiming', 'critical_path_for_suite' ]
+
+_logger=logging.getLogger('crow')
+
+_FINISH='finish'
+_START='start'
+
+def _task_name(path):
+    return '.'.join([ str(p) for p in path[1:] ])
+
+def _seconds(dt):
+    return None if dt is None else int(dt.total_seconds())
+
+class TaskTiming(object):
+    """!Schedule estimate for one task in one cycle.  All times are
+    datetime.timedelta objects relative to the analysis origin."""
+    def __init__(self,cycle,path,duration,duration_source):
+        self.cycle=cycle
+        self.path=path
+        self.name=_task_name(path)
+        self.duration=duration
+        self.duration_source=duration_source
+        self.earliest_start=None
+        self.earliest_finish=None
+        self.latest_start=None
+        self.latest_finish=None
+        self.binding=list()
+
+    @property
+    def key(self):
+        return (self.cycle,self.path)
+
+    @property
+    def slack(self):
+        if self.latest_start is None: return None
+        return self.latest_start-self.earliest_start
+
+    def is_schedulable(self):
+        return self.earliest_start is not None
+
+    def is_critical(self):
+        return self.slack==ZERO_DT
+
+    def as_dict(self):
+        return OrderedDict([
+            ( 'cycle', self.cycle.strftime('%Y-%m-%dT%H:%M:%S') ),
+            ( 'task', self.name ),
+            ( 'duration', _seconds(self.duration) ),
+            ( 'duration_source', self.duration_source ),
+            ( 'earliest_start', _seconds(self.earliest_start) ),
+            ( 'earliest_finish', _seconds(self.earliest_finish) ),
+            ( 'latest_start', _seconds(self.latest_start) ),
+            ( 'latest_finish', _seconds(self.latest_finish) ),
+            ( 'slack', _seconds(self.slack) ),
+            ( 'critical', self.is_schedulable() and self.is_critical() ) ])
+
+    def __repr__(self):
+        return f'TaskTiming({self.cycle:%Y%m%d%H%M}:{self.name})'
+
+class CriticalPathAnalysis(object):
+    """!Runs a forward and backward pass of the critical path method
+    over all cycles in a simplified Graph.
+
+    @param graph a Graph whose cycles were already simplified
+    @param runtimes optional mapping from task name
+      (ie. "gfs.forecast") to historical runtime: a timedelta, a
+      number of seconds, or a string accepted by to_timedelta
+    @param default_walltime duration used for tasks that have
+      neither a runtime nor a walltime
+    @param realtime if True, no task may start before its own cycle
+      time, as in a real-time workflow."""
+    def __init__(self,graph,runtimes=None,default_walltime=ZERO_DT,
+                 realtime=False):
+        typecheck('graph',graph,Graph)
+        if runtimes is not None:
+            typecheck('runtimes',runtimes,Mapping)
+        self.graph=graph
+        self.runtimes=runtimes if runtimes is not None else dict()
+        self.default_walltime=to_timedelta(default_walltime)
+        self.realtime=bool(realtime)
+        self.cycles=list(graph.each_cycle())
+        self.origin=self.cycles[0] if self.cycles else None
+        self.tasks=OrderedDict()
+        self.unschedulable=list()
+        self.missing_walltimes=list()
+        self.makespan=ZERO_DT
+        self.__cycle_set=set(self.cycles)
+        self.__nodes=dict()
+        self.__family_tasks=defaultdict(list)
+        self.__triggers=dict()
+        self.__resolved=dict()
+        self.__lower_bounds=dict()
+        self.__order=list()
+        self._collect()
+        self._forward_pass()
+        self._backward_pass()
+
+    ####################################################################
+
+    # Graph collection
+
+    def _select_cycle(self,cycle):
+        suite=self.graph.suite
+        invalidate_cache(suite,recurse=True)
+        validate(suite,stage='suite',recurse=True)
+        suite.Clock.now=cycle
+
+    def _collect(self):
+        for cycle in self.cycles:
+            self._select_cycle(cycle)
+            for node in self.graph.top_level_nodes(cycle):
+                self._collect_node(cycle,node,[],ZERO_DT,False)
+        if self.missing_walltimes:
+            _logger.warning(
+                f'{len(self.missing_walltimes)} tasks have no runtime '
+                f'or walltime; assuming {str_timedelta(self.default_walltime)}')
+
+    def _collect_node(self,cycle,node,triggers,time,has_time):
+        key=(cycle,timeless_path(node.path))
+        self.__nodes[key]=node
+        if not node.might_complete() or node.is_always_complete():
+            return
+        triggers=triggers+[node.trigger]
+        if 'Time' in node.view and node.view.Time is not None:
+            time=max(time,node.time) if has_time else node.time
+            has_time=True
+        if node.is_family():
+            for child in node:
+                self._collect_node(cycle,child,triggers,time,has_time)
+                child_key=(cycle,timeless_path(child.path))
+                if child_key in self.tasks:
+                    self.__family_tasks[key].append(child_key)
+                elif child_key in self.__family_tasks:
+                    self.__family_tasks[key].extend(
+                        self.__family_tasks[child_key])
+            return
+        if not node.is_task():
+            return
+        duration,source=self._duration(node)
+        timing=TaskTiming(cycle,key[1],duration,source)
+        self.tasks[key]=timing
+        lower_bound=None
+        if has_time:
+            lower_bound=cycle-self.origin+time
+        elif self.realtime:
+            lower_bound=cycle-self.origin
+        self.__lower_bounds[key]=lower_bound
+        self.__triggers[key]=AndDependency(*triggers)
+
+    def _duration(self,node):
+        name=_task_name(node.path)
+        if name in self.runtimes:
+            return to_timedelta(self.runtimes[name]), 'runtimes'
+        resources=node.view.get('resources',None)
+        if resources:
+            walltime=resources[0].get('walltime','')
+            if walltime:
+                return to_timedelta(walltime), 'walltime'
+        self.missing_walltimes.append(name)
+        return self.default_walltime, 'default'
+
+    ####################################################################
+
+    # Dependency resolution
+
+    def _resolve(self,cycle,dep):
+        """!Converts a dependency tree to nested tuples whose leaves are
+        edges to tasks in the analysis:
+
+        * ( 'and', [ items ] ) and ( 'or', [ items ] )
+        * ( 'edge', task_key, 'start' or 'finish' )
+        * ( 'true', ) and ( 'false', ) """
+        if isinstance(dep,AndDependency) or isinstance(dep,OrDependency):
+            op='and' if isinstance(dep,AndDependency) else 'or'
+            return ( op, [ self._resolve(cycle,d) for d in dep ] )
+        elif isinstance(dep,StateDependency):
+            if dep.state==FAILED:
+                return ( 'false', )
+            kind=_START if dep.state==RUNNING else _FINISH
+            return self._resolve_path(cycle,dep.path,kind)
+        elif isinstance(dep,EventDependency):
+            return self._resolve_path(cycle,dep.event.path[:-1],_FINISH)
+        elif dep is FALSE_DEPENDENCY or dep==FALSE_DEPENDENCY:
+            return ( 'false', )
+        # TRUE_DEPENDENCY, negations, and existence checks do not
+        # delay a task when everything succeeds.
+        return ( 'true', )
+
+    def _resolve_path(self,cycle,path,kind):
+        target_cycle=cycle+path[0]
+        if target_cycle not in self.__cycle_set:
+            return ( 'true', ) # outside the analysis: assume done
+        key=(target_cycle,timeless_path(path))
+        if key in self.tasks:
+            return ( 'edge', key, kind )
+        if key in self.__family_tasks:
+            members=[ ( 'edge', task, kind ) for task in self.__family_tasks[key] ]
+            return ( 'and' if kind==_FINISH else 'or', members )
+        node=self.__nodes.get(key,None)
+        if node is not None and node.is_always_complete():
+            return ( 'true', )
+        return ( 'false', ) # never runs, so never satisfied
+
+    ####################################################################
+
+    # Critical path method
+
+    def _forward_pass(self):
+        resolved=self.__resolved
+        predecessors=dict()
+        for key,dep in self.__triggers.items():
+            tree=self._resolve(key[0],dep)
+            resolved[key]=tree
+            predecessors[key]=set(_edge_keys(tree))
+        self.__order=_topological_sort(self.tasks.keys(),predecessors)
+
+        for key in self.__order:
+            timing=self.tasks[key]
+            result=self._evaluate(resolved[key])
+            if result is None:
+                self.unschedulable.append(timing)
+                continue
+            start,binding=result
+            lower_bound=self.__lower_bounds[key]
+            if lower_bound is not None and lower_bound>start:
+                start,binding=lower_bound,list()
+            timing.earliest_start=start
+            timing.earliest_finish=start+timing.duration
+            timing.binding=binding
+            self.makespan=max(self.makespan,timing.earliest_finish)
+
+    def _evaluate(self,tree):
+        """!Returns (time,edges) for a resolved dependency tree, where
+        time is the earliest time the dependency is met and edges are
+        the (task_key,kind) pairs that met it last.  Returns None if
+        the dependency is never met."""
+        op=tree[0]
+        if op=='true':
+            return ZERO_DT, list()
+        elif op=='false':
+            return None
+        elif op=='edge':
+            timing=self.tasks[tree[1]]
+            if not timing.is_schedulable(): return None
+            time=timing.earliest_start if tree[2]==_START \
+                 else timing.earliest_finish
+            return time, [ (tree[1],tree[2]) ]
+        results=[ self._evaluate(item) for item in tree[1] ]
+        if op=='and':
+            if None in results: return None
+            time=max([ r[0] for r in results ],default=ZERO_DT)
+            return time, [ edge for r in results if r[0]==time
+                           for edge in r[1] ]
+        results=[ r for r in results if r is not None ]
+        if not results: return None
+        return min(results,key=lambda r: r[0])
+
+    def _backward_pass(self):
+        successors=defaultdict(list)
+        for key in self.__order:
+            timing=self.tasks[key]
+            if not timing.is_schedulable(): continue
+            for pred,kind in self._all_edges(key):
+                successors[pred].append((key,kind))
+        for key in reversed(self.__order):
+            timing=self.tasks[key]
+            if not timing.is_schedulable(): continue
+            latest_finish=self.makespan
+            for succ,kind in successors[key]:
+                succ_start=self.tasks[succ].latest_start
+                if kind==_START:
+                    latest_finish=min(latest_finish,succ_start+timing.duration)
+                else:
+                    latest_finish=min(latest_finish,succ_start)
+            timing.latest_finish=latest_finish
+            timing.latest_start=latest_finish-timing.duration
+
+    def _all_edges(self,key):
+        """!Every edge of the dependency branches the forward pass
+        chose.  Edges that were met early still limit how late their
+        predecessor may finish."""
+        return self.__chosen_edges(self.__resolved[key])
+
+    def __chosen_edges(self,tree):
+        op=tree[0]
+        if op=='edge':
+            return [ (tree[1],tree[2]) ]
+        elif op=='and':
+            return [ edge for item in tree[1]
+                     for edge in self.__chosen_edges(item) ]
+        elif op=='or':
+            best=None
+            for item in tree[1]:
+                result=self._evaluate(item)
+                if result is not None and (best is None or result[0]<best[0]):
+                    best=(result[0],item)
+            return self.__chosen_edges(best[1]) if best else list()
+        return list()
+
+    ####################################################################
+
+    # Results
+
+    def each_task(self,cycle=None):
+        for timing in self.tasks.values():
+            if cycle is None or timing.cycle==cycle:
+                yield timing
+
+    def critical_path(self,cycle):
+        """!Returns the chain of tasks, earliest first, that determines
+        when the last task of the given cycle finishes.  The chain may
+        begin in earlier cycles."""
+        last=None
+        for timing in self.each_task(cycle):
+            if not timing.is_schedulable(): continue
+            if last is None or timing.earliest_finish>last.earliest_finish:
+                last=timing
+        path=list()
+        while last is not None:
+            path.append(last)
+            previous=None
+            for pred,kind in last.binding:
+                candidate=self.tasks[pred]
+                if previous is None or \
+                   candidate.earliest_finish>previous.earliest_finish:
+                    previous=candidate
+            last=previous
+        path.reverse()
+        return path
+
+    def cycle_summary(self,cycle):
+        timings=[ t for t in self.each_task(cycle) if t.is_schedulable() ]
+        if not timings:
+            return OrderedDict([
+                ( 'cycle', cycle.strftime('%Y-%m-%dT%H:%M:%S') ),
+                ( 'start', None ), ( 'end', None ), ( 'makespan', None ),
+                ( 'critical_path', [] ) ])
+        start=min([ t.earliest_start for t in timings ])
+        end=max([ t.earliest_finish for t in timings ])
+        return OrderedDict([
+            ( 'cycle', cycle.strftime('%Y-%m-%dT%H:%M:%S') ),
+            ( 'start', _seconds(start) ),
+            ( 'end', _seconds(end) ),
+            ( 'makespan', _seconds(end-start) ),
+            ( 'critical_path', [ OrderedDict([
+                ( 'cycle', t.cycle.strftime('%Y-%m-%dT%H:%M:%S') ),
+                ( 'task', t.name ) ]) for t in self.critical_path(cycle) ]) ])
+
+    def as_dict(self):
+        return OrderedDict([
+            ( 'origin', None if self.origin is None else
+                        self.origin.strftime('%Y-%m-%dT%H:%M:%S') ),
+            ( 'makespan', _seconds(self.makespan) ),
+            ( 'cycles', [ self.cycle_summary(c) for c in self.cycles ] ),
+            ( 'tasks', [ t.as_dict() for t in self.tasks.values() ] ),
+            ( 'unschedulable', [ OrderedDict([
+                ( 'cycle', t.cycle.strftime('%Y-%m-%dT%H:%M:%S') ),
+                ( 'task', t.name ) ]) for t in self.unschedulable ] ) ])
+
+    def to_json(self,fd=None,indent=1):
+        """!Returns the analysis as a JSON string, or writes it to fd if
+        one is given."""
+        if fd is None:
+            return json.dumps(self.as_dict(),indent=indent)
+        json.dump(self.as_dict(),fd,indent=indent)
+
+    def report(self,fd=None,verbose=False):
+        """!Writes a human-readable report to fd, or returns it as a
+        string if no fd is given.  If verbose, every task is listed
+        with its earliest and latest start and slack."""
+        sio=StringIO() if fd is None else fd
+        sio.write(f'Critical path analysis of {len(self.tasks)} tasks in '
+                  f'{len(self.cycles)} cycles\n')
+        sio.write(f'Overall makespan: {str_timedelta(self.makespan)}\n')
+        for cycle in self.cycles:
+            timings=[ t for t in self.each_task(cycle) if t.is_schedulable() ]
+            if not timings:
+                sio.write(f'\n{cycle:%Y%m%d%H%M}: no tasks run\n')
+                continue
+            start=min([ t.earliest_start for t in timings ])
+            end=max([ t.earliest_finish for t in timings ])
+            sio.write(f'\n{cycle:%Y%m%d%H%M}: start {str_timedelta(start)} '
+                      f'end {str_timedelta(end)} makespan '
+                      f'{str_timedelta(end-start)}\n')
+            sio.write('  critical path:\n')
+            for t in self.critical_path(cycle):
+                sio.write(f'    {t.cycle:%Y%m%d%H%M} {t.name} '
+                          f'start {str_timedelta(t.earliest_start)} '
+                          f'duration {str_timedelta(t.duration)}\n')
+            if not verbose: continue
+            sio.write('  tasks: earliest start, latest start, slack\n')
+            for t in timings:
+                sio.write(f'    {t.name} {str_timedelta(t.earliest_start)} '
+                          f'{str_timedelta(t.latest_start)} '
+                          f'{str_timedelta(t.slack)}\n')
+        for t in self.unschedulable:
+            sio.write(f'WARNING: {t.cycle:%Y%m%d%H%M} {t.name}: '
+                      'trigger can never be met\n')
+        if fd is None:
+            result=sio.getvalue()
+            sio.close()
+            return result
+
+def _edge_keys(tree):
+    if tree[0]=='edge':
+        yield tree[1]
+    elif tree[0] in [ 'and', 'or' ]:
+        for item in tree[1]:
+            for key in _edge_keys(item):
+                yield key
+
+def _topological_sort(keys,predecessors):
+    """!Orders keys so every key comes after its predecessors.  Raises
+    ValueError if the dependencies are cyclic."""
+    waiting=dict()
+    successors=defaultdict(list)
+    for key in keys:
+        preds=[ p for p in predecessors[key] if p!=key ]
+        waiting[key]=len(preds)
+        for pred in preds:
+            successors[pred].append(key)
+    ready=[ key for key in keys if not waiting[key] ]
+    order=list()
+    while ready:
+        key=ready.pop()
+        order.append(key)
+        for succ in successors[key]:
+            waiting[succ]-=1
+            if not waiting[succ]:
+                ready.append(succ)
+    if len(order)!=len(waiting):
+        stuck=[ _task_name(k[1]) for k in keys if waiting[k] ][:10]
+        raise ValueError('Cyclic dependencies between tasks: '+
+                         ', '.join(stuck))
+    return order
+
+def critical_path_for_suite(suite,clock=None,runtimes=None,
+                            default_walltime=ZERO_DT,realtime=False):
+    """!Builds and simplifies the job graph for the cycles in clock
+    (the suite clock by default), then analyzes it."""
+    graph=make_simplified_graph(suite,clock)
+    return CriticalPathAnalysis(graph,runtimes,default_walltime,realtime)
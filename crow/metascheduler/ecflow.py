@@ -49,40 +49,53 @@ def relative_path(start,dest):
     else:
         return './'+'/'.join(dest[i:])
     
-def undate_path(relative_time,format,suite_path,undated):
+def undate_path(relative_time,format,suite_path,undated,dater=None):
     """!In dependencies within crow.config, the task paths have a
     timedelta at element 0 to indicate the relative time of the
     dependency.  This creates a new path, replacing the timedelta with
-    a time string.  The format is sent to datetime.strftime."""
+    a time string.  The format is sent to datetime.strftime, or to
+    dater(timedelta,format) if a dater is given."""
     assert(isinstance(undated,OrderedDict))
     if suite_path and hasattr(suite_path[0],'total_seconds'):
-        when=relative_time+suite_path[0]
-        result=[when.strftime(format)] + suite_path[1:]
+        if dater is None:
+            when=relative_time+suite_path[0]
+            datestr=when.strftime(format)
+        else:
+            datestr=dater(suite_path[0],format)
+        result=[datestr] + suite_path[1:]
         return result,True
     return suite_path,False
 
-def convert_state_dep(fd,task,dep,clock,time_format,negate,undated):
+def convert_state_dep(fd,task,dep,clock,time_format,negate,undated,
+                      dater=None):
     assert(isinstance(undated,OrderedDict))
-    typecheck('clock',clock,crow.tools.Clock)
-    task_path,did_undated=undate_path(clock.now,time_format,task.path,undated)
-    dep_path,did_undated=undate_path(clock.now,time_format,dep.view.path,undated)
+    now=None
+    if dater is None:
+        typecheck('clock',clock,crow.tools.Clock)
+        now=clock.now
+    task_path,did_undated=undate_path(now,time_format,task.path,undated,dater)
+    dep_path,did_undated=undate_path(now,time_format,dep.view.path,undated,dater)
     rel_path=relative_path(task_path,dep_path)
     if did_undated and rel_path[0]=='/':
         undated[rel_path]=1
     state=ECFLOW_STATE_MAP[dep.state]
     fd.write(f'{rel_path} {"!=" if negate else "=="} {state}')
 
-def convert_event_dep(fd,task,dep_path,event_name,clock,time_format,negate,undated):
+def convert_event_dep(fd,task,dep_path,event_name,clock,time_format,negate,
+                      undated,dater=None):
     assert(isinstance(undated,OrderedDict))
-    typecheck('clock',clock,crow.tools.Clock)
-    task_path,did_undated=undate_path(clock.now,time_format,task.path,undated)
-    dep_path,did_undated=undate_path(clock.now,time_format,dep_path,undated)
+    now=None
+    if dater is None:
+        typecheck('clock',clock,crow.tools.Clock)
+        now=clock.now
+    task_path,did_undated=undate_path(now,time_format,task.path,undated,dater)
+    dep_path,did_undated=undate_path(now,time_format,dep_path,undated,dater)
     rel_path=relative_path(task_path,dep_path)
     if did_undated and rel_path[0]=='/':
         undated[rel_path]=1
     fd.write(f'{rel_path}:{event_name}{" is clear" if negate else ""}')
 
-def dep_to_ecflow(fd,task,dep,clock,time_format,undated):
+def dep_to_ecflow(fd,task,dep,clock,time_format,undated,dater=None):
     assert(isinstance(undated,OrderedDict))
     first=True
     if isinstance(dep,OrDependency):
@@ -90,29 +103,71 @@ def dep_to_ecflow(fd,task,dep,clock,time_format,undated):
             if not first:
                 fd.write(' or ')
             first=False
-            dep_to_ecflow(fd,task,subdep,clock,time_format,undated)
+            dep_to_ecflow(fd,task,subdep,clock,time_format,undated,dater)
     elif isinstance(dep,AndDependency):
         for subdep in dep:
             if not first:
                 fd.write(' and ')
             first=False
-            dep_to_ecflow(fd,task,subdep,clock,time_format,undated)
+            dep_to_ecflow(fd,task,subdep,clock,time_format,undated,dater)
     elif isinstance(dep,NotDependency):
         fd.write('not ')
         if isinstance(dep.depend,StateDependency):
             convert_state_dep(fd,task,dep.depend,clock,time_format,True,
-                              undated)
+                              undated,dater)
         elif isinstance(dep.depend,EventDependency):
             convert_event_dep(fd,task,dep.event.path[:-1],
                               dep.event.path[-1],clock,time_format,True,
-                              undated)
+                              undated,dater)
         else:
-            dep_to_ecflow(fd,task,dep.depend,clock,time_format,undated)
+            dep_to_ecflow(fd,task,dep.depend,clock,time_format,undated,dater)
     elif isinstance(dep,StateDependency):
-        convert_state_dep(fd,task,dep,clock,time_format,False,undated)
+        convert_state_dep(fd,task,dep,clock,time_format,False,undated,dater)
     elif isinstance(dep,EventDependency):
         convert_event_dep(fd,task,dep.event.path[:-1],
-                          dep.event.path[-1],clock,time_format,False,undated)
+                          dep.event.path[-1],clock,time_format,False,undated,
+                          dater)
+
+class _RenderedNode(object):
+    """!Stands in for a graph Node when converting dependencies of a
+    suite definition record; only the path is needed."""
+    def __init__(self,path):
+        self.path=path
+
+class DatePlaceholders(object):
+    """!A dater for _render_suite_def that returns a placeholder for
+    each distinct (timedelta,format) instead of a formatted date."""
+    def __init__(self):
+        self.dates=list()
+        self.__index=dict()
+    def __call__(self,dt,format):
+        key=(dt,format)
+        if key not in self.__index:
+            self.__index[key]=len(self.dates)
+            self.dates.append(key)
+        return f'\0{self.__index[key]}\0'
+
+class SuiteDefTemplate(object):
+    """!Suite definition text containing DatePlaceholders.  The
+    template assumes suite names of different cycles differ;
+    instantiate() returns None for cycles where they do not."""
+    def __init__(self,text,placeholders):
+        self.pieces=re.split('\0([0-9]+)\0',text)
+        for i in range(1,len(self.pieces),2):
+            self.pieces[i]=int(self.pieces[i])
+        self.dates=list(placeholders.dates)
+    def instantiate(self,cycle,suite_name_format):
+        values=[ (cycle+dt).strftime(format) for dt,format in self.dates ]
+        suite_names=[ value for value,(dt,format) in zip(values,self.dates)
+                      if format==suite_name_format ]
+        if len(set(suite_names))!=len(suite_names):
+            return None
+        sio=StringIO()
+        for i,piece in enumerate(self.pieces):
+            sio.write(values[piece] if i%2 else piece)
+        result=sio.getvalue()
+        sio.close()
+        return result
 
 class ToEcflow(object):
     def __init__(self,suite,apply_overrides=True):
@@ -151,6 +206,8 @@ class ToEcflow(object):
         if apply_overrides:
             self.suite.apply_overrides()
         self.graph=Graph(self.suite,self.suite.Clock)
+        self.__selected_cycle=None
+        self.__suite_def_templates=dict()
 
     def datestring(self,format):
         def replacer(m):
@@ -176,6 +233,14 @@ class ToEcflow(object):
         invalidate_cache(self.suite,recurse=True)
         validate(self.suite,stage='suite',recurse=True)
         self.suite.Clock.now = cycle
+        self.__selected_cycle = cycle
+
+    def _select_cycle_if_needed(self,cycle):
+        """!Calls _select_cycle unless that cycle is already selected.
+        Invalidating the suite's caches dominates the cost of
+        generating each cycle, so avoid doing it repeatedly."""
+        if self.__selected_cycle != cycle:
+            self._select_cycle(cycle)
 
     def _foreach_cycle(self,clock):
         """!Iterates over all cycles in the clock, ensuring self.suite is
@@ -214,86 +279,139 @@ class ToEcflow(object):
             self.graph.simplify_cycle(cycle)
 
     def _walk_job_graph(self,cycle,skip_fun=None,enter_fun=None,exit_fun=None):
-        self._select_cycle(cycle)
+        self._select_cycle_if_needed(cycle)
         for node in self.graph.depth_first_traversal(
                 cycle,skip_fun,enter_fun,exit_fun):
             yield node
 
     def _make_suite_def(self,cycle):
-        self._select_cycle(cycle)
-        clock=self.suite.Clock
-
+        self._select_cycle_if_needed(cycle)
         suite_name_format=self.suite.ecFlow.suite_name
         suite_name=cycle.strftime(suite_name_format)
+
+        # Cycles with the same records have the same suite definition,
+        # apart from the dates, so they share one template.
+        records=self._suite_def_records(cycle)
+        template=self.__suite_def_templates.get(records,None)
+        if template is None:
+            placeholders=DatePlaceholders()
+            template=SuiteDefTemplate(self._render_suite_def(
+                records,suite_name_format,placeholders),placeholders)
+            self.__suite_def_templates[records]=template
+        suite_def=template.instantiate(cycle,suite_name_format)
+        if suite_def is None:
+            # Suite names of different cycles are identical, so
+            # relative paths differ from those in the template.
+            _logger.debug(f'{cycle:%Y%m%d%H%M}: suite def cannot use '
+                          'template; rendering it directly')
+            suite_def=self._render_suite_def(
+                records,suite_name_format,
+                lambda dt,format: (cycle+dt).strftime(format))
+        return suite_name, suite_def
+
+    def _suite_def_records(self,cycle):
+        """!Walks the job graph for one cycle and returns a hashable
+        tuple of everything in its suite definition except dates."""
+        records=[ ( 'suite', self.suite.get('before_suite_def',None),
+                    self.suite.get('ecflow_def',None),
+                    self.suite.ecf_file_set.ECF_FILES,
+                    self.settings.suite_name,
+                    bool(self.settings.get('dates_in_time_dependencies',False)) ) ]
+        def exit_fun(node):
+            if node.is_family():
+                records.append( ( 'endfamily', tuple(node.path),
+                                  node.view.task_path_str ) )
+        for node in self._walk_job_graph(cycle,skip_fun=skip_fun,exit_fun=exit_fun):
+            ECF_FILES=None
+            if node.is_family() and 'ecf_file_set' in node.view:
+                ECF_FILES=node.view.ecf_file_set.ECF_FILES
+            events=list()
+            event_number=node.view.get('ecflow_first_event_number',1)
+            typecheck(f'{node.view.task_path_var}.ecflow_first_event_number',event_number,int)
+            if node.is_task():
+                for item in node.view.child_iter():
+                    if item.is_event():
+                        events.append( ( event_number, item.path[-1] ) )
+                    event_number+=1
+            records.append( (
+                'task' if node.is_task() else 'family',
+                tuple(node.path), node.view.task_path_str, ECF_FILES,
+                node.view.get('ecflow_def',None),
+                bool(node.view.get('Dummy',False)),
+                node.trigger, node.complete, node.time, tuple(events) ) )
+        return tuple(records)
+
+    def _render_suite_def(self,records,suite_name_format,dater):
+        """!Generates suite definition text from _suite_def_records.  The
+        dater(dt,format) returns the cycle plus dt, formatted by
+        format, or a placeholder for it."""
+        suite_name=dater(ZERO_DT,suite_name_format)
         undated=OrderedDict()
         sio=StringIO()
 
-        if 'before_suite_def' in self.suite:
-            sio.write(self.suite.before_suite_def)
+        _,before_suite_def,ecflow_def,ECF_FILES,_,dates_in_time = records[0]
+        if before_suite_def is not None:
+            sio.write(before_suite_def)
             sio.write('\n')
 
         sio.write(f'suite {suite_name}\n')
-        if 'ecflow_def' in self.suite:
-            for line in self.suite.ecflow_def.splitlines():
+        if ecflow_def is not None:
+            for line in ecflow_def.splitlines():
                 sio.write(f'{self.indent}{line.rstrip()}\n')
 
-        ECF_FILES=self.suite.ecf_file_set.ECF_FILES
         sio.write(f"{self.indent}edit ECF_FILES '{ECF_FILES}'\n")
 
-        def exit_fun(node):
-            if node.is_family():
-                indent=max(0,len(node.path)-1)*self.indent
-                ended=f'/{suite_name}/{node.view.task_path_str}'
+        for record in records[1:]:
+            if record[0]=='endfamily':
+                _,path,task_path_str = record
+                indent=max(0,len(path)-1)*self.indent
+                ended=f'/{suite_name}/{task_path_str}'
                 ended=re.sub('/+','/',ended)
                 sio.write(f'{indent}endfamily # {ended}\n')
+                continue
 
-        for node in self._walk_job_graph(cycle,skip_fun=skip_fun,exit_fun=exit_fun):
-            indent0=max(0,len(node.path)-1)*self.indent
-            indent1=max(0,len(node.path))*self.indent
-            nodetype='task' if node.is_task() else 'family'
-            sio.write(f'{indent0}{nodetype} {node.path[-1]}')
-            if node.is_family():
-                started=f' # /{suite_name}/{node.view.task_path_str}'
+            nodetype,path,task_path_str,ECF_FILES,ecflow_def,dummy, \
+                trigger,complete,time,events = record
+            node=_RenderedNode(SuitePath(path))
+            indent0=max(0,len(path)-1)*self.indent
+            indent1=max(0,len(path))*self.indent
+            sio.write(f'{indent0}{nodetype} {path[-1]}')
+            if nodetype=='family':
+                started=f' # /{suite_name}/{task_path_str}'
                 started=re.sub('/+','/',started)
                 sio.write(started)
-                if 'ecf_file_set' in node.view:
-                    ECF_FILES=node.view.ecf_file_set.ECF_FILES
+                if ECF_FILES is not None:
                     sio.write(f"\n{self.indent}edit ECF_FILES '{ECF_FILES}'")
 
             sio.write('\n')
 
-            if 'ecflow_def' in node.view:
-                for line in node.view.ecflow_def.splitlines():
+            if ecflow_def is not None:
+                for line in ecflow_def.splitlines():
                     sio.write(f'{indent1}{line.rstrip()}\n')
 
-            if 'Dummy' in node.view and node.view.Dummy:
+            if dummy:
                 sio.write(f"{indent1}edit ECF_DUMMY_TASK ''\n")
                 sio.write(f"{indent1}defstatus complete\n")
 
-            if node.trigger not in [FALSE_DEPENDENCY,TRUE_DEPENDENCY]:
+            if trigger not in [FALSE_DEPENDENCY,TRUE_DEPENDENCY]:
                 sio.write(f'{indent1}trigger ')
-                dep_to_ecflow(sio,node,node.trigger,clock,suite_name_format,undated)
+                dep_to_ecflow(sio,node,trigger,None,suite_name_format,
+                              undated,dater)
                 sio.write('\n')
-            if node.complete not in [FALSE_DEPENDENCY,TRUE_DEPENDENCY]:
+            if complete not in [FALSE_DEPENDENCY,TRUE_DEPENDENCY]:
                 sio.write(f'{indent1}complete ')
-                dep_to_ecflow(sio,node,node.complete,clock,suite_name_format,undated)
+                dep_to_ecflow(sio,node,complete,None,suite_name_format,
+                              undated,dater)
                 sio.write('\n')
-            if node.time>ZERO_DT:
-                when=cycle+node.time
-                ectime=when.strftime('%H:%M')
+            if time>ZERO_DT:
+                ectime=dater(time,'%H:%M')
                 sio.write(f'{indent1}time {ectime}\n')
-                if self.settings.dates_in_time_dependencies:
-                    ecdate=when.strftime('%d.%m.%Y')
+                if dates_in_time:
+                    ecdate=dater(time,'%d.%m.%Y')
                     sio.write(f'{indent1}date {ecdate}\n')
 
-            event_number=node.view.get('ecflow_first_event_number',1)
-            typecheck(f'{node.view.task_path_var}.ecflow_first_event_number',event_number,int)
-            if node.is_task():
-                for item in node.view.child_iter():
-                    if item.is_event():
-                        sio.write(f'{indent1}event {event_number} '
-                                  f'{item.path[-1]}\n')
-                    event_number+=1
+            for event_number,event_name in events:
+                sio.write(f'{indent1}event {event_number} {event_name}\n')
 
         sio.write(f'endsuite # /{suite_name}\n')
         suite_def_without_externs=sio.getvalue()
@@ -307,7 +425,7 @@ class ToEcflow(object):
             sio.close()
         else:
             suite_def=suite_def_without_externs
-        return suite_name, suite_def
+        return suite_def
 
     ####################################################################
 
@@ -368,6 +486,7 @@ class ToEcflow(object):
         self._initialize_graph()
         for cycle in self._foreach_cycle(self._cycles_to_write()):
             _logger.info(f'{cycle:%Y%m%d%H%M}: make suite definition in memory...')
+            ecflow_suite.add_cycle_state(cycle,self.graph.cycle_state(cycle))
             # Figure our where we are making the suite definition file:
             filename=cycle.strftime(self.suite.ecFlow.suite_def_filename)
             if ecflow_suite.have_suite_file(filename):
@@ -392,12 +511,15 @@ class EcflowSuiteFiles(object):
         self.job_mkdirs=list()
         self.ecf_files=OrderedDict()
         self.ecf_file_set_paths=OrderedDict()
+        self.cycle_states=OrderedDict()
 
     def add_suite(self,suite_file,suite_name,suite_def):
         self.suite_defs_by_name[suite_name]=[ suite_file, suite_def ]
         self.suite_defs_by_file[suite_file]=[ suite_name, suite_def ]
     def add_family(self,family_path):
         self.job_mkdirs.append(family_path)
+    def add_cycle_state(self,cycle,state):
+        self.cycle_states[cycle]=state
 
     def add_ecf_file_set(self,name,path):
         if name in self.ecf_files: return
@@ -422,6 +544,9 @@ class EcflowSuiteFiles(object):
         for suite_name,stuff in self.suite_defs_by_name.items():
             suite_file, suite_def = stuff
             yield suite_name,suite_file,suite_def
+    def each_cycle_state(self):
+        for cycle,state in self.cycle_states.items():
+            yield cycle,state
     def each_family_path(self):
         for family_name in self.job_mkdirs:
             yield family_name
@@ -0,0 +1,260 @@
+"""!Updates a running ecFlow server with only the parts of regenerated
+suite definitions that changed.
+
+Reloading a whole suite with "ecflow_client --load" is slow on a busy
+server, even when a single trigger changed.  This module parses the
+generated suite definition text into a tree of DefNode objects,
+compares it to the tree of the previously generated text, and builds
+a ReplacePlan: the smallest set of nodes to --replace or --delete, and
+the suites that are new and must be loaded.
+
+Commands are sent through an EcflowClient.  The SubprocessEcflowClient
+runs ecflow_client, while the DryRunEcflowClient only prints and
+records the commands.  Other clients can be plugged in by overriding
+EcflowClient.run."""
+
+f'This module requires python 3.6 or newer.'
+
+import sys, logging, subprocess
+from abc import abstractmethod
+from collections import OrderedDict
+
+__all__=[ 'DefNode', 'parse_suite_def', 'diff_suite_defs', 'ReplacePlan',
+          'plan_suite_updates', 'EcflowClient', 'SubprocessEcflowClient',
+          'DryRunEcflowClient' ]
+
+_logger=logging.getLogger('to_ecflow')
+
+class DefNode(object):
+    """!A suite, family, or task in a parsed suite definition.  The
+    attributes are the node's own lines (edit, trigger, event, and so
+    on) in order, with whitespace stripped.  Child nodes are in the
+    children OrderedDict, keyed by name."""
+    def __init__(self,kind,name,parent=None):
+        self.kind=kind
+        self.name=name
+        self.parent=parent
+        self.attributes=list()
+        self.children=OrderedDict()
+
+    @property
+    def path(self):
+        names=list()
+        node=self
+        while node is not None:
+            names.append(node.name)
+            node=node.parent
+        return '/'+'/'.join(reversed(names))
+
+    def walk(self):
+        """!Iterates over this node and all nodes below it, depth first."""
+        yield self
+        for child in self.children.values():
+            yield from child.walk()
+
+    def find(self,path):
+        """!Returns the node at the given absolute path below this
+        suite, or None."""
+        names=path.strip('/').split('/')
+        if not names or names[0]!=self.name: return None
+        node=self
+        for name in names[1:]:
+            node=node.children.get(name,None)
+            if node is None: return None
+        return node
+
+    def same_as(self,other):
+        """!Is this subtree identical to the other?"""
+        return self.kind==other.kind and self.name==other.name and \
+            self.attributes==other.attributes and \
+            list(self.children)==list(other.children) and \
+            all([ child.same_as(other.children[name])
+                  for name,child in self.children.items() ])
+
+    def __repr__(self):
+        return f'DefNode({self.kind!r},{self.path!r})'
+
+def parse_suite_def(text):
+    """!Parses the text of an ecFlow suite definition file.  Returns an
+    OrderedDict mapping suite name to DefNode.  Extern lines and
+    comments are ignored."""
+    suites=OrderedDict()
+    node=None
+    for lineno,line in enumerate(text.splitlines(),1):
+        line=line.strip()
+        if not line or line.startswith('#'): continue
+        words=line.split()
+        keyword=words[0]
+        if keyword=='extern':
+            continue
+        elif keyword=='suite':
+            node=DefNode('suite',words[1])
+            suites[node.name]=node
+        elif keyword in [ 'family', 'task' ]:
+            if node is None:
+                raise ValueError(f'line {lineno}: {keyword} outside a suite')
+            if node.kind=='task':
+                node=node.parent # tasks end at the next node
+            child=DefNode(keyword,words[1],node)
+            node.children[child.name]=child
+            node=child
+        elif keyword in [ 'endtask', 'endfamily', 'endsuite' ]:
+            kind=keyword[3:]
+            if node is not None and node.kind=='task' and kind!='task':
+                node=node.parent
+            if node is None or node.kind!=kind:
+                raise ValueError(f'line {lineno}: {keyword} without {kind}')
+            node=node.parent
+        elif node is None:
+            raise ValueError(f'line {lineno}: {keyword} outside a suite')
+        else:
+            node.attributes.append(' '.join(words))
+    if node is not None:
+        raise ValueError(f'{node.path}: suite definition ends inside '
+                         f'{node.kind}')
+    return suites
+
+class ReplacePlan(object):
+    """!The ecflow_client commands needed to bring a server from one
+    set of suite definitions to another.
+
+    * load --- (suite name, definition file) of suites to --load
+    * replace --- (node path, definition file) of nodes to --replace
+    * delete --- paths of nodes to --delete
+    * unchanged --- names of suites that need no commands"""
+    def __init__(self):
+        self.load=list()
+        self.replace=list()
+        self.delete=list()
+        self.unchanged=list()
+
+    def __bool__(self):
+        return bool(self.load or self.replace or self.delete)
+
+    def __str__(self):
+        return f'load {len(self.load)} suites, replace {len(self.replace)} ' \
+               f'nodes, delete {len(self.delete)} nodes, ' \
+               f'{len(self.unchanged)} suites unchanged'
+
+    def suites_to_load(self):
+        return OrderedDict(self.load)
+
+    def execute(self,client):
+        """!Sends the commands to the EcflowClient.  Deletions are sent
+        first, then replacements, then new suites are loaded."""
+        for path in self.delete:
+            client.delete(path)
+        for path,filename in self.replace:
+            client.replace(path,filename)
+        for suite,filename in self.load:
+            client.load(filename)
+
+    def dry_run(self,fd=None):
+        """!Prints the commands execute() would send, and returns them as
+        a list of argument lists."""
+        client=DryRunEcflowClient(fd)
+        self.execute(client)
+        return client.commands
+
+def _diff_node(old,new,filename,plan):
+    if old.kind!=new.kind or old.attributes!=new.attributes:
+        plan.replace.append((new.path,filename))
+        return
+    kept=[ name for name in new.children if name in old.children ]
+    added=[ name for name in new.children if name not in old.children ]
+    if kept!=[ name for name in old.children if name in new.children ] or \
+       list(new.children)!=kept+added:
+        # Order of the children changed, or new children are not at
+        # the end.  Replacing one node cannot express that.
+        plan.replace.append((new.path,filename))
+        return
+    for name,child in old.children.items():
+        if name not in new.children:
+            plan.delete.append(child.path)
+    for name in kept:
+        _diff_node(old.children[name],new.children[name],filename,plan)
+    for name in added:
+        plan.replace.append((new.children[name].path,filename))
+
+def diff_suite_defs(old_text,new_text,filename,plan=None):
+    """!Compares two versions of a suite definition file, adding the
+    commands to update the server to a ReplacePlan.  Suites that are
+    only in the old text are left alone, since the new text may hold
+    a subset of the cycles.
+
+    @param old_text the previously loaded suite definition, or None
+    @param new_text the new suite definition
+    @param filename file that contains new_text, for --load and --replace
+    @param plan the ReplacePlan to add to; a new one if None
+    @returns the ReplacePlan"""
+    if plan is None: plan=ReplacePlan()
+    old_suites=parse_suite_def(old_text) if old_text is not None else {}
+    for name,new in parse_suite_def(new_text).items():
+        old=old_suites.get(name,None)
+        if old is None:
+            plan.load.append((name,filename))
+        elif old.same_as(new):
+            plan.unchanged.append(name)
+        else:
+            _diff_node(old,new,filename,plan)
+    return plan
+
+def plan_suite_updates(suite_def_files,old_suite_defs):
+    """!Builds a ReplacePlan for suite definition files that were just
+    written.
+
+    @param suite_def_files mapping from suite name to definition file,
+      as returned by write_ecflow_suite_to_disk
+    @param old_suite_defs mapping from suite name to the text of the
+      definition the server last loaded.  Suites absent from it are
+      loaded whole."""
+    plan=ReplacePlan()
+    for name,filename in suite_def_files.items():
+        with open(filename,'rt') as fd:
+            new_text=fd.read()
+        diff_suite_defs(old_suite_defs.get(name,None),new_text,filename,plan)
+    _logger.info(f'ecflow update plan: {plan}')
+    return plan
+
+class EcflowClient(object):
+    """!Sends commands to an ecFlow server.  Subclasses implement run(),
+    which receives the ecflow_client arguments as a list."""
+    @abstractmethod
+    def run(self,args):
+        """!Runs ecflow_client with the given arguments."""
+    def load(self,filename):
+        self.run([ '--load', filename ])
+    def begin(self,suite):
+        self.run([ '--begin', suite ])
+    def replace(self,path,filename):
+        self.run([ f'--replace={path}', filename, 'parent' ])
+    def delete(self,path):
+        self.run([ '--delete=force', 'yes', path ])
+
+class SubprocessEcflowClient(EcflowClient):
+    """!Runs the ecflow_client program, which finds the server from
+    $ECF_HOST and $ECF_PORT.  Failures are logged, not raised, so the
+    remaining commands still run."""
+    def __init__(self,command='ecflow_client'):
+        self.command=command
+    def run(self,args):
+        cmd=[ self.command ] + list(args)
+        _logger.info(' '.join(cmd))
+        result=subprocess.run(cmd,check=False)
+        if result.returncode:
+            _logger.warning(f'{" ".join(cmd)}: exit status '
+                            f'{result.returncode}')
+        return result.returncode
+
+class DryRunEcflowClient(EcflowClient):
+    """!Prints the ecflow_client commands to fd (default: stdout) instead
+    of running them, and keeps them in the commands list."""
+    def __init__(self,fd=None,command='ecflow_client'):
+        self.fd=fd
+        self.command=command
+        self.commands=list()
+    def run(self,args):
+        self.commands.append(list(args))
+        fd=self.fd if self.fd is not None else sys.stdout
+        fd.write(' '.join([ self.command ] + list(args)) + '\n')
+        return 0
@@ -0,0 +1,163 @@
+"""!Persistent record of the ecFlow cycles already generated, so that
+adding cycles to a running workflow only analyzes and writes the new
+ones.
+
+Graph.simplify_cycle decides which nodes of a cycle run by looking at
+that cycle and the suite clock alone.  Hence cycles that were
+generated before need not be repopulated when new cycles are added.
+Instead, the simplified node states of the most recent cycles are
+kept in a JSON state file.  New cycles are checked against those
+boundary cycles: a dependency on a node that was never written to
+its suite definition can never be met in ecFlow.
+
+The state is only reused if the fingerprint of the configuration
+matches the one recorded with it; otherwise all cycles are treated as
+new."""
+
+f'This module requires python 3.6 or newer.'
+
+import os, json, logging, hashlib, datetime, tempfile
+from collections import OrderedDict
+from datetime import timedelta
+
+from crow.tools import Clock, typecheck
+
+__all__=[ 'EcflowGraphState', 'fingerprint_text' ]
+
+_logger=logging.getLogger('to_ecflow')
+
+CYCLE_FORMAT='%Y%m%d%H%M'
+
+def fingerprint_text(text):
+    """!Returns a fingerprint of configuration text for EcflowGraphState"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EcflowGraphState(object):
+    """!Cycles generated so far, and the simplified node states of the
+    last boundary_cycles of them.
+
+    @param fingerprint fingerprint_text() of the configuration used
+      to generate the cycles
+    @param boundary_cycles number of most recent cycles whose node
+      states are kept"""
+    VERSION=1
+
+    def __init__(self,fingerprint=None,boundary_cycles=4):
+        typecheck('boundary_cycles',boundary_cycles,int)
+        self.fingerprint=fingerprint
+        self.boundary_cycles=boundary_cycles
+        self.generated=set()
+        self.cycle_states=OrderedDict()
+
+    def __len__(self):
+        return len(self.generated)
+
+    def is_generated(self,cycle):
+        return cycle in self.generated
+
+    def new_cycles(self,clock):
+        """!Iterates over the cycles in the clock that were not yet
+        generated."""
+        typecheck('clock',clock,Clock)
+        for cycle in clock:
+            if cycle not in self.generated:
+                yield cycle
+
+    def new_cycle_ranges(self,clock):
+        """!Iterates over (first,last) for each run of consecutive
+        clock cycles that were not yet generated.  Cycles generated
+        before, between the runs, are left out."""
+        first=last=None
+        for cycle in clock:
+            if cycle not in self.generated:
+                if first is None: first=cycle
+                last=cycle
+            elif first is not None:
+                yield first,last
+                first=last=None
+        if first is not None:
+            yield first,last
+
+    def check_references(self,ecflow_suite):
+        """!Returns a list of messages about nodes in the newly generated
+        cycles that depend on a node in another cycle that never runs
+        or is always complete, and hence is absent from its suite
+        definition."""
+        states=OrderedDict(self.cycle_states)
+        states.update(ecflow_suite.each_cycle_state())
+        problems=list()
+        for cycle,state in ecflow_suite.each_cycle_state():
+            for name,node in state.items():
+                for seconds,path in node.get('refs',[]):
+                    target=cycle+timedelta(seconds=seconds)
+                    if target not in states: continue
+                    target_state=states[target].get(path,None)
+                    if target_state is None:
+                        status='does not exist'
+                    elif target_state['state']!='runs':
+                        status=f'is {target_state["state"].replace("_"," ")}'
+                    else:
+                        continue
+                    problems.append(f'{cycle:{CYCLE_FORMAT}}: {name}: depends '
+                                    f'on {path} in {target:{CYCLE_FORMAT}} '
+                                    f'which {status}')
+        return problems
+
+    def record(self,ecflow_suite):
+        """!Adds the cycles of an EcflowSuiteFiles to the state, keeping
+        node states only for the most recent boundary_cycles cycles."""
+        for cycle,state in ecflow_suite.each_cycle_state():
+            self.generated.add(cycle)
+            self.cycle_states[cycle]=state
+        keep=sorted(self.cycle_states.keys())[-self.boundary_cycles:] \
+             if self.boundary_cycles else []
+        self.cycle_states=OrderedDict(
+            [ (c,self.cycle_states[c]) for c in keep ])
+
+    def as_dict(self):
+        return OrderedDict([
+            ( 'version', self.VERSION ),
+            ( 'fingerprint', self.fingerprint ),
+            ( 'boundary_cycles', self.boundary_cycles ),
+            ( 'generated', [ f'{c:{CYCLE_FORMAT}}'
+                             for c in sorted(self.generated) ] ),
+            ( 'cycle_states', OrderedDict([
+                ( f'{c:{CYCLE_FORMAT}}', state )
+                for c,state in self.cycle_states.items() ]) ) ])
+
+    def save(self,filename):
+        """!Writes the state to filename, replacing it atomically."""
+        dirname=os.path.dirname(os.path.abspath(filename))
+        os.makedirs(dirname,exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'wt',dir=dirname,prefix=os.path.basename(filename)+'.',
+                delete=False) as fd:
+            json.dump(self.as_dict(),fd,indent=1)
+            tempname=fd.name
+        os.replace(tempname,filename)
+        _logger.info(f'{filename}: saved state of {len(self.generated)} cycles')
+
+    @staticmethod
+    def load(filename,fingerprint=None,boundary_cycles=4):
+        """!Reads the state from filename.  Returns an empty state if the
+        file does not exist, or if the fingerprint differs from the
+        one in the file."""
+        state=EcflowGraphState(fingerprint,boundary_cycles)
+        if not os.path.exists(filename):
+            _logger.info(f'{filename}: no prior state; all cycles are new')
+            return state
+        with open(filename,'rt') as fd:
+            data=json.load(fd)
+        if data.get('version',None)!=EcflowGraphState.VERSION:
+            _logger.warning(f'{filename}: unknown state file version; '
+                            'ignoring prior state')
+            return state
+        if fingerprint is not None and data['fingerprint']!=fingerprint:
+            _logger.warning(f'{filename}: configuration has changed since '
+                            'the state was saved; ignoring prior state')
+            return state
+        def cycle(s): return datetime.datetime.strptime(s,CYCLE_FORMAT)
+        state.generated=set([ cycle(c) for c in data['generated'] ])
+        for c,cycle_state in data['cycle_states'].items():
+            state.cycle_states[cycle(c)]=cycle_state
+        return state
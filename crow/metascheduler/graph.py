@@ -10,7 +10,8 @@ from collections import OrderedDict
 
 from .algebra import simplify as algebra_simplify
 from .algebra import assume as algebra_assume
-from crow.config import TRUE_DEPENDENCY,FALSE_DEPENDENCY,Suite
+from crow.config import TRUE_DEPENDENCY,FALSE_DEPENDENCY,Suite,SuitePath,\
+     validate,invalidate_cache,StateDependency,EventDependency
 from crow.tools import NamedConstant,Clock,typecheck,MISSING,ZERO_DT
 
 def depth_first_traversal(tree,skip_fun=None,enter_fun=None,
@@ -31,6 +32,37 @@ def depth_first_traversal(tree,skip_fun=None,enter_fun=None,
     if exit_fun is not None:
         exit_fun(tree)
 
+def timeless_path(path):
+    """!Returns the path relative to its own cycle, with a zero time
+    offset, removing any "this" and "up" left by dependencies that
+    were written relative to a task."""
+    timeless=SuitePath([ZERO_DT])
+    for element in path[1:]:
+        if element=='this':
+            continue
+        elif element=='up' and len(timeless)>1:
+            timeless.pop()
+        else:
+            timeless.append(element)
+    return timeless
+
+def dependency_leaves(dep):
+    """!Iterates over the StateDependency and EventDependency objects
+    in a dependency tree."""
+    if isinstance(dep,StateDependency) or isinstance(dep,EventDependency):
+        yield dep
+        return
+    for subdep in dep:
+        for leaf in dependency_leaves(subdep):
+            yield leaf
+
+def dependency_target(leaf):
+    """!Path of the task or family a dependency leaf refers to.  For
+    events, this is the task that sets the event."""
+    if isinstance(leaf,EventDependency):
+        return SuitePath(leaf.event.path[:-1])
+    return leaf.path
+
 class Node(object):
     def __init__(self,view,cycle):
         self.view=view
@@ -117,6 +149,63 @@ class Graph(object):
         self.__suite=suite
         self.__nodes=collections.defaultdict(dict)
         self.__cycles=collections.defaultdict(OrderedDict)
+
+    @property
+    def clock(self):
+        return self.__clock
+
+    @property
+    def suite(self):
+        return self.__suite
+
+    def each_cycle(self):
+        """!Iterates over all cycles added via add_cycle, in order."""
+        for cycle in sorted(self.__cycles.keys()):
+            yield cycle
+
+    def has_cycle(self,cycle):
+        return cycle in self.__cycles
+
+    def top_level_nodes(self,cycle):
+        """!Iterates over the suite's top-level families and tasks for
+        the given cycle.  Traverse their children to reach the rest
+        of the cycle."""
+        if cycle not in self.__cycles:
+            raise KeyError(f'{cycle}: have not added this '
+                           'cycle yet (add_cycle())')
+        for node in self.__cycles[cycle].values():
+            yield node
+
+    def cycle_state(self,cycle):
+        """!Summarizes the simplified nodes of a cycle as plain data.
+        Returns an OrderedDict from dot-separated node path to a dict
+        with the node's "state" (runs, never_run or always_complete).
+        Nodes that run also have their residual "trigger" and
+        "complete" dependencies as text, and "refs": the nodes in
+        other cycles they depend on, as [ seconds, path ] pairs."""
+        state=OrderedDict()
+        for top in self.top_level_nodes(cycle):
+            for node in depth_first_traversal(top):
+                name='.'.join([ str(p) for p in node.path[1:] ])
+                if not node.might_complete():
+                    state[name]={ 'state':'never_run' }
+                    continue
+                elif node.is_always_complete():
+                    state[name]={ 'state':'always_complete' }
+                    continue
+                refs=list()
+                for dep in [ node.trigger, node.complete ]:
+                    for leaf in dependency_leaves(dep):
+                        path=dependency_target(leaf)
+                        if path[0]==ZERO_DT: continue
+                        ref=[ int(path[0].total_seconds()),
+                              '.'.join([ str(p) for p in
+                                         timeless_path(path)[1:] ]) ]
+                        if ref not in refs: refs.append(ref)
+                state[name]={ 'state':'runs', 'trigger':str(node.trigger),
+                              'complete':str(node.complete), 'refs':refs }
+        return state
+
     def simplify_cycle(self,cycle):
         if cycle not in self.__clock:
             raise ValueError(
@@ -228,3 +317,23 @@ class Graph(object):
                     self._add_child(cycle,grandchild_view,child_node,memo)
         return child_node
                     
+
+def make_simplified_graph(suite,clock=None):
+    """!Builds a Graph of the suite for all cycles in the clock (the
+    suite clock by default) and simplifies every cycle.  The final
+    task, if any, is removed as the metaschedulers do."""
+    typecheck('suite',suite,Suite)
+    if clock is None:
+        clock=copy.copy(suite.Clock)
+    graph=Graph(suite,suite.Clock)
+    for cycle in clock:
+        invalidate_cache(suite,recurse=True)
+        validate(suite,stage='suite',recurse=True)
+        suite.Clock.now=cycle
+        graph.add_cycle(cycle)
+    if 'final' in suite:
+        for cycle in clock:
+            graph.force_never_run(suite.final.at(cycle-suite.Clock.start).path)
+    for cycle in clock:
+        graph.simplify_cycle(cycle)
+    return graph
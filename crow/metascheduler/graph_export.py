@@ -0,0 +1,243 @@
+"""!Flattens a simplified multi-cycle Graph into integer arrays so
+analysis tools can work on it without the CROW configuration engine.
+
+Every family and task of every cycle gets an integer id, in cycle
+order and depth-first order within a cycle.  Connections are stored
+in compressed sparse row (CSR) form: the neighbors of node i are
+indices[indptr[i]:indptr[i+1]].  The arrays are:
+
+* cycles --- cycle times in seconds since the epoch, UTC (int64)
+* cycle_index --- index into cycles for each node (int32)
+* path --- dot-separated task or family path (str)
+* is_task --- True for tasks, False for families (bool)
+* state --- NODE_RUNS, NODE_NEVER_RUNS, or NODE_ALWAYS_COMPLETE (int8)
+* time --- the node's Time offset from its cycle in seconds (int64)
+* parent --- id of the containing family, or -1 (int32)
+* children_indptr, children_indices --- family membership
+* trigger_indptr, trigger_indices, trigger_kind --- nodes referenced
+  by the trigger, and the kind of reference (EDGE_* constants)
+* complete_indptr, complete_indices, complete_kind --- same for the
+  complete condition
+* trigger_external, complete_external --- number of references to
+  nodes outside the exported cycles
+* trigger_expr, complete_expr --- the simplified dependency as text,
+  since the edges alone lose the and/or structure
+
+Only the flattening is pure python.  Saving to, or loading from, a
+.npz file requires numpy."""
+
+f'This module requires python 3.6 or newer.'
+
+import logging, calendar
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+from crow.tools import typecheck
+from crow.metascheduler.graph import Graph, timeless_path, \
+     dependency_leaves, dependency_target
+from crow.config import LogicalDependency, EventDependency, \
+          TRUE_DEPENDENCY, FALSE_DEPENDENCY, COMPLETED, RUNNING, FAILED
+
+__all__=[ 'FlatGraph', 'flatten_graph', 'load_npz', 'NODE_RUNS',
+          'NODE_NEVER_RUNS', 'NODE_ALWAYS_COMPLETE', 'EDGE_COMPLETED',
+          'EDGE_RUNNING', 'EDGE_FAILED', 'EDGE_EVENT' ]
+
+_logger=logging.getLogger('crow')
+
+NODE_RUNS=0
+NODE_NEVER_RUNS=1
+NODE_ALWAYS_COMPLETE=2
+
+EDGE_COMPLETED=0
+EDGE_RUNNING=1
+EDGE_FAILED=2
+EDGE_EVENT=3
+
+_EDGE_KIND={ COMPLETED:EDGE_COMPLETED, RUNNING:EDGE_RUNNING,
+             FAILED:EDGE_FAILED }
+
+## The arrays, in file order, and their element types
+_ARRAYS=OrderedDict([
+    ( 'cycles', 'int64' ), ( 'cycle_index', 'int32' ), ( 'path', 'str' ),
+    ( 'is_task', 'bool' ), ( 'state', 'int8' ), ( 'time', 'int64' ),
+    ( 'parent', 'int32' ), ( 'children_indptr', 'int32' ),
+    ( 'children_indices', 'int32' ), ( 'trigger_indptr', 'int32' ),
+    ( 'trigger_indices', 'int32' ), ( 'trigger_kind', 'int8' ),
+    ( 'trigger_external', 'int32' ), ( 'trigger_expr', 'str' ),
+    ( 'complete_indptr', 'int32' ), ( 'complete_indices', 'int32' ),
+    ( 'complete_kind', 'int8' ), ( 'complete_external', 'int32' ),
+    ( 'complete_expr', 'str' ) ])
+
+## Cycle zero: cycles are naive datetimes in UTC
+_EPOCH=datetime(1970,1,1)
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError as ie:
+        raise ImportError('Saving or loading a .npz graph requires numpy, '
+                          'which is not installed.') from ie
+    return numpy
+
+def _expression(dep):
+    if dep is TRUE_DEPENDENCY or dep==TRUE_DEPENDENCY: return 'true'
+    if dep is FALSE_DEPENDENCY or dep==FALSE_DEPENDENCY: return 'false'
+    return str(dep)
+
+class FlatGraph(object):
+    """!Integer-indexed copy of a Graph.  The arrays are plain python
+    lists until as_arrays() or save_npz() convert them to numpy.
+    from_arrays() reverses the conversion."""
+    def __init__(self):
+        self.cycles=list()
+        self.cycle_index=list()
+        self.path=list()
+        self.is_task=list()
+        self.state=list()
+        self.time=list()
+        self.parent=list()
+        self.children_indptr=[0]
+        self.children_indices=list()
+        self.trigger_indptr=[0]
+        self.trigger_indices=list()
+        self.trigger_kind=list()
+        self.trigger_external=list()
+        self.trigger_expr=list()
+        self.complete_indptr=[0]
+        self.complete_indices=list()
+        self.complete_kind=list()
+        self.complete_external=list()
+        self.complete_expr=list()
+
+    def __len__(self):
+        return len(self.path)
+
+    def node_ids(self,path):
+        """!Iterates over the ids, one per cycle, of the node with the
+        given dot-separated path."""
+        for i,p in enumerate(self.path):
+            if p==path: yield i
+
+    def children(self,i):
+        return self.children_indices[
+            self.children_indptr[i]:self.children_indptr[i+1]]
+
+    def trigger_edges(self,i):
+        start,end=self.trigger_indptr[i],self.trigger_indptr[i+1]
+        return list(zip(self.trigger_indices[start:end],
+                        self.trigger_kind[start:end]))
+
+    def complete_edges(self,i):
+        start,end=self.complete_indptr[i],self.complete_indptr[i+1]
+        return list(zip(self.complete_indices[start:end],
+                        self.complete_kind[start:end]))
+
+    def as_lists(self):
+        """!Returns an OrderedDict of plain python lists, one per array,
+        with cycles in seconds since the epoch.  This is what
+        as_arrays() converts to numpy."""
+        lists=OrderedDict()
+        for name in _ARRAYS:
+            if name=='cycles':
+                lists[name]=[ calendar.timegm(c.utctimetuple())
+                              for c in self.cycles ]
+            else:
+                lists[name]=list(getattr(self,name))
+        return lists
+
+    def as_arrays(self):
+        """!Returns an OrderedDict of numpy arrays, one per attribute."""
+        np=_import_numpy()
+        def dtype(kind):
+            return { 'bool':bool, 'str':str }.get(kind,None) or \
+                getattr(np,kind)
+        return OrderedDict([
+            ( name, np.array(values,dtype=dtype(_ARRAYS[name])) )
+            for name,values in self.as_lists().items() ])
+
+    @staticmethod
+    def from_arrays(arrays):
+        """!Makes a FlatGraph from the result of as_lists(), as_arrays()
+        or load_npz()."""
+        flat=FlatGraph()
+        for name,kind in _ARRAYS.items():
+            convert={ 'bool':bool, 'str':str }.get(kind,int)
+            values=[ convert(value) for value in arrays[name] ]
+            if name=='cycles':
+                values=[ _EPOCH+timedelta(seconds=value) for value in values ]
+            setattr(flat,name,values)
+        return flat
+
+    def save_npz(self,filename,compressed=True):
+        np=_import_numpy()
+        save=np.savez_compressed if compressed else np.savez
+        save(filename,**self.as_arrays())
+
+def load_npz(filename):
+    """!Reads a file written by FlatGraph.save_npz, returning a dict of
+    numpy arrays."""
+    np=_import_numpy()
+    with np.load(filename,allow_pickle=False) as data:
+        return { key:data[key] for key in data.files }
+
+def flatten_graph(graph):
+    """!Converts every cycle added to the Graph into a FlatGraph.  Call
+    Graph.simplify_cycle first; unsimplified cycles are exported with
+    their raw dependencies."""
+    typecheck('graph',graph,Graph)
+    flat=FlatGraph()
+    ids=dict()
+    nodes=list()
+
+    # First pass: number the nodes so edges can refer to any cycle.
+    for icycle,cycle in enumerate(graph.each_cycle()):
+        flat.cycles.append(cycle)
+        stack=[ (node,-1) for node in reversed(list(
+            graph.top_level_nodes(cycle))) ]
+        while stack:
+            node,parent=stack.pop()
+            i=len(nodes)
+            ids[cycle,timeless_path(node.path)]=i
+            nodes.append((cycle,node))
+            flat.cycle_index.append(icycle)
+            flat.path.append('.'.join([ str(p) for p in node.path[1:] ]))
+            flat.is_task.append(node.is_task())
+            if not node.might_complete():
+                flat.state.append(NODE_NEVER_RUNS)
+            elif node.is_always_complete():
+                flat.state.append(NODE_ALWAYS_COMPLETE)
+            else:
+                flat.state.append(NODE_RUNS)
+            flat.time.append(int(node.time.total_seconds()))
+            flat.parent.append(parent)
+            for child in reversed(list(node)):
+                stack.append((child,i))
+
+    # Second pass: children and dependency edges, in CSR form.
+    children=[ list() for i in range(len(nodes)) ]
+    for i,parent in enumerate(flat.parent):
+        if parent>=0: children[parent].append(i)
+    for i,(cycle,node) in enumerate(nodes):
+        flat.children_indices.extend(children[i])
+        flat.children_indptr.append(len(flat.children_indices))
+        for name in [ 'trigger', 'complete' ]:
+            dep=getattr(node,name)
+            indices=getattr(flat,name+'_indices')
+            kinds=getattr(flat,name+'_kind')
+            external=0
+            if isinstance(dep,LogicalDependency):
+                for leaf in dependency_leaves(dep):
+                    path=dependency_target(leaf)
+                    kind=EDGE_EVENT if isinstance(leaf,EventDependency) \
+                         else _EDGE_KIND[leaf.state]
+                    target=ids.get((cycle+path[0],timeless_path(path)),None)
+                    if target is None:
+                        external+=1
+                    else:
+                        indices.append(target)
+                        kinds.append(kind)
+            getattr(flat,name+'_indptr').append(len(indices))
+            getattr(flat,name+'_external').append(external)
+            getattr(flat,name+'_expr').append(_expression(dep))
+    _logger.info(f'flattened {len(flat)} nodes in {len(flat.cycles)} cycles')
+    return flat
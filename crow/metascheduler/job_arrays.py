@@ -0,0 +1,115 @@
+"""!Groups the tasks generated from a TaskArray into batch system job
+arrays.
+
+Each element of a TaskArray is normally its own batch job, so a large
+ensemble means one submission per member.  The tasks generated from
+one TaskElement that request identical resources can instead be
+submitted as one job array.  Each task knows its index in the array
+from the array_index key set by TaskArrayElement._duplicate, and the
+ArrayGroup.dimension_script() shell code maps the scheduler's array
+index variable back to the task's dimension values.
+
+Rocoto and ecFlow track the state of each task's job separately, so
+to_rocoto and to_ecflow still write one task per element.  A job
+array is for workflows, or parts of them, whose members are submitted
+together by a driver script or a single wrapper task."""
+
+f'This module requires python 3.6 or newer.'
+
+import shlex, logging
+from io import StringIO
+from collections import OrderedDict
+
+from crow.tools import typecheck
+from crow.config import SuiteView
+from crow.sysenv import JobResourceSpec
+from crow.sysenv.exceptions import InvalidJobResourceSpec
+
+__all__=[ 'ArrayGroup', 'find_array_groups' ]
+
+_logger=logging.getLogger('crow')
+
+class ArrayGroup(object):
+    """!Tasks from one TaskElement in one family, all requesting the same
+    resources, that can be submitted as one job array.
+
+    @param family the SuiteView of the family holding the tasks
+    @param element path of the TaskElement that generated the tasks
+    @param resources the JobResourceSpec shared by all tasks"""
+    def __init__(self,family,element,resources):
+        self.family=family
+        self.element=element
+        self.resources=resources
+        self.tasks=list()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def indices(self):
+        """!Array indices of the tasks, in order"""
+        return [ task.array_index for task in self.tasks ]
+
+    def batch_card(self,scheduler,jobname=None,max_running=None):
+        """!Returns the scheduler's batch card for the whole array."""
+        return scheduler.batch_array_resources(
+            self.resources,self.indices(),jobname=jobname,
+            max_running=max_running)
+
+    def dimension_script(self,scheduler):
+        """!Returns sh code that sets CROW_ARRAY_TASK to the task path,
+        and CROW_DIMVAL_<dimension> and CROW_DIMIDX_<dimension> to the
+        dimension values and indices, of the array element selected
+        by the scheduler's array index variable."""
+        var=scheduler.array_index_var
+        if not var:
+            raise NotImplementedError(
+                f'{type(scheduler).__name__} does not support job arrays')
+        sio=StringIO()
+        sio.write(f'case "${{{var}}}" in\n')
+        for task in self.tasks:
+            words=[ f'CROW_ARRAY_TASK={shlex.quote(task.task_path_var)}' ]
+            for name,value in task.dimval.items():
+                words.append(f'CROW_DIMVAL_{name}={shlex.quote(str(value))}')
+            for name,value in task.dimidx.items():
+                words.append(f'CROW_DIMIDX_{name}={int(value)}')
+            sio.write(f'  {task.array_index}) export {" ".join(words)} ;;\n')
+        sio.write(f'  *) echo "${{{var}}}: not an index of this array" 1>&2'
+                  ' ; exit 1 ;;\n')
+        sio.write('esac\n')
+        ret=sio.getvalue()
+        sio.close()
+        return ret
+
+    def __repr__(self):
+        return f'ArrayGroup({self.element!r},{len(self)} tasks)'
+
+def find_array_groups(suite,resources='resources',min_size=2):
+    """!Finds the tasks generated by TaskArrays that can be collapsed into
+    job arrays.  Tasks are grouped by family and TaskElement, and
+    then split wherever the resources differ.  Disabled tasks are
+    skipped.
+
+    @param suite a Suite or SuiteView
+    @param resources name of the key with each task's JobResourceSpec
+    @param min_size smallest group to return
+    @returns a list of ArrayGroup objects"""
+    typecheck('suite',suite,SuiteView)
+    groups=OrderedDict()
+    for view in suite.walk_task_tree():
+        if not view.is_task() or 'array_index' not in view: continue
+        if view.get('Disable',False): continue
+        spec=view.get(resources,None)
+        if spec is not None and not isinstance(spec,JobResourceSpec):
+            try:
+                spec=JobResourceSpec(spec)
+            except InvalidJobResourceSpec:
+                spec=None
+        if spec is None:
+            _logger.debug(f'{view.task_path_var}: no valid {resources}; '
+                          'not part of a job array')
+            continue
+        key=( tuple(view.parent.path), view.array_element, spec )
+        if key not in groups:
+            groups[key]=ArrayGroup(view.parent,view.array_element,spec)
+        groups[key].tasks.append(view)
+    return [ group for group in groups.values() if len(group)>=min_size ]
@@ -5,7 +5,7 @@ from copy import copy
 from xml.sax.saxutils import quoteattr, escape
 
 from crow.tools import typecheck
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from collections.abc import Sequence, Mapping
 from crow.tools import to_timedelta
 import crow.sysenv
@@ -17,10 +17,13 @@ from crow.config import SuiteView, Suite, Depend, LogicalDependency, \
           CycleExistsDependency, DataEvent, ShellEvent, EventDependency, \
           document_root, update_globals
 from crow.metascheduler.algebra import simplify
+from crow.metascheduler.rocoto_cache import RocotoTaskCache, \
+     raw_fingerprint, dependency_fingerprint, Uncacheable, \
+     EvaluationTracker, ReadScope
 
 _logger=logging.getLogger('crow')
 
-__all__=['to_rocoto','RocotoConfigError','ToRocoto',
+__all__=['to_rocoto','write_rocoto','RocotoConfigError','ToRocoto',
          'SelfReferentialDependency' ]
 
 class RocotoConfigError(Exception): pass
@@ -41,6 +44,10 @@ _ROCOTO_DEP_TAG={ AndDependency:'and',
 
 _ZERO_DT=timedelta()
 
+# Stands in for the task XML in the expanded workflow_xml when the
+# tasks are streamed to a file by ToRocoto.write_workflow_xml.
+_TASK_XML_MARKER='\0CROW_ROCOTO_TASK_XML\0'
+
 def has_conditions(self,item,completes,test_alarm_name,alarm_name=None):
     if completes and 'Complete' in item:
         return True
@@ -76,38 +83,186 @@ def _has_alarms(self,item):
             if _has_alarms(subitem): return True
         return False
 
-def _entirely_in_alarm(item,desired_alarm,recursed_alarm):
-    if 'AlarmName' in item:
-        recursed_alarm=item.AlarmName
-
-    if desired_alarm!=recursed_alarm: return False
-
-    if item.is_family():
-        for subitem in item.child_iter():
-            if item.is_family() or item.is_task():
-                if not _entirely_in_alarm(
-                        subitem,desired_alarm,recursed_alarm):
-                    return False
+def _tokenize(text):
+    """!Splits text into words and single non-word characters, such
+    that ''.join(_tokenize(text))==text"""
+    return _TOKEN_RE.findall(text)
+
+_TOKEN_RE=re.compile(r'\w+|\W')
+_WORD_RE=re.compile(r'\w+\Z')
+
+def _variable_words(tokens):
+    """!Which tokens of XML text may be replaced by a metatask <var>:
+    words in element text and attribute values, but not tag names,
+    attribute names, or entity names."""
+    result=list()
+    state='text'
+    quote=None
+    after_equals=False
+    after_ampersand=False
+    for token in tokens:
+        word=bool(_WORD_RE.match(token))
+        result.append(word and state!='tag' and not after_ampersand)
+        after_ampersand = token=='&' and state!='tag'
+        if state=='text':
+            if token=='<': state='tag'
+        elif state=='tag':
+            if token in [ '"', "'" ] and after_equals:
+                state,quote='attribute',token
+            elif token=='>':
+                state='text'
+        elif token==quote:
+            state='tag'
+        if not token.isspace():
+            after_equals = token=='='
+    return result
+
+def _same_but_words(tokens,other):
+    """!Are the two token lists the same, except for words in text or
+    attribute values?  If so, both can be made from one template with
+    a metatask <var> in place of each differing word."""
+    if len(tokens)!=len(other): return False
+    for a,b,variable in zip(tokens,other,_variable_words(tokens)):
+        if a!=b and not ( variable and _WORD_RE.match(b) ):
+            return False
     return True
 
-
-def _none_are_in_alarm(item,desired_alarm,recursed_alarm):
-    if 'AlarmName' in item:
-        recursed_alarm=item.AlarmName
-
-    if desired_alarm==recursed_alarm:
-        #print(f'NAIA: {item.path}: alarm {recursed_alarm} is in alarm {desired_alarm}')
-        return False
-
-    if item.is_family() or item.is_cycle():
-        for subitem in item.child_iter():
-            if subitem.is_family() or subitem.is_task():
-                if not _none_are_in_alarm(
-                        subitem,desired_alarm,recursed_alarm):
-                    #print(f'NAIA: {item.path}: subitem {subitem.path} in alarm {desired_alarm}')
-                    return False
-    #print(f'NAIA: {item.path}: self and children not in {desired_alarm}')
-    return True
+_TAG_RE=re.compile(r'<!--.*?-->|<(/?)[A-Za-z_][^>]*?(/?)>')
+_DOCTYPE_SUBSET_END_RE=re.compile(r'<!DOCTYPE[^[>]*\[.*?(\]\s*>)',re.DOTALL)
+
+def _line_depth(line,depth):
+    """!Depth of element nesting after the line, if it started at the
+    given depth, or None if the line closes an element it did not
+    open."""
+    for match in _TAG_RE.finditer(line):
+        if match.group(0).startswith('<!--'): continue
+        if match.group(1):
+            depth-=1
+            if depth<0: return None
+        elif not match.group(2):
+            depth+=1
+    return depth
+
+def _balanced_ranges(lines,start,end):
+    """!Iterates over (first,last+1) line index ranges within
+    lines[start:end] that each hold only complete elements, so they
+    are well-formed as the text of an XML entity."""
+    while start<end:
+        depth=0
+        last_zero=start
+        i=start
+        while i<end:
+            depth=_line_depth(lines[i],depth)
+            if depth is None: break
+            i+=1
+            if depth==0: last_zero=i
+        if last_zero>start:
+            yield start,last_zero
+            start=last_zero
+        else:
+            start+=1 # cannot start a fragment on this line
+
+def _task_fragments(lines,common):
+    """!Iterates over (first,last+1) line ranges of the bodies of the
+    <task>s in lines that consist of lines in the common set, and hold
+    only complete elements.  Blank lines are trimmed from the ends."""
+    i=0
+    while i<len(lines):
+        if not lines[i].lstrip().startswith('<task '):
+            i+=1
+            continue
+        i+=1
+        while i<len(lines) and not lines[i].lstrip().startswith('</task>'):
+            if lines[i].strip() not in common:
+                i+=1
+                continue
+            run_start=i
+            while i<len(lines) and lines[i].strip() in common and \
+                  not lines[i].lstrip().startswith('</task>'):
+                i+=1
+            for first,last in _balanced_ranges(lines,run_start,i):
+                while first<last and not lines[first].strip(): first+=1
+                while last>first and not lines[last-1].strip(): last-=1
+                if last-first>1:
+                    yield first,last
+
+def _factor_entities(text,min_size,make_entity):
+    """!Replaces identical multi-line fragments of <task> bodies that
+    are at least min_size characters long with entity references.
+
+    @param text the task XML
+    @param min_size minimum length of a fragment's text
+    @param make_entity function that receives a fragment's text, and
+      returns the text that replaces the fragment
+    @returns the new task XML"""
+    lines=text.split('\n')
+
+    # Lines that appear in more than one task:
+    seen=dict()
+    task=0
+    for line in lines:
+        stripped=line.strip()
+        if stripped.startswith('<task '): task+=1
+        if seen.get(stripped,task)!=task:
+            seen[stripped]=None
+        elif stripped not in seen:
+            seen[stripped]=task
+    common=set([ line for line,task in seen.items() if task is None ])
+
+    def fragment_text(first,last):
+        return '\n'.join([ line.strip() for line in lines[first:last] ])
+
+    count=dict()
+    fragments=list(_task_fragments(lines,common))
+    for first,last in fragments:
+        fragment=fragment_text(first,last)
+        count[fragment]=count.get(fragment,0)+1
+
+    replaced=list()
+    prior=0
+    for first,last in fragments:
+        fragment=fragment_text(first,last)
+        if count[fragment]<2 or len(fragment)<min_size: continue
+        indent=lines[first][:len(lines[first])-len(lines[first].lstrip())]
+        replaced.extend(lines[prior:first])
+        replaced.append(indent+make_entity(fragment))
+        prior=last
+    replaced.extend(lines[prior:])
+    return '\n'.join(replaced)
+
+class _AlarmTree(object):
+    """!Tree of the tasks and families of a suite, for computing the
+    final task dependencies.  Each node knows the alarms used in its
+    tree, which are gathered in a single bottom-up pass.
+
+    * alarms --- alarms of the node and its task and family
+      descendants; if for_alarm is not in there, none are in the alarm
+    * all_alarms --- alarms of the node and all descendants of nested
+      families; if it is {for_alarm}, the node is entirely in the alarm
+
+    Nodes with no alarm have the alarm name ''."""
+    def __init__(self,view,alarm_name):
+        if 'AlarmName' in view:
+            alarm_name=view.AlarmName
+        self.view=view
+        self.path=SuitePath(view.path[1:])
+        self.is_task=view.is_task()
+        self.is_family=view.is_family()
+        self.disabled=bool(( 'Disable' in view and view.Disable ) or \
+                           ( 'Dummy' in view and view.Dummy ))
+        self.alarms={ alarm_name }
+        self.all_alarms={ alarm_name }
+        self.children=list()
+        if self.is_family or view.is_cycle():
+            for subitem in view.child_iter():
+                self.add_child(_AlarmTree(subitem,alarm_name))
+
+    def add_child(self,child):
+        self.children.append(child)
+        if child.is_family or child.is_task:
+            self.alarms.update(child.alarms)
+        if self.is_family:
+            self.all_alarms.update(child.all_alarms)
 
 def stringify_clock(name,clock,indent):
     start_time=clock.start.strftime('%Y%m%d%H%M')
@@ -229,12 +384,27 @@ class ToRocoto(object):
             raise TypeError("Suite's Rocoto.indent_text, if present, "
                             "must be a string.")
         self.__dummy_var_count=0
+        self.__array_metatask_count=0
+        self.__array_metatasks=bool(
+            suite.Rocoto.get('task_array_metatasks',False))
+
+        self.__task_cache=None
+        if suite.Rocoto.get('task_cache_file',None):
+            self.__task_cache=RocotoTaskCache(
+                str(suite.Rocoto.task_cache_file))
+        self.__context_fingerprint=None
+        self.__family_fingerprints=dict()
+        self.__read_scopes=dict()
 
         self.__families_with_completes=set()
         self.__families_with_alarms=set()
 
         self.__alarms_used=set()
 
+        # Indent levels of make_task_xml calls whose output is
+        # streamed by write_workflow_xml, or None when not streaming.
+        self.__streamed_task_xml=None
+
     def defenvar(self,name,value,literal=False):
         if literal:
             return f'<envar><name>{name}</name><value>{value}</value></envar>'
@@ -248,6 +418,7 @@ class ToRocoto(object):
 
     def defvar(self,name,value,literal=False):
         if literal:
+            value=str(value).replace('%','&#37;').replace('"','&#34;')
             value=f'"{value}"'
         else:
             value=quoteattr(str(value))
@@ -269,7 +440,91 @@ class ToRocoto(object):
             return sio.getvalue()
 
     def make_task_xml(self,indent=1):
+        if self.__streamed_task_xml is not None:
+            # write_workflow_xml will write the tasks in place of this
+            self.__streamed_task_xml.append(indent)
+            return _TASK_XML_MARKER
         fd=StringIO()
+        self._write_task_xml(fd,indent)
+        result=fd.getvalue()
+        fd.close()
+        return result
+
+    def write_workflow_xml(self,fd):
+        """!Writes the workflow_xml to fd.  The task XML is written
+        directly to fd as each task is converted, instead of being
+        accumulated in a string first."""
+        self.__streamed_task_xml=list()
+        try:
+            text=self._expand_workflow_xml()
+            indents=self.__streamed_task_xml
+        finally:
+            self.__streamed_task_xml=None
+            # The cached text has markers in place of the tasks.
+            invalidate_cache(self.settings,'workflow_xml')
+        pieces=text.split(_TASK_XML_MARKER)
+        if len(pieces)!=len(indents)+1:
+            raise RocotoConfigError('workflow_xml: unexpected use of '
+                                    'make_task_xml result')
+        min_size=int(self.settings.get('entity_threshold',0))
+        if min_size:
+            self._write_factored_workflow_xml(fd,pieces,indents,min_size)
+        else:
+            fd.write(pieces[0])
+            for indent,piece in zip(indents,pieces[1:]):
+                self._write_task_xml(fd,indent)
+                fd.write(piece)
+        if self.__task_cache is not None:
+            self.__task_cache.save()
+
+    def _write_factored_workflow_xml(self,fd,pieces,indents,min_size):
+        """!Writes the workflow XML with repeated fragments of tasks
+        replaced by entities declared in the DOCTYPE.  The task XML
+        must be held in memory to find the repeats."""
+        head=pieces[0]
+        match=_DOCTYPE_SUBSET_END_RE.search(head)
+        if match:
+            insert_at=match.start(1)
+            head_format='{declarations}'
+        elif '<!DOCTYPE' not in head and '<workflow' in head:
+            insert_at=head.index('<workflow')
+            head_format='<!DOCTYPE workflow [\n{declarations}]>\n'
+        else:
+            _logger.warning('workflow_xml: no DOCTYPE internal subset to '
+                            'receive entities; will not factor task XML.')
+            insert_at=None
+
+        entities=OrderedDict() # fragment text -> entity name
+        def make_entity(fragment):
+            if fragment not in entities:
+                entities[fragment]=f'crow_fragment_{len(entities)+1}'
+            return self.varref(entities[fragment])
+
+        task_xml=list()
+        for indent in indents:
+            with StringIO() as sio:
+                self._write_task_xml(sio,indent)
+                task_xml.append(sio.getvalue())
+        if insert_at is not None:
+            SEPARATOR='\n<!-- CROW_TASK_XML_SEPARATOR -->\n'
+            task_xml=_factor_entities(SEPARATOR.join(task_xml),min_size,
+                                      make_entity).split(SEPARATOR)
+            _logger.info(f'workflow_xml: {len(entities)} repeated fragments '
+                         'of tasks replaced with entities')
+        if entities:
+            declarations=''.join([
+                f'{self.__spacing}{self.defvar(name,fragment,literal=True)}\n'
+                for fragment,name in entities.items() ])
+            head=head[:insert_at] + \
+                 head_format.format(declarations=declarations) + \
+                 head[insert_at:]
+
+        fd.write(head)
+        for xml,piece in zip(task_xml,pieces[1:]):
+            fd.write(xml)
+            fd.write(piece)
+
+    def _write_task_xml(self,fd,indent):
         self._record_item(self.suite,FALSE_DEPENDENCY,'')
 
         # Find all families that have tasks with completes:
@@ -287,9 +542,6 @@ class ToRocoto(object):
         self._convert_item(fd,max(0,indent-1),self.suite,TRUE_DEPENDENCY,
                            FALSE_DEPENDENCY,timedelta.min,'')
         self._handle_final_task(fd,indent)
-        result=fd.getvalue()
-        fd.close()
-        return result
 
     # ----------------------------------------------------------------
 
@@ -454,7 +706,11 @@ class ToRocoto(object):
             maxtries=int(view.get(
                 'max_tries',self.suite.Rocoto.get('max_tries',0)))
             attr = f' maxtries="{maxtries}"' if maxtries else ''
-            self._write_task_text(fd,attr,indent,view,dep,time,alarm_name)
+            if self.__task_cache is None:
+                self._write_task_text(fd,attr,indent,view,dep,time,alarm_name)
+            else:
+                self._write_cached_task_text(
+                    fd,attr,indent,view,dep,time,alarm_name)
             return
 
         self.__dummy_var_count+=1
@@ -469,6 +725,7 @@ class ToRocoto(object):
             fd.write(f'''>
 {space*indent}  <var name="{dummy_var}">DUMMY_VALUE</var>
 ''')
+        array_tasks=list() # token lists of consecutive TaskArray tasks
         for key,child in view.items():
             if key in [ 'up', 'this' ]: continue
             if not isinstance(child,SuiteView):
@@ -479,12 +736,136 @@ class ToRocoto(object):
                         'The "final" task must be a Task, not a '
                         +type(child.viewed).__name__)
                 self.__final_task=child
+            elif self.__array_metatasks and child.is_task() and \
+                 'dimval' in child:
+                with StringIO() as sio:
+                    self._convert_item(sio,indent+1,child,trigger,complete,
+                                       time,alarm_name)
+                    tokens=_tokenize(sio.getvalue())
+                if not tokens: continue # disabled or dummy
+                if array_tasks and not _same_but_words(array_tasks[0],tokens):
+                    self._write_array_tasks(fd,indent+1,path,array_tasks)
+                    array_tasks=list()
+                array_tasks.append(tokens)
             else:
+                self._write_array_tasks(fd,indent+1,path,array_tasks)
+                array_tasks=list()
                 self._convert_item(fd,indent+1,child,trigger,complete,time,alarm_name)
+        self._write_array_tasks(fd,indent+1,path,array_tasks)
 
         if not isinstance(view,Suite):
             fd.write(f'{space*indent}</metatask>\n')
 
+    def _task_fingerprint(self,attr,indent,view,dependency,time,alarm_name):
+        """!Fingerprint of everything that determines the text written by
+        _write_task_text, for the RocotoTaskCache.  Returns None if
+        some input has no stable representation."""
+        try:
+            if self.__context_fingerprint is None:
+                context=[ raw_fingerprint(document_root(self.suite),True),
+                          self.__spacing ]
+                for item in self.suite.walk_task_tree():
+                    context.append(f'{item.path}:{item.is_task()}')
+                for path,(item,complete) in self.__completes.items():
+                    context.append(f'{path}:{complete!r}')
+                self.__context_fingerprint=raw_fingerprint(context)
+            parts=[ self.__context_fingerprint ]
+            family=view.parent
+            while True:
+                key=family.path
+                if key not in self.__family_fingerprints:
+                    self.__family_fingerprints[key]=raw_fingerprint(
+                        family,skip_tasks=True)
+                parts.append(self.__family_fingerprints[key])
+                if isinstance(family,Suite): break
+                family=family.parent
+            parts.extend([ raw_fingerprint(view),
+                           dependency_fingerprint(dependency),
+                           attr, str(indent), str(time), alarm_name ])
+            return raw_fingerprint(parts)
+        except Uncacheable as uc:
+            _logger.debug(f'{view.task_path_var}: not cached: {uc}')
+            return None
+
+    def _read_scopes(self,view):
+        """!ReadScope objects for the inputs of a task's fingerprint:
+        the task, the document outside the suite, and the non-task
+        contents of each family above it.  All but the task's own are
+        shared by all tasks."""
+        scopes=[ ReadScope(view) ]
+        doc=view.viewed._get_globals()['doc']
+        if id(doc) not in self.__read_scopes:
+            self.__read_scopes[id(doc)]=( doc, ReadScope(doc,True) )
+        scopes.append(self.__read_scopes[id(doc)][1])
+        family=view.parent
+        while True:
+            key=family.path
+            if key not in self.__read_scopes:
+                self.__read_scopes[key]=( family, ReadScope(family,True) )
+            scopes.append(self.__read_scopes[key][1])
+            if isinstance(family,Suite): break
+            family=family.parent
+        return scopes
+
+    def _write_cached_task_text(self,fd,attr,indent,view,dependency,time,
+                                alarm_name):
+        """!Same as _write_task_text, but reuses the text from the
+        RocotoTaskCache if the task's inputs did not change."""
+        fingerprint=self._task_fingerprint(
+            attr,indent,view,dependency,time,alarm_name)
+        text=None
+        if fingerprint is not None:
+            text=self.__task_cache.get(fingerprint)
+        if text is None and fingerprint is None:
+            with StringIO() as sio:
+                self._write_task_text(sio,attr,indent,view,dependency,time,
+                                      alarm_name)
+                text=sio.getvalue()
+        elif text is None:
+            with StringIO() as sio, EvaluationTracker() as tracker:
+                self._write_task_text(sio,attr,indent,view,dependency,time,
+                                      alarm_name)
+                text=sio.getvalue()
+            outside=next(tracker.outside_reads(
+                *self._read_scopes(view)),None)
+            if outside is None:
+                self.__task_cache.put(fingerprint,text)
+            else:
+                _logger.debug(f'{view.task_path_var}: not cached: {outside}')
+        elif alarm_name:
+            self.__alarms_used.add(alarm_name)
+        fd.write(text)
+
+    def _write_array_tasks(self,fd,indent,family_path,array_tasks):
+        """!Writes the tasks generated from a TaskArray.  If there are
+        several, they are written as one <metatask> whose <var>s hold
+        the words that differ between them.  Rocoto expands that
+        metatask back into the original tasks."""
+        if not array_tasks: return
+        if len(array_tasks)==1:
+            fd.write(''.join(array_tasks[0]))
+            return
+        space=self.__spacing
+        self.__array_metatask_count+=1
+        count=self.__array_metatask_count
+        template=list(array_tasks[0])
+        var_names=OrderedDict() # word lists -> var name
+        for i in range(len(template)):
+            words=tuple([ tokens[i] for tokens in array_tasks ])
+            if len(set(words))<2: continue
+            if words not in var_names:
+                var_names[words]=f'crow_array_{count}_{len(var_names)+1}'
+            template[i]=f'#{var_names[words]}#'
+        name=f'{family_path}.crow_array_{count}' if family_path \
+             else f'crow_array_{count}'
+        fd.write(f'{space*indent}<metatask name="{name}">\n')
+        for words,name in var_names.items():
+            fd.write(f'{space*(indent+1)}<var name="{name}">'
+                     f'{" ".join(words)}</var>\n')
+        for line in ''.join(template).splitlines(True):
+            fd.write(space+line)
+        fd.write(f'{space*indent}</metatask>\n')
+
     def _write_task_text(self,fd,attr,indent,view,dependency,time,alarm_name,
                          manual_dependency=None):
         assert(view is not None)
@@ -589,7 +970,7 @@ class ToRocoto(object):
 
         return dep
 
-    def _final_task_deps_for_alarm(self,item,for_alarm,alarm_name=''):
+    def _final_task_deps_for_alarm(self,node,for_alarm):
         # For tasks:
         #   item is not in alarm 
         #     OR
@@ -606,25 +987,20 @@ class ToRocoto(object):
         #   entirety of family is not in alarm
         #     OR
         #   final_task_deps... for any children are not met
-        if 'AlarmName' in item:
-            alarm_name=item.AlarmName
-
-        path=SuitePath(item.path[1:])
+        #
+        # The node is an _AlarmTree, which knows the alarms of its
+        # entire tree, so no subtree is walked more than once.
+        item=node.view
+        path=node.path
         with_completes=self.__families_with_completes
-        with_alarms=self.__families_with_alarms
 
         # Disabled applies recursively to families, so if this node is
         # disabled, the netire tree is done:
-        if 'Disable' in item and item.Disable:
-            #print(f'{path}: disabled')
-            return TRUE_DEPENDENCY
-        if 'Dummy' in item and item.Dummy:
-            #print(f'{path}: dummy')
+        if node.disabled:
             return TRUE_DEPENDENCY
         
         # If nothing in the entire tree is in the alarm, then we're done.
-        if _none_are_in_alarm(item,for_alarm,alarm_name):
-            #print(f'{path}: entire tree is not in alarm')
+        if for_alarm not in node.alarms:
             return TRUE_DEPENDENCY
 
         if len(path)==1 and '_is_final_' in path:
@@ -635,15 +1011,14 @@ class ToRocoto(object):
             if item.path in self.__completes:
                 dep = dep | self.__completes[item.path][1]
 
-            if item.is_task():
+            if node.is_task:
                 # No children.  We're done.
-                #print(f'{path}: task dep {dep}')
                 return dep
         else:
             # This is a suite.
             dep=FALSE_DEPENDENCY
 
-        if path and _entirely_in_alarm(item,for_alarm,alarm_name) and \
+        if path and node.all_alarms=={for_alarm} and \
            path not in with_completes:
             # Families with no "complete" dependency in their entire
             # tree have no further dependencies to identify.  Their
@@ -652,18 +1027,13 @@ class ToRocoto(object):
             return dep
 
         subdep=TRUE_DEPENDENCY
-        for subitem in item.child_iter():
-            dep2=self._final_task_deps_for_alarm(
-                subitem,for_alarm,alarm_name)
-            subdep=subdep & dep2
-            del dep2
-
+        for child in node.children:
+            subdep=subdep & self._final_task_deps_for_alarm(child,for_alarm)
 
         if subdep is not TRUE_DEPENDENCY:
             dep=subdep
             if item.path in self.__completes:
                 dep = self.__completes[item.path][1] | subdep
-        #print(f'{path}: family or suite dep {dep}')
         return dep
 
     def _handle_final_task(self,fd,indent):
@@ -706,11 +1076,12 @@ class ToRocoto(object):
 {self.__spacing*(indent+1)}<!-- All tasks must be complete or invalid for this cycle -->\n'''
         alarms = set(self.__alarms_used)
         alarms.add('')
+        tree = _AlarmTree(self.suite,'')
         # Reverse-sort the alarm names so the final tasks show up in
         # the same order each time, with the task "final" at the end.
         for alarm_name in reversed(sorted(alarms)):
             #print(f'find final for {alarm_name}')
-            dep = self._final_task_deps_for_alarm(self.suite,alarm_name)
+            dep = self._final_task_deps_for_alarm(tree,alarm_name)
             dep = simplify(dep)
             task_name=f'final_for_{alarm_name}' if alarm_name else 'final_no_alarm'
             new_task=copy(self.suite.final.viewed)
@@ -722,6 +1093,7 @@ class ToRocoto(object):
             del new_task
             self.__all_defined.add(SuitePath(
                 [_ZERO_DT] + new_task_view.path[1:]))
+            tree.add_child(_AlarmTree(new_task_view,''))
             assert( dep is not FALSE_DEPENDENCY )
             self._write_task_text(fd,'',indent,new_task_view,
                                   dep,timedelta.min,alarm_name)
@@ -737,7 +1109,17 @@ class ToRocoto(object):
             manual_dependency=manual_dependency)
 def to_rocoto(suite,apply_overrides=True):
     typecheck('suite',suite,Suite)
-    return ToRocoto(suite,apply_overrides=apply_overrides)._expand_workflow_xml()
+    with StringIO() as sio:
+        ToRocoto(suite,apply_overrides=apply_overrides).write_workflow_xml(sio)
+        return sio.getvalue()
+
+def write_rocoto(suite,fd,apply_overrides=True):
+    """!Writes the Rocoto XML for the suite to the file object fd.
+    Same result as fd.write(to_rocoto(suite)), but tasks are written
+    as they are generated, so the document is never held in memory.
+    (Except for the task XML, if Rocoto.entity_threshold is set.)"""
+    typecheck('suite',suite,Suite)
+    ToRocoto(suite,apply_overrides=apply_overrides).write_workflow_xml(fd)
 
 def test():
     def to_string(action):
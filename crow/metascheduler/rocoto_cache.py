@@ -0,0 +1,246 @@
+"""!On-disk cache of the <task> XML generated by ToRocoto, so that
+regenerating a workflow after a small configuration change only
+re-renders the tasks affected by it.
+
+Each task's text is stored under a fingerprint of everything that
+goes into it:
+
+* the task's raw (unevaluated) configuration, including events and
+  anything merged into it by YAML anchors or Inherit
+* the raw non-task contents of each family above it, up to the suite
+* the dependency, time, alarm, and attributes passed to the writer
+* the raw document outside of the suite, the set of tasks in the
+  suite, and their completion conditions
+
+Values that a task's expressions read from another task's
+configuration, and expressions that depend on the environment (ENV,
+tools.env, tools.isfile and the like), are not part of the
+fingerprint.  Hence, when a task is rendered, an EvaluationTracker
+records every configuration value its expressions read, and the task
+is only cached if all of them are in the inputs listed above.
+
+The cache only holds entries used by the last generation, so it does
+not grow without bound."""
+
+f'This module requires python 3.6 or newer.'
+
+import os, re, json, logging, hashlib, datetime, tempfile
+from collections.abc import Mapping, Sequence
+
+from crow.tools import Clock, NamedConstant
+from crow.config import SuiteView, Taskable, Cycle, EventDependency, \
+     AndDependency, OrDependency, NotDependency
+from crow.config.tasks import TaskArray, TaskArrayElement
+from crow.config.eval_tools import recording_reads
+
+__all__=[ 'RocotoTaskCache', 'raw_fingerprint', 'dependency_fingerprint',
+          'Uncacheable', 'EvaluationTracker', 'ReadScope' ]
+
+_logger=logging.getLogger('crow')
+
+class Uncacheable(Exception):
+    """!Raised when a value has no stable text representation, so it
+    cannot be part of a fingerprint."""
+
+_SIMPLE_TYPES=( int, float, bool, type(None), datetime.datetime,
+                datetime.timedelta, Clock, NamedConstant )
+
+def _is_task_like(value):
+    return isinstance(value,(Taskable,TaskArray,TaskArrayElement,Cycle,
+                             SuiteView))
+
+def _update_raw(digest,value,skip_tasks,stack):
+    if isinstance(value,SuiteView):
+        value=value.viewed
+    if id(value) in stack:
+        digest.update(b'<recursion>')
+        return
+    if isinstance(value,str):
+        digest.update(f'{type(value).__name__}:{str(value)!r};'.encode('utf-8'))
+    elif isinstance(value,_SIMPLE_TYPES):
+        digest.update(f'{type(value).__name__}:{value!r};'.encode('utf-8'))
+    elif hasattr(value,'_raw_child') or isinstance(value,(Mapping,Sequence)):
+        stack.add(id(value))
+        child=value._raw_child() if hasattr(value,'_raw_child') else value
+        if isinstance(child,Mapping):
+            digest.update(f'{type(value).__name__}{{'.encode('utf-8'))
+            for key in sorted(child.keys(),key=str):
+                if key in [ 'up', 'this' ]: continue
+                item=child[key]
+                if skip_tasks and _is_task_like(item): continue
+                digest.update(f'{key!r}:'.encode('utf-8'))
+                _update_raw(digest,item,False,stack)
+            digest.update(b'}')
+        else:
+            digest.update(f'{type(value).__name__}['.encode('utf-8'))
+            for item in child:
+                _update_raw(digest,item,False,stack)
+            digest.update(b']')
+        stack.remove(id(value))
+    else:
+        text=repr(value)
+        if ' at 0x' in text:
+            raise Uncacheable(f'{type(value).__name__}: no stable '
+                              'representation')
+        digest.update(f'{type(value).__name__}:{text};'.encode('utf-8'))
+
+def raw_fingerprint(value,skip_tasks=False):
+    """!Returns a sha256 hex digest of the raw contents of a
+    configuration object, without evaluating any expressions.
+
+    @param value a dict_eval, list_eval, SuiteView, or simple value
+    @param skip_tasks if True, tasks, families, and suites in the top
+      level of value are not included
+    @raise Uncacheable if a value has no stable representation"""
+    digest=hashlib.sha256()
+    _update_raw(digest,value,skip_tasks,set())
+    return digest.hexdigest()
+
+def _update_dependency(digest,dep,stack):
+    if isinstance(dep,EventDependency):
+        # The event's file or command is written into the dependency.
+        _update_raw(digest,dep.event,False,stack)
+    elif isinstance(dep,AndDependency) or isinstance(dep,OrDependency):
+        for subdep in dep.depends:
+            _update_dependency(digest,subdep,stack)
+    elif isinstance(dep,NotDependency):
+        _update_dependency(digest,dep.depend,stack)
+
+def dependency_fingerprint(dep):
+    """!Returns a sha256 hex digest of a dependency tree, including the
+    raw contents of the events it refers to."""
+    digest=hashlib.sha256()
+    digest.update(repr(dep).encode('utf-8'))
+    _update_dependency(digest,dep,set())
+    return digest.hexdigest()
+
+## Expressions that read the environment or the filesystem, whose
+## results can change without any change to the configuration
+_ENVIRONMENT_RE=re.compile(
+    r'\bENV\b|\btools\s*\.\s*(?:env|have_env|isdir|isfile|islink|exists|'
+    r'readlink|realpath|abspath|can_write|machine_name)\b|'
+    r'\b(?:os|sys|subprocess|time|random)\s*\.|'
+    r'\b(?:now|utcnow|today)\s*\(')
+
+def _add_containers(ids,paths,value,skip_tasks):
+    if isinstance(value,SuiteView):
+        value=value.viewed
+    if id(value) in ids or isinstance(value,(str,)+_SIMPLE_TYPES):
+        return
+    if not hasattr(value,'_raw_child') and \
+       not isinstance(value,(Mapping,Sequence)):
+        return
+    ids.add(id(value))
+    if getattr(value,'_path',''):
+        paths.add(value._path)
+    child=value._raw_child() if hasattr(value,'_raw_child') else value
+    items=child.items() if isinstance(child,Mapping) else enumerate(child)
+    for key,item in items:
+        if key in [ 'up', 'this' ]: continue
+        if skip_tasks and _is_task_like(item): continue
+        _add_containers(ids,paths,item,False)
+
+class ReadScope(object):
+    """!The containers in the raw contents of a configuration value,
+    and copies of them, for EvaluationTracker.outside_reads.  Building
+    one walks the whole value, so reuse it for many tasks.
+
+    @param value a dict_eval, list_eval, or SuiteView
+    @param skip_tasks if True, containers in the tasks, families, and
+      suites in the top level of value are not included"""
+    def __init__(self,value,skip_tasks=False):
+        self.ids=set()
+        self.paths=set()
+        _add_containers(self.ids,self.paths,value,skip_tasks)
+
+    def __contains__(self,container):
+        if id(container) in self.ids: return True
+        path=getattr(container,'_path','')
+        return bool(path) and path in self.paths
+
+class EvaluationTracker(object):
+    """!Records the configuration values this thread reads in a with
+    block, through recording_reads.  Values whose expressions were
+    evaluated and cached before the block are still recorded, with
+    the values those expressions read."""
+    def __init__(self):
+        self.reads=list() # (container, key, raw value)
+        self.__recording=None
+
+    def __enter__(self):
+        self.__recording=recording_reads(self.reads)
+        self.__recording.__enter__()
+        return self
+
+    def __exit__(self,*args):
+        recording,self.__recording=self.__recording,None
+        return recording.__exit__(*args)
+
+    def outside_reads(self,*scopes):
+        """!Iterates over a description of each recorded read that is
+        not inside one of the scopes, and of each expression read that
+        depends on the environment.
+
+        @param scopes ReadScope objects"""
+        seen=set()
+        for container,key,raw in self.reads:
+            if ( id(container), key ) in seen: continue
+            seen.add(( id(container), key ))
+            path=getattr(container,'_path','')
+            if not any([ container in scope for scope in scopes ]):
+                yield f'reads {path}.{key}'
+            elif hasattr(raw,'_result') and isinstance(raw,str) and \
+                 _ENVIRONMENT_RE.search(raw):
+                yield f'{path}.{key} depends on the environment'
+
+class RocotoTaskCache(object):
+    """!Maps task fingerprints to rendered <task> XML, stored in a JSON
+    file.
+
+    @param filename the cache file; need not exist"""
+    VERSION=1
+
+    def __init__(self,filename):
+        self.filename=filename
+        self.hits=0
+        self.misses=0
+        self.__old=dict()
+        self.__used=dict()
+        if not os.path.exists(filename):
+            _logger.info(f'{filename}: no Rocoto task cache yet')
+            return
+        try:
+            with open(filename,'rt') as fd:
+                data=json.load(fd)
+        except ValueError as ve:
+            _logger.warning(f'{filename}: cannot read cache: {ve}')
+            return
+        if data.get('version',None)==self.VERSION:
+            self.__old=data['tasks']
+
+    def get(self,fingerprint):
+        """!Returns the cached text for the fingerprint, or None"""
+        text=self.__old.get(fingerprint,self.__used.get(fingerprint,None))
+        if text is None:
+            self.misses+=1
+        else:
+            self.hits+=1
+            self.__used[fingerprint]=text
+        return text
+
+    def put(self,fingerprint,text):
+        self.__used[fingerprint]=text
+
+    def save(self):
+        """!Writes the entries used since the cache was read, replacing
+        the file atomically."""
+        dirname=os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(dirname,exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'wt',dir=dirname,prefix=os.path.basename(self.filename)+'.',
+                delete=False) as fd:
+            json.dump({ 'version':self.VERSION, 'tasks':self.__used },fd)
+            tempname=fd.name
+        os.replace(tempname,self.filename)
+        _logger.info(f'{self.filename}: Rocoto task cache: {self.hits} '
+                     f'reused, {self.misses} rendered')
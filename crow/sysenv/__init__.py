@@ -1,6 +1,6 @@
 from .jobs import JobResourceSpec, JobRankSpec, MAXIMUM_THREADS
-from .nodes import NodeSpec, GenericNodeSpec, node_tool_for
-from .shell import ShellCommand
+from .nodes import NodeSpec, GenericNodeSpec, NodePlacement, node_tool_for
+from .shell import ShellCommand, CommandPool
 from .exceptions import UnknownSchedulerError
 from .schedulers import get_scheduler, has_scheduler
 from .parallelism import get_parallelism, has_parallelism
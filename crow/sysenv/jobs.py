@@ -3,6 +3,7 @@ from abc import abstractmethod
 from collections import UserList, Mapping, Sequence, OrderedDict
 from subprocess import Popen, PIPE, CompletedProcess
 from crow.sysenv.exceptions import InvalidJobResourceSpec
+from crow.tools import memory_in_bytes
 
 __all__=['JobRankSpec','JobResourceSpec']
 
@@ -15,9 +16,36 @@ MISSING=object() # special constant for missing arguments
 
 MAXIMUM_THREADS=sys.maxsize
 
+def megabytes(value):
+    """!Converts a memory amount to megabytes.  Numbers, and strings
+    that are numbers, are already in megabytes.  Other strings have
+    units, as understood by crow.tools.memory_in_bytes: 3G, 500M, and
+    so on."""
+    if isinstance(value,str):
+        try:
+            return float(value)
+        except ValueError:
+            return memory_in_bytes(value)/1048576.
+    return float(value)
+
+def _freeze(value):
+    """!Returns a hashable equivalent of a value in a JobRankSpec:
+    sequences become tuples and mappings become sorted tuples of
+    (key,value) pairs."""
+    if isinstance(value,str):
+        return value
+    if isinstance(value,Mapping):
+        return tuple(sorted([ (k,_freeze(v)) for k,v in value.items() ],
+                            key=lambda kv: str(kv[0])))
+    if isinstance(value,Sequence):
+        return tuple([ _freeze(v) for v in value ])
+    return value
+
 ########################################################################
 
 class JobRankSpec(Mapping):
+    """!Resources for one block of MPI ranks.  Immutable and hashable,
+    so it can be shared between JobResourceSpecs and used as a key."""
     OPTIONAL_ATTRIBUTES=[
         'walltime', 'memory', 'outerr', 'stdout', 'stderr', 'jobname',
         'batch_memory', 'compute_memory', 'lsf_affinity' ]
@@ -42,9 +70,9 @@ class JobRankSpec(Mapping):
             'separate_node':separate_node,
             'hyperthreads':int(hyperthreads),
             'OMP_NUM_THREADS':max(0,int(OMP_NUM_THREADS)),
-            'memory_per_rank':max(1,float(memory_per_rank)),
+            'memory_per_rank':max(1,megabytes(memory_per_rank)),
             'exe':( None if exe is MISSING else exe ),
-            'args':( [] if args is MISSING else list(args) ) }
+            'args':( () if args is MISSING else tuple(args) ) }
 
         if max_ppn is not MISSING:
             self.__spec['max_ppn']=int(max_ppn)
@@ -55,6 +83,8 @@ class JobRankSpec(Mapping):
                 raise TypeError(f'Unknown argument {key}')
             self.__spec[key]=value
 
+        self.__hash=None
+
         if not isinstance(exe,str) and exe is not MISSING and \
            exe is not None:
             raise TypeError('exe must be a string, not a %s'%(
@@ -77,9 +107,9 @@ class JobRankSpec(Mapping):
     def is_mpi(self):         return self['mpi_ranks']>0
 
     def simplify(self,adapt):
-        js=JobRankSpec(**self.__spec)
-        adapt(js.__spec)
-        return js
+        spec=dict(self.__spec)
+        adapt(spec)
+        return JobRankSpec(**spec)
 
     def new_with(self,*args,**kwargs):
         """!Creates a new JobRankSpec with the given modifications.  The
@@ -90,10 +120,36 @@ class JobRankSpec(Mapping):
 
     # Nicities
     def __getattr__(self,key):
+        if key.startswith('_JobRankSpec__'):
+            raise AttributeError(key)
         if key in self:
             return self[key]
         raise AttributeError(key)
 
+    def __setattr__(self,key,value):
+        if not key.startswith('_JobRankSpec__'):
+            raise AttributeError(f'{type(self).__name__} is immutable')
+        object.__setattr__(self,key,value)
+
+    # Immutable, so copies are unneeded:
+    def __copy__(self):           return self
+    def __deepcopy__(self,memo):  return self
+
+    def __frozen(self):
+        return tuple(sorted([ (k,_freeze(v)) for k,v in self.__spec.items() ]))
+    def __hash__(self):
+        if self.__hash is None:
+            self.__hash=hash(self.__frozen())
+        return self.__hash
+    def __eq__(self,other):
+        # Not equal to plain mappings, whose hashes would differ.
+        if not isinstance(other,JobRankSpec):
+            return NotImplemented
+        return self is other or ( hash(self)==hash(other) and
+                                  self.__frozen()==other.__frozen() )
+    def __ne__(self,other):
+        return not self==other
+
     # Implement Mapping abstract methods:
     def __getitem__(self,key):    return self.__spec[key]
     def __len__(self):            return len(self.__spec)
@@ -110,22 +166,49 @@ class JobRankSpec(Mapping):
 ########################################################################
 
 class JobResourceSpec(Sequence):
+    """!An immutable, hashable sequence of JobRankSpec objects, one per
+    block of ranks in a job."""
     def __init__(self,specs):
         try:
-            self.__specs=[ JobRankSpec(**spec) for spec in specs ]
+            self.__specs=tuple([
+                spec if isinstance(spec,JobRankSpec) else JobRankSpec(**spec)
+                for spec in specs ])
         except(ValueError,TypeError,IndexError) as e:
             raise InvalidJobResourceSpec("Invalid resource specification:"+
                                       repr(specs))
+        self.__hash=None
 
     # Implement Sequence abstract methods:
     def __getitem__(self,index): return self.__specs[index]
     def __len__(self):           return len(self.__specs)
 
+    def __setattr__(self,key,value):
+        if not key.startswith('_JobResourceSpec__'):
+            raise AttributeError(f'{type(self).__name__} is immutable')
+        object.__setattr__(self,key,value)
+
+    # Immutable, so copies are unneeded:
+    def __copy__(self):           return self
+    def __deepcopy__(self,memo):  return self
+
+    def __hash__(self):
+        if self.__hash is None:
+            self.__hash=hash(self.__specs)
+        return self.__hash
+    def __eq__(self,other):
+        if not isinstance(other,JobResourceSpec):
+            return NotImplemented
+        return self is other or self.__specs==other.__specs
+    def __ne__(self,other):
+        return not self==other
+
     def simplify(self,adapt_resource_spec,adapt_rank_spec):
-        new=JobResourceSpec(
-            [ spec.simplify(adapt_rank_spec) for spec in self ])
-        adapt_resource_spec(new.__specs)
-        return new
+        """!Returns a new JobResourceSpec.  Each rank is passed through
+        JobRankSpec.simplify(adapt_rank_spec), and then the list of
+        ranks is modified in-place by adapt_resource_spec."""
+        specs=[ spec.simplify(adapt_rank_spec) for spec in self ]
+        adapt_resource_spec(specs)
+        return JobResourceSpec(specs)
 
     def has_threads(self):
         return any([ spec.is_openmp() for spec in self])
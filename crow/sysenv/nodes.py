@@ -1,14 +1,23 @@
 import crow.tools
+import itertools
+from fractions import Fraction
 from abc import abstractmethod
 from collections import UserList, Mapping, Sequence, OrderedDict
 from subprocess import Popen, PIPE, CompletedProcess
-from crow.sysenv.jobs import MAXIMUM_THREADS
+from crow.sysenv.jobs import MAXIMUM_THREADS, JobResourceSpec, megabytes
 from crow.sysenv.util import ranks_to_nodes_ppn
 from crow.tools import typecheck
 from crow.sysenv.exceptions import *
 
 def noop(*args,**kwargs): pass
 
+## Values of the node_packing setting
+NODE_PACKING_MODES=[ 'none', 'ordered', 'reorder' ]
+
+## Largest number of rank blocks for which node packing tries every
+## order of the blocks.
+MAX_PACKING_PERMUTATION_BLOCKS=7
+
 def node_tool_for(node_type,settings):
     if node_type != "generic":
         raise UnknownNodeType(f"No such node type: {node_type}")
@@ -73,6 +82,19 @@ class NodeSpec(object):
             else:
                 i=i+1
     
+    def group_similar_ranks(self,spec,can_merge_ranks=None):
+        """!Splits a JobResourceSpec into the contiguous groups of rank
+        blocks that merge_similar_ranks would merge into one.  Returns
+        a list of JobResourceSpec objects, one per group."""
+        can_merge_ranks = can_merge_ranks or self.can_merge_ranks
+        groups=list()
+        for rank in spec:
+            if groups and can_merge_ranks(groups[-1][0],rank):
+                groups[-1].append(rank)
+            else:
+                groups.append([rank])
+        return [ JobResourceSpec(group) for group in groups ]
+
     def with_similar_ranks_merged(self,spec,rank_simplifier=None,
                                   can_merge_ranks=None):
         """!Given a JobResourceSpec, return a new one with all similar ranks
@@ -85,11 +107,17 @@ class NodeSpec(object):
         return spec.simplify(merge,rank_simplifier)
 
     def to_nodes_ppn(self,spec,rank_simplifier=None,
-                     can_merge_ranks=None):
+                     can_merge_ranks=None,placement=None):
         """!Given a JobResourceSpec that represents an MPI program, express 
         it in (nodes,ranks_per_node) pairs where each is an integer.
         This is intended to be used to generate PBS-style
-        "nodes=1:ppn=3+8:ppn=12" specifications.        """
+        "nodes=1:ppn=3+8:ppn=12" specifications.  If a NodePlacement
+        is given, or node packing is enabled, the pairs describe the
+        packed nodes instead.        """
+        if placement is None and self.node_packing!='none':
+            placement=self.pack_ranks(spec)
+        if placement is not None:
+            return placement.nodes_ppn()
         spec=self.with_similar_ranks_merged(spec,rank_simplifier,
                                             can_merge_ranks)
         # Get the (nodes,ppn) pairs for all ranks:
@@ -101,18 +129,108 @@ class NodeSpec(object):
             nodes_ranks.extend(kj)
         return nodes_ranks
 
+    node_packing='none'
+    hetjob=False
+
+    @abstractmethod
+    def pack_ranks(self,spec,reorder=None):
+        """!Packs the rank blocks of a JobResourceSpec onto as few nodes as
+        possible, letting blocks share nodes.  Returns a NodePlacement."""
+
+########################################################################
+
+class NodePlacement(object):
+    """!Assignment of the ranks of a JobResourceSpec to compute nodes, as
+    returned by NodeSpec.pack_ranks.  Ranks are placed in order: the
+    first node gets the first ranks of spec, the next node the ranks
+    after those, and so on, so an MPI launcher that fills each node
+    in turn reproduces the placement.  Hence spec holds the rank
+    blocks in the order the MPI program must list them, which may
+    differ from the requested order.
+
+    The nodes are a tuple of (count,layout) pairs: count identical
+    nodes, each holding the ranks in layout, a tuple of (block index
+    in spec, number of ranks) pairs.
+
+    Immutable and hashable, so it can be passed to the memoized
+    scheduler resource methods."""
+    def __init__(self,spec,nodes):
+        self.__spec=spec
+        merged=list()
+        for count,layout in nodes:
+            layout=tuple([ (int(block),int(ranks)) for block,ranks in layout ])
+            if merged and merged[-1][1]==layout:
+                merged[-1]=( merged[-1][0]+int(count), layout )
+            else:
+                merged.append( ( int(count), layout ) )
+        self.__nodes=tuple(merged)
+
+    @property
+    def spec(self): return self.__spec
+    @property
+    def nodes(self): return self.__nodes
+
+    def node_count(self):
+        return sum([ count for count,layout in self.__nodes ])
+
+    def nodes_ppn(self):
+        """!Returns (nodes,ranks_per_node) pairs, merging consecutive
+        nodes with the same number of ranks."""
+        result=list()
+        for count,layout in self.__nodes:
+            ppn=sum([ ranks for block,ranks in layout ])
+            if result and result[-1][1]==ppn:
+                result[-1]=( result[-1][0]+count, ppn )
+            else:
+                result.append( ( count, ppn ) )
+        return result
+
+    def __hash__(self):
+        return hash((self.__spec,self.__nodes))
+    def __eq__(self,other):
+        if not isinstance(other,NodePlacement):
+            return NotImplemented
+        return self.__spec==other.__spec and self.__nodes==other.__nodes
+    def __ne__(self,other):
+        return not self==other
+    def __repr__(self):
+        return f'NodePlacement({self.__spec!r},{self.__nodes!r})'
+
 ########################################################################
 
 class GenericNodeSpec(NodeSpec):
+    """!Nodes with physical_cores_per_node cores of
+    logical_cpus_per_core CPUs each, and optionally memory_per_node
+    megabytes of memory.  The node_packing setting selects how MPI
+    ranks are assigned to nodes:
+
+    * none --- each rank block gets its own nodes (default)
+    * ordered --- consecutive rank blocks may share nodes (also: true)
+    * reorder --- rank blocks may also be reordered to use fewer nodes.
+      This renumbers the MPI ranks, so it must be requested by name.
+
+    The hetjob setting, if True, runs each block of similar ranks as
+    its own component of a Slurm heterogeneous job.  It is read here so
+    that the Slurm scheduler and the SrunMPI parallelism, which are
+    usually given the same settings, agree on the components."""
     def __init__(self,settings):
         self.settings=dict(settings)
         self.cores_per_node=int(settings['physical_cores_per_node'])
         self.cpus_per_core=int(settings.get('logical_cpus_per_core',1))
-        self.memory_per_node=float(settings.get('memory_per_node',0))
+        self.memory_per_node=megabytes(settings.get('memory_per_node',0))
         assert(self.cores_per_node>0)
         self.hyperthreading_allowed=bool(
             settings.get('hyperthreading_allowed',False))
         self.indent_text=str(settings.get('indent_text','  '))
+        node_packing=settings.get('node_packing','none')
+        if node_packing is True:    node_packing='ordered'
+        elif not node_packing:      node_packing='none'
+        if node_packing not in NODE_PACKING_MODES:
+            raise SysEnvConfigError(
+                f'node_packing: must be one of {NODE_PACKING_MODES} '
+                f'not {node_packing!r}')
+        self.node_packing=node_packing
+        self.hetjob=bool(settings.get('hetjob',False))
 
     def __repr__(self):
         return f'GenericNodeSpec{self.settings!r}'
@@ -184,23 +302,71 @@ class GenericNodeSpec(NodeSpec):
 
         return max_per_node
 
+    def same_memory(self,R1,R2):
+        """!Do the ranks fit on nodes the same way, memory-wise?  Memory is
+        only considered when the memory_per_node is known."""
+        return not self.memory_per_node or \
+               R1.get('memory_per_rank',1)==R2.get('memory_per_rank',1)
+
     def can_merge_ranks(self,R1,R2):
         return not R1['separate_node'] and not R2['separate_node'] and \
                R1['OMP_NUM_THREADS']==R2['OMP_NUM_THREADS'] and \
                R1.get('max_ppn',0)==R2.get('max_ppn',0) and \
-               R1.get('memory_per_node',1)==R2.get('memory_per_node',1) and \
-               R1.get('exe','') == R2.get('exe','') and (
+               self.same_memory(R1,R2) and \
+               R1.get('exe','') == R2.get('exe','') and \
+               R1.get('args',()) == R2.get('args',()) and (
                  not self.hyperthreading_allowed or \
                  R1.get('hyperthreads',1) == R2.get('hyperthreads',1) )
 
     def same_except_exe(self,R1,R2):
         return not R1['separate_node'] and not R2['separate_node'] and \
                R1['OMP_NUM_THREADS']==R2['OMP_NUM_THREADS'] and \
-               R1.get('memory_per_node',1)==R2.get('memory_per_node',1) and \
+               self.same_memory(R1,R2) and \
                R1.get('max_ppn',0)==R2.get('max_ppn',0) and ( \
                  not self.hyperthreading_allowed or \
                  R1.get('hyperthreads',1) == R2.get('hyperthreads',1) )
 
+    def memory_map(self,placement):
+        """!Describes the memory use on each group of identical nodes in
+        a NodePlacement.  Returns a list of dicts, one per group, with
+        keys:
+
+        * nodes --- number of nodes in the group
+        * ranks --- list of (block index, number of ranks) on each node
+        * memory --- list of megabytes used by each of those blocks
+        * used --- total megabytes used per node
+        * free --- megabytes left per node, or None if memory_per_node
+          is unknown"""
+        typecheck('placement',placement,NodePlacement)
+        result=list()
+        for count,layout in placement.nodes:
+            memory=[ ranks*placement.spec[block].memory_per_rank
+                     for block,ranks in layout ]
+            used=sum(memory)
+            result.append({
+                'nodes':count, 'ranks':list(layout), 'memory':memory,
+                'used':used,
+                'free':( self.memory_per_node-used
+                         if self.memory_per_node else None ) })
+        return result
+
+    def memory_map_comment(self,placement,prefix='# '):
+        """!Formats the memory_map() of a NodePlacement as comment
+        lines for a batch card, one line per group of identical nodes.
+        Returns the empty string if the placement is None."""
+        if placement is None:
+            return ''
+        lines=list()
+        for group in self.memory_map(placement):
+            blocks=', '.join([
+                f'{ranks} of block {block} ({memory:.0f}M)'
+                for (block,ranks),memory in zip(group['ranks'],group['memory']) ])
+            free='' if group['free'] is None \
+                 else f', {group["free"]:.0f}M free'
+            lines.append(f'{prefix}{group["nodes"]} node(s): {blocks}; '
+                         f'{group["used"]:.0f}M used{free}\n')
+        return ''.join(lines)
+
     def node_size(self,rank_spec):
         typecheck('rank_spec',rank_spec,crow.sysenv.jobs.JobRankSpec)
         can_hyper=self.hyperthreading_allowed
@@ -208,3 +374,133 @@ class GenericNodeSpec(NodeSpec):
         if can_hyper and rank_spec.get('hyperthreads',False):
             max_per_node*=max(1,min(self.cpus_per_core,rank_spec.hyperthreads))
         return max_per_node
+
+    # ----------------------------------------------------------------
+    # Node packing
+    # ----------------------------------------------------------------
+
+    def cpus_per_rank(self,rank_spec):
+        """!Number of logical CPUs, out of the cores_per_node*cpus_per_core
+        on a node, used by one rank of the given JobRankSpec, as a
+        Fraction.  A thread without hyperthreading occupies a whole
+        core."""
+        omp_threads=max(1,rank_spec.get('OMP_NUM_THREADS',1))
+        return Fraction(omp_threads*self.cpus_per_core,
+                        self.threads_per_core(rank_spec))
+
+    def threads_per_core(self,rank_spec):
+        """!Number of a rank's threads that share one core, as used by
+        max_ranks_per_node."""
+        if self.hyperthreading_allowed and rank_spec.get('hyperthreads',False):
+            return max(1,min(self.cpus_per_core,rank_spec.hyperthreads))
+        return 1
+
+    def _packing_blocks(self,spec):
+        blocks=list()
+        for rank_spec in spec:
+            ranks=max(1,int(rank_spec.get('mpi_ranks',1)))
+            per_node=self.max_ranks_per_node(rank_spec)
+            if rank_spec.want_max_threads():
+                # Threads fill whatever the ranks leave, so the
+                # block cannot share nodes.
+                cpus=Fraction(self.cores_per_node*self.cpus_per_core,per_node)
+                separate=True
+            else:
+                cpus=self.cpus_per_rank(rank_spec)
+                separate=bool(rank_spec['separate_node'])
+            blocks.append(( ranks, per_node, cpus,
+                            rank_spec['memory_per_rank'], separate ))
+        return blocks
+
+    def _pack_in_order(self,blocks,order):
+        """!Fills nodes with the blocks in the given order.  Each node
+        takes as many ranks as fit before moving on to the next node.
+        Returns a list of [count,layout] where layout is a list of
+        (position in order, ranks) pairs."""
+        node_cpus=self.cores_per_node*self.cpus_per_core
+        node_memory=self.memory_per_node
+        nodes=list()
+        layout=None # ranks on the node being filled
+        used_cpus=0
+        used_memory=0.
+        for position,index in enumerate(order):
+            ranks,per_node,cpus,memory,separate=blocks[index]
+            if separate: layout=None
+            while ranks:
+                if layout is None:
+                    layout=list()
+                    nodes.append([1,layout])
+                    used_cpus=0
+                    used_memory=0.
+                    if ranks>per_node:
+                        # Whole nodes of this block, except the last
+                        # which may have room for the next block.
+                        full=(ranks-1)//per_node
+                        nodes[-1]=[full,[(position,per_node)]]
+                        ranks-=full*per_node
+                        layout=list()
+                        nodes.append([1,layout])
+                fit=min(ranks,per_node,(node_cpus-used_cpus)//cpus)
+                if node_memory:
+                    fit=min(fit,int((node_memory-used_memory)//memory))
+                if fit<1:
+                    layout=None
+                    continue
+                layout.append((position,fit))
+                ranks-=fit
+                used_cpus+=fit*cpus
+                used_memory+=fit*memory
+                if ranks:
+                    # The rest of this block, and hence all later
+                    # blocks, go on later nodes.
+                    layout=None
+            if separate: layout=None
+        return nodes
+
+    def _packing_orders(self,blocks,reorder):
+        natural=tuple(range(len(blocks)))
+        yield natural
+        if not reorder or len(blocks)<2: return
+        if len(blocks)<=MAX_PACKING_PERMUTATION_BLOCKS:
+            yield from itertools.permutations(natural)
+            return
+        # Too many blocks to try every order.  Put blocks that cannot
+        # share nodes first, then the ones with the most CPUs per
+        # rank, so the small ranks fill the gaps left by large ones.
+        yield tuple(sorted(natural,key=lambda i: (
+            not blocks[i][4], -blocks[i][2], -blocks[i][0])))
+        yield tuple(sorted(natural,key=lambda i: (
+            not blocks[i][4], blocks[i][2], -blocks[i][0])))
+
+    def pack_ranks(self,spec,reorder=None):
+        """!Packs the rank blocks of a JobResourceSpec onto as few nodes as
+        possible.  Blocks share nodes unless they request
+        separate_node, and each node holds no more ranks of a block
+        than max_ranks_per_node allows (max_ppn, memory_per_rank, OpenMP
+        threads and hyperthreads) nor more logical CPUs and memory
+        than it has.  Returns a NodePlacement.
+
+        Ranks must be placed in MPI rank order, so the placement is
+        chosen among the orders of the blocks: the requested order
+        only, or, if reorder is True, every order when there are at
+        most MAX_PACKING_PERMUTATION_BLOCKS blocks, otherwise a few
+        heuristic ones.  The requested order wins ties.
+
+        @param spec a JobResourceSpec for an MPI program
+        @param reorder may the blocks be reordered?  Default: True if
+          the node_packing setting is "reorder"."""
+        typecheck('spec',spec,JobResourceSpec)
+        if reorder is None:
+            reorder = self.node_packing=='reorder'
+        blocks=self._packing_blocks(spec)
+        best=None
+        best_order=None
+        for order in self._packing_orders(blocks,reorder):
+            nodes=self._pack_in_order(blocks,order)
+            count=sum([ n for n,layout in nodes ])
+            if best is None or count<best[0]:
+                best=( count, nodes )
+                best_order=order
+        packed=JobResourceSpec([ spec[i] for i in best_order ])
+        return NodePlacement(packed,[ (count,layout)
+                                      for count,layout in best[1] ])
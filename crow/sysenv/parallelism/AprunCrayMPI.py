@@ -21,7 +21,17 @@ class Parallelism(object):  # (BaseParallelism):
         self.mpi_runner=str(settings.get('aprun'))
         self.rank_sep=str(settings.get('rank_sep',':'))
 
-    def make_ShellCommand(self,spec):
+    def make_ShellCommand(self,spec,placement=None):
+        """!Returns a ShellCommand that runs the given JobResourceSpec.  If
+        a NodePlacement is given, or the node_packing setting is
+        "reorder," the rank blocks are listed in the placement's order
+        so the ranks land on the nodes it chose."""
+        if placement is None and self.nodes.node_packing=='reorder' and \
+           not spec.is_pure_serial() and not spec.is_pure_openmp():
+            placement=self.nodes.pack_ranks(spec)
+        if placement is not None:
+            spec=placement.spec
+
         if spec.is_pure_serial():
             return ShellCommand(spec['exe'])
         elif spec.is_pure_openmp():
@@ -30,9 +40,11 @@ class Parallelism(object):  # (BaseParallelism):
 
         # Merge any adjacent ranks that can be merged.  Ignore
         # differing executables between ranks while merging them
-        # (rename_exe):
+        # (rename_exe), unless a placement reordered the blocks, which
+        # can put different programs next to each other:
         merged=self.nodes.with_similar_ranks_merged(
-            spec,can_merge_ranks=self.nodes.same_except_exe)
+            spec,can_merge_ranks=self.nodes.same_except_exe
+            if placement is None else self.nodes.can_merge_ranks)
 
         cmd=[ self.mpi_runner ]
 
@@ -58,6 +70,7 @@ class Parallelism(object):  # (BaseParallelism):
                 cmd.append(exe)
             else:
                 cmd.extend(exe)
+            cmd.extend([ str(arg) for arg in rank.get('args',()) ])
             first=False
 
         return ShellCommand(cmd)
@@ -0,0 +1,171 @@
+import math, shlex, logging
+from io import StringIO
+
+from crow.sysenv.exceptions import *
+from crow.sysenv.jobs import JobResourceSpec
+from crow.sysenv.shell import ShellCommand
+from crow.sysenv.nodes import GenericNodeSpec
+
+from crow.sysenv.parallelism.base import Parallelism as BaseParallelism
+
+__all__=['Parallelism']
+
+_logger=logging.getLogger('crow')
+
+class Parallelism(BaseParallelism):
+    """!Runs MPI programs with Slurm's srun.  Programs with more than one
+    block of ranks are described in a --multi-prog configuration file,
+    which is written by the ShellCommand, so the command line stays
+    short no matter how many blocks there are.
+
+    Settings:
+
+    * mpi_runner --- srun program (default: srun)
+    * multi_prog_file --- name of the --multi-prog configuration file
+      (default: crow_multi_prog.conf)
+    * cpu_bind --- if True (the default), and the ranks' layout on
+      the nodes is known from a NodePlacement, bind each rank to its
+      CPUs with --cpu-bind=mask_cpu
+    * hetjob --- if True, launch each component of the Slurm
+      scheduler's heterogeneous job with its own --het-group (default:
+      False).  This is the node setting the Slurm scheduler also reads,
+      so give both the same settings."""
+    def __init__(self,settings):
+        self.settings=dict(settings)
+        self.nodes=GenericNodeSpec(settings)
+        self.parallelism='SrunMPI'
+        self.mpi_runner=str(settings.get('mpi_runner','srun'))
+        self.multi_prog_file=str(settings.get('multi_prog_file',
+                                              'crow_multi_prog.conf'))
+        self.cpu_bind=bool(settings.get('cpu_bind',True))
+
+    def _program_for(self,rank):
+        words=list()
+        if rank.is_openmp():
+            words.extend([ '/usr/bin/env', 'OMP_NUM_THREADS='+
+                           '%d'%self.nodes.omp_threads_for(rank) ])
+        exe=rank['exe']
+        if isinstance(exe,str):
+            words.append(exe)
+        else:
+            words.extend(exe)
+        words.extend([ str(arg) for arg in rank.get('args',()) ])
+        return words
+
+    def _node_cpu_masks(self,placement,layout):
+        masks=list()
+        core=0
+        for block,ranks in layout:
+            rank=placement.spec[block]
+            hyperthreads=self.nodes.threads_per_core(rank)
+            cores=int(math.ceil(
+                self.nodes.cpus_per_rank(rank)/self.nodes.cpus_per_core))
+            for i in range(ranks):
+                mask=0
+                for c in range(core,core+cores):
+                    for h in range(hyperthreads):
+                        mask|=1<<(c+h*self.nodes.cores_per_node)
+                masks.append(f'0x{mask:x}')
+                core+=cores
+        return masks
+
+    def cpu_masks(self,placement):
+        """!Returns the --cpu-bind=mask_cpu list for the local tasks on
+        each node of the NodePlacement, or None if nodes with different
+        layouts would need different lists.  Logical CPUs are numbered
+        core by core, with hyperthreads of core c at c+N*cores_per_node."""
+        longest=list()
+        all_masks=[ self._node_cpu_masks(placement,layout)
+                    for count,layout in placement.nodes ]
+        for masks in all_masks:
+            if len(masks)>len(longest):
+                longest=masks
+        for masks in all_masks:
+            if masks!=longest[:len(masks)]:
+                return None
+        return longest
+
+    def multi_prog_config(self,spec):
+        """!Returns the text of the --multi-prog configuration file for a
+        JobResourceSpec: one line per block of ranks, giving the rank
+        range and the program to run."""
+        sio=StringIO()
+        first=0
+        for rank in spec:
+            count=max(1,int(rank.get('mpi_ranks',1)))
+            last=first+count-1
+            ranks=f'{first}' if first==last else f'{first}-{last}'
+            program=' '.join([ shlex.quote(w) for w in self._program_for(rank) ])
+            sio.write(f'{ranks} {program}\n')
+            first=last+1
+        ret=sio.getvalue()
+        sio.close()
+        return ret
+
+    def make_ShellCommand(self,spec,placement=None):
+        """!Returns a ShellCommand that runs the given JobResourceSpec.  If
+        a NodePlacement is given, or node packing is enabled, the rank
+        blocks are listed in the placement's order and bound to the
+        CPUs it chose."""
+        if spec.is_pure_serial() or spec.is_pure_openmp():
+            return ShellCommand(self._program_for(spec[0]))
+
+        if placement is None and self.nodes.node_packing!='none':
+            placement=self.nodes.pack_ranks(spec)
+        if placement is not None:
+            spec=placement.spec
+
+        cmd=[ self.mpi_runner ]
+
+        # Only the first block's extra arguments are used, since srun
+        # options apply to all ranks.
+        extra=spec[0].get('SrunMPI_extra',None)
+        if extra is not None:
+            if isinstance(extra,str): extra=[extra]
+            cmd.extend(extra)
+
+        if self.cpu_bind and placement is not None:
+            masks=self.cpu_masks(placement)
+            if masks:
+                cmd.append('--cpu-bind=mask_cpu:'+','.join(masks))
+            else:
+                _logger.debug(f'{placement!r}: nodes have different '
+                              'layouts; not binding ranks to CPUs')
+
+        components=[ spec ]
+        if placement is None and self.nodes.hetjob:
+            # Same components as the Slurm scheduler's hetjob.
+            components=self.nodes.group_similar_ranks(
+                spec,can_merge_ranks=self.nodes.same_except_exe)
+
+        files=list()
+        for i,component in enumerate(components):
+            filename=self.multi_prog_file
+            if len(components)>1:
+                if i: cmd.append(':')
+                cmd.append(f'--het-group={i}')
+                filename=f'{filename}.{i}'
+            self._append_component(cmd,files,component,filename)
+        return ShellCommand(cmd,files=files)
+
+    def _append_component(self,cmd,files,spec,filename):
+        # Merge adjacent blocks that run the same program.
+        merged=self.nodes.with_similar_ranks_merged(spec)
+
+        cmd.extend(['-n','%d'%sum([ max(1,int(rank.get('mpi_ranks',1)))
+                                    for rank in merged ])])
+
+        # srun gives every task in the component the same number of
+        # CPUs, so threads are only requested when all blocks agree.
+        threads={ self.nodes.omp_threads_for(rank) if rank.is_openmp()
+                  else None for rank in merged }
+        if len(threads)==1 and None not in threads:
+            cmd.append('--cpus-per-task=%d'%threads.pop())
+
+        if len(merged)==1:
+            cmd.extend(self._program_for(merged[0]))
+            return
+
+        cmd.extend([ '--multi-prog', filename ])
+        files.append({ 'name':filename,
+                       'content':self.multi_prog_config(merged) })
@@ -1,14 +1,18 @@
 from crow.sysenv.exceptions import UnknownParallelismError
 import crow.sysenv.parallelism.HydraIMPI
 import crow.sysenv.parallelism.AprunCrayMPI
+import crow.sysenv.parallelism.SrunMPI
 from crow.sysenv.parallelism.HydraIMPI \
     import Parallelism as HydraIMPIParallelism
 from crow.sysenv.parallelism.AprunCrayMPI \
     import Parallelism as AprunCrayMPIParallelism
+from crow.sysenv.parallelism.SrunMPI \
+    import Parallelism as SrunMPIParallelism
 
 KNOWN_PARALLELISM={
     'HydraIMPI': HydraIMPIParallelism,
-    'AprunCrayMPI': AprunCrayMPIParallelism
+    'AprunCrayMPI': AprunCrayMPIParallelism,
+    'SrunMPI': SrunMPIParallelism
     }
 
 
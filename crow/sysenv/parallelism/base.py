@@ -3,10 +3,16 @@ from ..jobs import JobResourceSpec
 
 class Parallelism(object):
     @abstractmethod
-    def make_ShellCommand(self,spec): pass
+    def make_ShellCommand(self,spec,placement=None): pass
 
-    def run(self,spec,*args,**kwargs):
+    def run(self,spec,*args,placement=None,**kwargs):
         if not isinstance(spec,JobResourceSpec):
             spec=JobResourceSpec(spec)
-        cmd=self.make_ShellCommand(spec)
+        cmd=self.make_ShellCommand(spec,placement=placement)
         return cmd.run(*args,**kwargs)
+
+    async def run_async(self,spec,*args,placement=None,**kwargs):
+        if not isinstance(spec,JobResourceSpec):
+            spec=JobResourceSpec(spec)
+        cmd=self.make_ShellCommand(spec,placement=placement)
+        return await cmd.run_async(*args,**kwargs)
@@ -7,7 +7,8 @@ from crow.sysenv.util import ranks_to_nodes_ppn
 from crow.sysenv.jobs import JobResourceSpec
 from crow.sysenv.nodes import GenericNodeSpec
 
-from crow.sysenv.schedulers.base import Scheduler as BaseScheduler
+from crow.sysenv.schedulers.base import Scheduler as BaseScheduler, \
+     memoize_resources, array_index_ranges
 
 from collections import Sequence
 
@@ -41,6 +42,15 @@ class Scheduler(BaseScheduler):
         else:
             return 2000*1048576.
 
+    def _block_rusage(self,block,rusage):
+        """!The rusage of a block after the first in a task geometry
+        request: its own memory setting, if it has one, or else the
+        whole job's rusage."""
+        if not rusage or not block.get('memory',''):
+            return rusage
+        bytes=tools.memory_in_bytes(block['memory'])
+        return f'rusage[mem={int(math.ceil(bytes/1048576.)):d}]'
+
     # ------------------------------------------------------------------
 
     def _ranks_affinity_and_span_for(self,spec):
@@ -129,6 +139,7 @@ class Scheduler(BaseScheduler):
         sio.close()
         return ret
 
+    @memoize_resources
     def batch_resources(self,spec,**kwargs):
         if kwargs:
             spec=dict(spec,**kwargs)
@@ -217,20 +228,40 @@ class Scheduler(BaseScheduler):
             ras=self._ranks_affinity_and_span_for(spec)
             sio.write("#BSUB -R '")
             first=True
-            for ras1 in ras:
+            for block,ras1 in zip(spec,ras):
+                block_rusage=rusage
                 if first:
                     first=False
                 else:
                     sio.write(' + ')
+                    block_rusage=self._block_rusage(block,rusage)
                 sio.write(f'{ras1["ranks"]}*'
                           f'{{span[{ras1["span"]}]'
-                          f'affinity[{ras1["affinity"]}]{rusage}}}')
+                          f'affinity[{ras1["affinity"]}]{block_rusage}}}')
             sio.write("'\n")
             
         ret=sio.getvalue()
         sio.close()
         return ret
 
+    array_index_var='LSB_JOBINDEX'
+
+    def batch_array_resources(self,spec,indices,jobname=None,
+                              max_running=None):
+        if not isinstance(spec,JobResourceSpec):
+            spec=JobResourceSpec(spec)
+        # LSF names the array in the job name, so one is needed.
+        if not jobname:
+            jobname=spec[0].get('jobname','crow_array')
+        sio=StringIO()
+        sio.write(self.batch_resources(spec))
+        limit=f'%{int(max_running)}' if max_running else ''
+        sio.write(f"#BSUB -J '{jobname}[{array_index_ranges(indices)}]"
+                  f"{limit}'\n")
+        ret=sio.getvalue()
+        sio.close()
+        return ret
+
     ####################################################################
 
     # Generation of Rocoto XML
@@ -267,7 +298,8 @@ class Scheduler(BaseScheduler):
 
     # ------------------------------------------------------------------
 
-    def rocoto_resources(self,spec,indent=0):
+    @memoize_resources
+    def rocoto_resources(self,spec,indent=0,placement=None):
         sio=StringIO()
         space=self.indent_text
         if not isinstance(spec,JobResourceSpec):
@@ -294,7 +326,8 @@ class Scheduler(BaseScheduler):
         # Split into (nodes,ranks_per_node) pairs.  Ignore differing
         # executables between ranks while merging them (same_except_exe):
         nodes_ranks=self.nodes.to_nodes_ppn(
-            spec,can_merge_ranks=self.nodes.same_except_exe)
+            spec,can_merge_ranks=self.nodes.same_except_exe,
+            placement=placement)
         
         sio.write(indent*space+'<nodes>' \
             + '+'.join([f'{max(n,1)}:ppn={max(p,1)}' for n,p in nodes_ranks ]) \
@@ -7,7 +7,8 @@ from crow.sysenv.util import ranks_to_nodes_ppn
 from crow.sysenv.jobs import JobResourceSpec
 from crow.sysenv.nodes import GenericNodeSpec
 
-from crow.sysenv.schedulers.base import Scheduler as BaseScheduler
+from crow.sysenv.schedulers.base import Scheduler as BaseScheduler, \
+     memoize_resources, array_index_ranges
 
 from collections import Sequence
 
@@ -52,7 +53,8 @@ class Scheduler(BaseScheduler):
         sio.close()
         return ret
 
-    def batch_resources(self,spec,**kwargs):
+    @memoize_resources
+    def batch_resources(self,spec,placement=None,**kwargs):
         if kwargs:
             spec=dict(spec,**kwargs)
         space=self.indent_text
@@ -107,21 +109,42 @@ class Scheduler(BaseScheduler):
         else:
             if not spec.is_pure_serial() and not spec.is_pure_openmp():
                 # This is an MPI program.
-                nodes_ranks=self.nodes.to_nodes_ppn(spec)
+                if placement is None and self.nodes.node_packing!='none':
+                    placement=self.nodes.pack_ranks(spec)
+                nodes_ranks=self.nodes.to_nodes_ppn(spec,placement=placement)
                 requested_nodes=sum([ n for n,p in nodes_ranks ])
+                sio.write(self.nodes.memory_map_comment(placement))
             sio.write('#BSUB -extsched CRAYLINUX[]\n')
             if self.settings.get('use_export_nodes',True):
-                sio.write(f'export NODES={requested_nodes}')
+                sio.write(f'export NODES={requested_nodes}\n')
             else:
                 sio.write("#BSUB -R '1*{select[craylinux && !vnode]} + ")
                 sio.write('%d'%requested_nodes)
                 sio.write("*{select[craylinux && vnode]span[")
-                sio.write(f"ptile={nodesize}] cu[type=cabinet]}}'")
+                sio.write(f"ptile={nodesize}] cu[type=cabinet]}}'\n")
         
         ret=sio.getvalue()
         sio.close()
         return ret
 
+    array_index_var='LSB_JOBINDEX'
+
+    def batch_array_resources(self,spec,indices,jobname=None,
+                              max_running=None):
+        if not isinstance(spec,JobResourceSpec):
+            spec=JobResourceSpec(spec)
+        # LSF names the array in the job name, so one is needed.
+        if not jobname:
+            jobname=spec[0].get('jobname','crow_array')
+        sio=StringIO()
+        sio.write(self.batch_resources(spec))
+        limit=f'%{int(max_running)}' if max_running else ''
+        sio.write(f"#BSUB -J '{jobname}[{array_index_ranges(indices)}]"
+                  f"{limit}'\n")
+        ret=sio.getvalue()
+        sio.close()
+        return ret
+
     ####################################################################
 
     # Generation of Rocoto XML
@@ -151,7 +174,8 @@ class Scheduler(BaseScheduler):
         sio.close()
         return ret
 
-    def rocoto_resources(self,spec,indent=0):
+    @memoize_resources
+    def rocoto_resources(self,spec,indent=0,placement=None):
         sio=StringIO()
         space=self.indent_text
         if not isinstance(spec,JobResourceSpec):
@@ -200,11 +224,12 @@ class Scheduler(BaseScheduler):
         else:
             if not spec.is_pure_serial() and not spec.is_pure_openmp():
                 # This is an MPI program.
-                nodes_ranks=self.nodes.to_nodes_ppn(spec)
+                nodes_ranks=self.nodes.to_nodes_ppn(spec,placement=placement)
                 requested_nodes=sum([ n for n,p in nodes_ranks ])
 
             nodes_ranks=self.nodes.to_nodes_ppn(
-                spec,can_merge_ranks=lambda x,y: False)
+                spec,can_merge_ranks=lambda x,y: False,
+                placement=placement)
             
             sio.write(indent*space+'<nodes>' \
                 + '+'.join([f'{max(n,1)}:ppn={max(p,1)}' for n,p in nodes_ranks ]) \
@@ -6,7 +6,8 @@ from crow.sysenv.exceptions import *
 from crow.sysenv.util import ranks_to_nodes_ppn
 from crow.sysenv.jobs import JobResourceSpec
 from crow.sysenv.nodes import GenericNodeSpec
-from crow.sysenv.schedulers.base import Scheduler as BaseScheduler
+from crow.sysenv.schedulers.base import Scheduler as BaseScheduler, \
+     memoize_resources, array_index_ranges
 
 from collections import Sequence
 
@@ -69,7 +70,8 @@ class Scheduler(BaseScheduler):
             return int(math.ceil(bytes/1048576.))
         return None
 
-    def batch_resources(self,*args,**kwargs):
+    @memoize_resources
+    def batch_resources(self,*args,placement=None,**kwargs):
         spec=tools.make_dict_from(args,kwargs)
         space=self.indent_text
         sio=StringIO()
@@ -116,11 +118,29 @@ class Scheduler(BaseScheduler):
             # Split into (nodes,ranks_per_node) pairs.  Ignore
             # differing executables between ranks while merging them
             # (del_exe):
+            if placement is None and self.nodes.node_packing!='none':
+                placement=self.nodes.pack_ranks(spec)
             nodes_ranks=self.nodes.to_nodes_ppn(
-                spec,can_merge_ranks=self.nodes.same_except_exe)
+                spec,can_merge_ranks=self.nodes.same_except_exe,
+                placement=placement)
             sio.write('#PBS -l nodes=')
             sio.write('+'.join([f'{n}:ppn={p}' for n,p in nodes_ranks ]))
             sio.write('\n')
+            sio.write(self.nodes.memory_map_comment(placement))
+        ret=sio.getvalue()
+        sio.close()
+        return ret
+
+    array_index_var='PBS_ARRAYID'
+
+    def batch_array_resources(self,spec,indices,jobname=None,
+                              max_running=None):
+        sio=StringIO()
+        sio.write(self.batch_resources(spec))
+        if jobname:
+            sio.write(f'#PBS -N {jobname}\n')
+        limit=f'%{int(max_running)}' if max_running else ''
+        sio.write(f'#PBS -t {array_index_ranges(indices)}{limit}\n')
         ret=sio.getvalue()
         sio.close()
         return ret
@@ -159,7 +179,8 @@ class Scheduler(BaseScheduler):
         sio.close()
         return ret
 
-    def rocoto_resources(self,*args,indent=0,**kwargs):
+    @memoize_resources
+    def rocoto_resources(self,*args,indent=0,placement=None,**kwargs):
         spec=tools.make_dict_from(args,kwargs)
         sio=StringIO()
         space=self.indent_text
@@ -200,7 +221,8 @@ class Scheduler(BaseScheduler):
             # Split into (nodes,ranks_per_node) pairs.  Ignore differing
             # executables between ranks while merging them (del_exe):
             nodes_ranks=self.nodes.to_nodes_ppn(
-                spec,can_merge_ranks=self.nodes.same_except_exe)
+                spec,can_merge_ranks=self.nodes.same_except_exe,
+                placement=placement)
             
             sio.write(indent*space+'<nodes>' \
                 + '+'.join([f'{n}:ppn={p}' for n,p in nodes_ranks ]) \
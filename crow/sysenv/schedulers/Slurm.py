@@ -6,7 +6,8 @@ from crow.sysenv.exceptions import *
 from crow.sysenv.util import ranks_to_nodes_ppn
 from crow.sysenv.jobs import JobResourceSpec
 from crow.sysenv.nodes import GenericNodeSpec
-from crow.sysenv.schedulers.base import Scheduler as BaseScheduler
+from crow.sysenv.schedulers.base import Scheduler as BaseScheduler, \
+     memoize_resources, array_index_ranges
 
 from collections import Sequence
 
@@ -69,7 +70,53 @@ class Scheduler(BaseScheduler):
             return int(math.ceil(bytes/1048576.))
         return None
 
-    def batch_resources(self,*args,**kwargs):
+    def hetjob_components(self,spec,placement=None):
+        """!Splits an MPI program's JobResourceSpec into the components of a
+        Slurm heterogeneous job: one per block of ranks left after
+        merging similar ranks.  A program placed by node packing, or
+        any program unless the hetjob setting is True, has only one
+        component.  Returns a list of JobResourceSpec objects."""
+        if placement is None and self.nodes.node_packing!='none':
+            placement=self.nodes.pack_ranks(spec)
+        if placement is not None or not self.nodes.hetjob:
+            return [ spec ]
+        return self.nodes.group_similar_ranks(
+            spec,can_merge_ranks=self.nodes.same_except_exe)
+
+    def _component_memory(self,spec):
+        """!Megabytes per node for one component of a heterogeneous job,
+        from its own rank blocks: the memory or compute_memory of its
+        first block, or else its ranks per node times their largest
+        memory_per_rank.  Returns None if no block requests memory."""
+        megabytes=self.get_memory_from_resource_spec(spec)
+        if megabytes is not None:
+            return megabytes
+        per_rank=max([ r.memory_per_rank for r in spec ])
+        if per_rank<=1:
+            return None
+        nodes_ranks=self.nodes.to_nodes_ppn(
+            spec,can_merge_ranks=self.nodes.same_except_exe)
+        return int(math.ceil(per_rank*max([ p for n,p in nodes_ranks ])))
+
+    def _write_component(self,spec,placement,sio):
+        nodes_ranks=self.nodes.to_nodes_ppn(
+            spec,can_merge_ranks=self.nodes.same_except_exe,
+            placement=placement)
+        nodes=sum([ n for n,p in nodes_ranks ])
+        ranks=sum([ n*p for n,p in nodes_ranks ])
+        sio.write(f'#SBATCH -N {nodes} -n {ranks}')
+        threads=set([ self.nodes.omp_threads_for(r) for r in spec ])
+        if len(threads)>1:
+            # Ranks need different numbers of CPUs, which one Slurm
+            # component cannot request, so take the whole nodes and
+            # let the launcher bind each rank to its CPUs.
+            sio.write(' --exclusive')
+        elif spec[0].is_openmp():
+            sio.write(f' --cpus-per-task={threads.pop()}')
+        sio.write('\n')
+
+    @memoize_resources
+    def batch_resources(self,*args,placement=None,**kwargs):
         spec=tools.make_dict_from(args,kwargs)
         space=self.indent_text
         sio=StringIO()
@@ -86,7 +133,18 @@ class Scheduler(BaseScheduler):
             sio.write(f'#SBATCH -t {hours:02d}:{minutes:02d}'
                       f':{seconds:02d}\n')
 
+        mpi=not spec.is_pure_serial() and not spec.is_pure_openmp()
+        if mpi and placement is None and self.nodes.node_packing!='none':
+            placement=self.nodes.pack_ranks(spec)
+
         megabytes=self.get_memory_from_resource_spec(spec)
+        if placement is not None and \
+           max([ r.memory_per_rank for r in spec ])>1:
+            # Packed nodes hold different blocks, so ask for the
+            # memory of the fullest node.
+            megabytes=int(math.ceil(max([
+                group['used'] for group in
+                self.nodes.memory_map(placement) ])))
         if megabytes is not None:
             sio.write(f'#SBATCH --mem={megabytes:d}M\n')
 
@@ -98,7 +156,7 @@ class Scheduler(BaseScheduler):
             if spec[0].get('stderr',''):
                 sio.write('#SBATCH -e {spec[0]["stderr"]}\n')
         if spec[0].get('jobname'):
-            sio.write('#SBATCH -J {spec[0]["jobname"]}\n')
+            sio.write(f'#SBATCH -J {spec[0]["jobname"]}\n')
 
         # --------------------------------------------------------------
         # Request processors.
@@ -110,7 +168,13 @@ class Scheduler(BaseScheduler):
         elif spec.is_pure_openmp():
             # Pure threaded.  Treat as exclusive serial.
             sio.write('#SBATCH -N 1 -n 2\n')
-        else:
+        elif placement is not None:
+            # This is an MPI program placed by node packing.  The
+            # placement decides the nodes, so the whole program is one
+            # component.
+            self._write_component(spec,placement,sio)
+            sio.write(self.nodes.memory_map_comment(placement))
+        elif not self.nodes.hetjob:
             # This is an MPI program.
 
             # Split into (nodes,ranks_per_node) pairs.  Ignore
@@ -121,6 +185,41 @@ class Scheduler(BaseScheduler):
             sio.write('#SBATCH -N ')
             sio.write('+'.join([f'{n} -n {p}' for n,p in nodes_ranks ]))
             sio.write('\n')
+        else:
+            # This is an MPI program.  Each block of similar ranks
+            # is a component of a heterogeneous job, so each gets its
+            # own node shape and memory.  Ignore differing executables
+            # between ranks while merging them (same_except_exe):
+            components=self.hetjob_components(spec)
+            for i,component in enumerate(components):
+                if i:
+                    sio.write('#SBATCH hetjob\n')
+                memory=self._component_memory(component)
+                if memory is not None and (i or megabytes is None):
+                    sio.write(f'#SBATCH --mem={memory:d}M\n')
+                self._write_component(component,None,sio)
+        ret=sio.getvalue()
+        sio.close()
+        return ret
+
+    array_index_var='SLURM_ARRAY_TASK_ID'
+
+    def batch_array_resources(self,spec,indices,jobname=None,
+                              max_running=None):
+        if not isinstance(spec,JobResourceSpec):
+            spec=JobResourceSpec(spec)
+        if not spec.is_pure_serial() and not spec.is_pure_openmp() and \
+           len(self.hetjob_components(spec))>1:
+            raise SysEnvConfigError('Slurm job arrays cannot hold '
+                                    'heterogeneous jobs.')
+        if jobname:
+            # batch_resources writes the -J for the array's name.
+            spec=JobResourceSpec([ spec[0].new_with(jobname=jobname) ]+
+                                 list(spec[1:]))
+        sio=StringIO()
+        sio.write(self.batch_resources(spec))
+        limit=f'%{int(max_running)}' if max_running else ''
+        sio.write(f'#SBATCH --array={array_index_ranges(indices)}{limit}\n')
         ret=sio.getvalue()
         sio.close()
         return ret
@@ -156,7 +255,8 @@ class Scheduler(BaseScheduler):
         sio.close()
         return ret
 
-    def rocoto_resources(self,*args,indent=0,**kwargs):
+    @memoize_resources
+    def rocoto_resources(self,*args,indent=0,placement=None,**kwargs):
         spec=tools.make_dict_from(args,kwargs)
         sio=StringIO()
         space=self.indent_text
@@ -197,7 +297,8 @@ class Scheduler(BaseScheduler):
             # Split into (nodes,ranks_per_node) pairs.  Ignore differing
             # executables between ranks while merging them (del_exe):
             nodes_ranks=self.nodes.to_nodes_ppn(
-                spec,can_merge_ranks=self.nodes.same_except_exe)
+                spec,can_merge_ranks=self.nodes.same_except_exe,
+                placement=placement)
             
             sio.write(indent*space+'<nodes>' \
                 + '+'.join([f'{n}:ppn={p}' for n,p in nodes_ranks ]) \
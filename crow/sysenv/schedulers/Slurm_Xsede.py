@@ -6,7 +6,8 @@ from crow.sysenv.exceptions import *
 from crow.sysenv.util import ranks_to_nodes_ppn
 from crow.sysenv.jobs import JobResourceSpec
 from crow.sysenv.nodes import GenericNodeSpec
-from crow.sysenv.schedulers.base import Scheduler as BaseScheduler
+from crow.sysenv.schedulers.base import Scheduler as BaseScheduler, \
+     memoize_resources, array_index_ranges
 
 from collections import Sequence
 
@@ -67,7 +68,8 @@ class Scheduler(BaseScheduler):
             return int(math.ceil(bytes/1048576.))
         return None
 
-    def batch_resources(self,*args,**kwargs):
+    @memoize_resources
+    def batch_resources(self,*args,placement=None,**kwargs):
         spec=tools.make_dict_from(args,kwargs)
         space=self.indent_text
         sio=StringIO()
@@ -96,7 +98,7 @@ class Scheduler(BaseScheduler):
             if spec[0].get('stderr',''):
                 sio.write('#SBATCH -e {spec[0]["stderr"]}\n')
         if spec[0].get('jobname'):
-            sio.write('#SBATCH -J {spec[0]["jobname"]}\n')
+            sio.write(f'#SBATCH -J {spec[0]["jobname"]}\n')
 
         # --------------------------------------------------------------
         # Request processors.
@@ -114,11 +116,33 @@ class Scheduler(BaseScheduler):
             # Split into (nodes,ranks_per_node) pairs.  Ignore
             # differing executables between ranks while merging them
             # (del_exe):
+            if placement is None and self.nodes.node_packing!='none':
+                placement=self.nodes.pack_ranks(spec)
             nodes_ranks=self.nodes.to_nodes_ppn(
-                spec,can_merge_ranks=self.nodes.same_except_exe)
+                spec,can_merge_ranks=self.nodes.same_except_exe,
+                placement=placement)
             sio.write('#SBATCH -N ')
             sio.write('+'.join([f'{n} -n {p}' for n,p in nodes_ranks ]))
             sio.write('\n')
+            sio.write(self.nodes.memory_map_comment(placement))
+        ret=sio.getvalue()
+        sio.close()
+        return ret
+
+    array_index_var='SLURM_ARRAY_TASK_ID'
+
+    def batch_array_resources(self,spec,indices,jobname=None,
+                              max_running=None):
+        if not isinstance(spec,JobResourceSpec):
+            spec=JobResourceSpec(spec)
+        if jobname:
+            # batch_resources writes the -J for the array's name.
+            spec=JobResourceSpec([ spec[0].new_with(jobname=jobname) ]+
+                                 list(spec[1:]))
+        sio=StringIO()
+        sio.write(self.batch_resources(spec))
+        limit=f'%{int(max_running)}' if max_running else ''
+        sio.write(f'#SBATCH --array={array_index_ranges(indices)}{limit}\n')
         ret=sio.getvalue()
         sio.close()
         return ret
@@ -152,7 +176,8 @@ class Scheduler(BaseScheduler):
         sio.close()
         return ret
 
-    def rocoto_resources(self,*args,indent=0,**kwargs):
+    @memoize_resources
+    def rocoto_resources(self,*args,indent=0,placement=None,**kwargs):
         spec=tools.make_dict_from(args,kwargs)
         sio=StringIO()
         space=self.indent_text
@@ -193,7 +218,8 @@ class Scheduler(BaseScheduler):
             # Split into (nodes,ranks_per_node) pairs.  Ignore differing
             # executables between ranks while merging them (del_exe):
             nodes_ranks=self.nodes.to_nodes_ppn(
-                spec,can_merge_ranks=self.nodes.same_except_exe)
+                spec,can_merge_ranks=self.nodes.same_except_exe,
+                placement=placement)
             
             sio.write(indent*space+'<nodes>' \
                 + '+'.join([f'{n}:ppn={p}' for n,p in nodes_ranks ]) \
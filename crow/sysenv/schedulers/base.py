@@ -1,6 +1,70 @@
+import functools
 from abc import abstractmethod
+from collections import namedtuple, Sequence
+from crow.sysenv.jobs import JobResourceSpec
+
+__all__=[ 'Scheduler', 'RenderCounts', 'memoize_resources',
+          'array_index_ranges' ]
+
+## Number of distinct resource requests a Scheduler rendered, and the
+## total number of requests it received.
+RenderCounts=namedtuple('RenderCounts',[ 'distinct', 'total' ])
+
+def memoize_resources(method):
+    """!Decorator for Scheduler.rocoto_resources and batch_resources.
+    Workflows send the same few resource specifications from hundreds
+    of tasks, so the text for each distinct JobResourceSpec and
+    keyword arguments is generated once and reused.  Calls that do not
+    pass a single resource specification, or whose arguments cannot be
+    hashed, are not memoized."""
+    name=method.__name__
+    @functools.wraps(method)
+    def render(self,*args,**kwargs):
+        if len(args)!=1 or isinstance(args[0],str) or \
+           not isinstance(args[0],Sequence):
+            return method(self,*args,**kwargs)
+        spec=args[0]
+        if not isinstance(spec,JobResourceSpec):
+            spec=JobResourceSpec(spec)
+        try:
+            key=( name, spec, tuple(sorted(kwargs.items())) )
+            hash(key)
+        except TypeError:
+            return method(self,spec,**kwargs)
+        memo=self._resource_memo()
+        memo['total']+=1
+        text=memo['text'].get(key,None)
+        if text is None:
+            text=method(self,spec,**kwargs)
+            memo['text'][key]=text
+        return text
+    return render
+
+def array_index_ranges(indices):
+    """!Converts job array indices to the compact form batch systems
+    accept: 1-3,5,7-9.  The indices may be a count N, meaning 1
+    through N, or a sequence of integers."""
+    if isinstance(indices,int):
+        indices=range(1,indices+1)
+    indices=sorted(set([ int(i) for i in indices ]))
+    if not indices:
+        raise ValueError('A job array needs at least one index.')
+    ranges=list()
+    first=last=indices[0]
+    for i in indices[1:]+[None]:
+        if i is not None and i==last+1:
+            last=i
+            continue
+        ranges.append(f'{first}' if first==last else f'{first}-{last}')
+        if i is not None:
+            first=last=i
+    return ','.join(ranges)
 
 class Scheduler(object):
+    ## Environment variable that holds a job array element's index, or
+    ## None if the scheduler has no job arrays.
+    array_index_var=None
+
     @abstractmethod
     def rocoto_accounting(self,spec,indent): pass
     @abstractmethod
@@ -11,3 +75,34 @@ class Scheduler(object):
     def batch_accounting(self,spec,**kwargs): pass
     @abstractmethod
     def batch_resources(self,spec,**kwargs): pass
+
+    @abstractmethod
+    def batch_array_resources(self,spec,indices,jobname=None,
+                              max_running=None):
+        """!Batch card for a job array: the batch_resources of each
+        element, plus the request for the array.  Each element finds
+        its index in the array_index_var environment variable.
+
+        @param spec the JobResourceSpec of each element
+        @param indices number of elements, or a sequence of indices
+        @param jobname name of the array job
+        @param max_running maximum number of elements that may run at
+          once, or None for no limit"""
+
+    def _resource_memo(self):
+        memo=self.__dict__.get('_Scheduler__memo',None)
+        if memo is None:
+            memo={ 'total':0, 'text':dict() }
+            self.__memo=memo
+        return memo
+
+    def render_counts(self):
+        """!Returns a RenderCounts with the number of distinct resource
+        requests rendered by rocoto_resources and batch_resources, and
+        the total number of requests."""
+        memo=self._resource_memo()
+        return RenderCounts(len(memo['text']),memo['total'])
+
+    def clear_resource_memo(self):
+        """!Discards all memoized resource text and resets the counts."""
+        self.__memo=None
@@ -1,13 +1,40 @@
 import logging
 import os
+import sys
+import signal
+import asyncio
 from abc import abstractmethod
 from collections import UserList, Mapping, Sequence, OrderedDict
-from subprocess import Popen, PIPE, CompletedProcess
+from subprocess import Popen, PIPE, CompletedProcess, TimeoutExpired
+from crow.sysenv.jobs import megabytes
+from crow.sysenv.exceptions import MachineTooSmallError
 
-__all__=['ShellCommand']
+__all__=['ShellCommand','CommandPool']
 
 logger=logging.getLogger('crow')
 
+def _run_in_new_loop(coroutine):
+    """!Runs a coroutine to completion in a new event loop, and closes
+    the loop.  Before Python 3.8, asyncio only reaps subprocesses of
+    the current event loop, so the new loop is made current until the
+    coroutine is done, and the previous one is then restored."""
+    loop=asyncio.new_event_loop()
+    if sys.version_info>=(3,8):
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+    try:
+        previous=asyncio.get_event_loop()
+    except RuntimeError:
+        previous=None # not the main thread
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(previous)
+        loop.close()
+
 class ShellCommand(object):
     def __init__(self,command,env=False,files=False,cwd=False):
         if isinstance(command,str):
@@ -45,21 +72,26 @@ class ShellCommand(object):
           f'env={self.env!r}, cwd={self.cwd!r}, files=[ ' + \
           ', '.join([ repr(v) for k,v in self.files.items() ]) + '])'
         
-    def run(self,input=None,stdin=None,stdout=None,stderr=None,timeout=None,
-            check=False,encoding=None):
-        """!Runs this command via subprocess.Pipe.  Returns a
-        CompletedProcess.  Arguments have the same meaning as
-        subprocess.run.        """
+    def _write_files(self):
         for name,f in self.files.items():
             mode=f.get('mode','wt')
             logger.info(f'{f["name"]}: write mode {mode}')
             with open(f['name'],mode) as fd:
                 fd.write(str(f['content']))
 
-        env=None
-        if self.env:
-            env=dict(os.environ)
-            env.update(self.env)
+    def _environment(self):
+        if not self.env: return None
+        env=dict(os.environ)
+        env.update({ k:str(v) for k,v in self.env.items() })
+        return env
+
+    def run(self,input=None,stdin=None,stdout=None,stderr=None,timeout=None,
+            check=False,encoding=None):
+        """!Runs this command via subprocess.Pipe.  Returns a
+        CompletedProcess.  Arguments have the same meaning as
+        subprocess.run.        """
+        self._write_files()
+        env=self._environment()
 
         logger.info(f'Popen {repr(self.command)}')
         pipe=Popen(args=self.command,stdin=stdin,stdout=stdout,
@@ -70,3 +102,137 @@ class ShellCommand(object):
         if check:
             cp.check_returncode()
         return cp
+
+    async def run_async(self,input=None,stdin=None,stdout=None,stderr=None,
+                        timeout=None,check=False,encoding=None):
+        """!Coroutine version of run(), using an asyncio subprocess so
+        many commands can run at once in one thread.  Arguments have
+        the same meaning as in run().  On timeout, the process is
+        killed and TimeoutExpired is raised."""
+        self._write_files()
+        env=self._environment()
+        if encoding is not None and input is not None:
+            input=input.encode(encoding)
+
+        logger.info(f'create_subprocess_exec {repr(self.command)}')
+        proc=await asyncio.create_subprocess_exec(
+            *self.command,stdin=stdin,stdout=stdout,stderr=stderr,
+            cwd=self.cwd,env=env)
+        try:
+            (stdout, stderr) = await asyncio.wait_for(
+                proc.communicate(input=input),timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise TimeoutExpired(self.command,timeout)
+        if encoding is not None:
+            if stdout is not None: stdout=stdout.decode(encoding)
+            if stderr is not None: stderr=stderr.decode(encoding)
+        cp=CompletedProcess(self.command,proc.returncode,stdout,stderr)
+        if check:
+            cp.check_returncode()
+        return cp
+
+class CommandPool(object):
+    """!Runs many ShellCommands at once on one node, starting each one
+    as soon as enough of the node's CPUs and memory are free.
+
+    The budget is the node's logical CPUs (physical cores only, unless
+    hyperthreading_allowed) and memory_per_node from a GenericNodeSpec.
+    A node without memory_per_node has no memory limit.  Each command's
+    stdout and stderr go to NAME.out and NAME.err in output_dir.
+
+    A command that exceeds the timeout is killed.  Its result has the
+    return code of a process killed by SIGKILL, and its name is in
+    the timed_out list.
+
+    @param nodes the GenericNodeSpec of the node
+    @param output_dir directory for the output files
+    @param cpus override the number of CPUs in the budget
+    @param memory override the memory budget, in megabytes"""
+    def __init__(self,nodes,output_dir='.',cpus=None,memory=None):
+        self.cpus=int(cpus if cpus is not None else nodes.cores_per_node*(
+            nodes.cpus_per_core if nodes.hyperthreading_allowed else 1))
+        self.memory=megabytes(memory if memory is not None
+                              else nodes.memory_per_node)
+        self.output_dir=output_dir
+        self.commands=list()
+        self.timed_out=list()
+
+    def add(self,command,name=None,cpus=1,memory=0):
+        """!Adds a command to the pool.
+
+        @param command a ShellCommand, or anything
+          ShellCommand.from_object accepts
+        @param name base name of the output files (default: cmdNNN)
+        @param cpus CPUs the command uses
+        @param memory memory the command uses, as megabytes or a
+          string with units, like "2G"
+        @raise MachineTooSmallError if the command does not fit the budget"""
+        command=ShellCommand.from_object(command)
+        name=name or f'cmd{len(self.commands):03d}'
+        memory=megabytes(memory)
+        if cpus>self.cpus or (self.memory and memory>self.memory):
+            raise MachineTooSmallError(
+                f'{name}: needs {cpus} CPUs and {memory} MB, but the pool '
+                f'has {self.cpus} CPUs and {self.memory or "unlimited"} MB')
+        self.commands.append((name,command,cpus,memory))
+        return name
+
+    async def run_async(self,timeout=None):
+        """!Coroutine that runs all commands and returns their
+        CompletedProcess objects, in the order they were added.  The
+        stdout and stderr of each are the paths to its output files.
+        All commands are run even if some fail to start; the first such
+        error is raised once the others are done."""
+        available={ 'cpus':self.cpus, 'memory':self.memory }
+        self.timed_out=list()
+        condition=asyncio.Condition()
+
+        def fits(cpus,memory):
+            return cpus<=available['cpus'] and \
+                ( not self.memory or memory<=available['memory'] )
+
+        async def run_one(name,command,cpus,memory):
+            async with condition:
+                await condition.wait_for(lambda: fits(cpus,memory))
+                available['cpus']-=cpus
+                available['memory']-=memory
+            out=os.path.join(self.output_dir,name+'.out')
+            err=os.path.join(self.output_dir,name+'.err')
+            try:
+                with open(out,'wb') as outfd, open(err,'wb') as errfd:
+                    cp=await command.run_async(stdout=outfd,stderr=errfd,
+                                               timeout=timeout)
+            except TimeoutExpired:
+                logger.warning(f'{name}: killed after {timeout} seconds')
+                self.timed_out.append(name)
+                cp=CompletedProcess(command.command,-signal.SIGKILL)
+            finally:
+                async with condition:
+                    available['cpus']+=cpus
+                    available['memory']+=memory
+                    condition.notify_all()
+            return CompletedProcess(cp.args,cp.returncode,out,err)
+
+        results=await asyncio.gather(*[
+            run_one(*command) for command in self.commands ],
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result,BaseException):
+                raise result
+        return results
+
+    def run(self,timeout=None,check=False):
+        """!Runs all commands and returns a list of CompletedProcess
+        objects, in the order they were added.  If check is True,
+        raises CalledProcessError for the first command that failed,
+        after all commands are done."""
+        os.makedirs(self.output_dir,exist_ok=True)
+        results=_run_in_new_loop(self.run_async(timeout=timeout))
+        failed=[ cp for cp in results if cp.returncode ]
+        logger.info(f'CommandPool: {len(results)} commands, '
+                    f'{len(failed)} failed, {len(self.timed_out)} timed out')
+        if check and failed:
+            failed[0].check_returncode()
+        return results
@@ -0,0 +1,391 @@
+"""!Cached batch system job status.
+
+Tools that show a workflow's state, such as rocoto_viewer, run bjobs
+or squeue on every refresh.  With many viewers open, that floods the
+scheduler daemons with identical queries.  This module runs one
+StatusPoller per user instead.  It runs the scheduler's status
+command at a fixed interval, parses the output into JobStatus
+objects, and publishes the result in a JSON cache file and,
+optionally, on a local Unix socket.  Viewers read the cache with
+read_status_file or query_status_socket and never run the command
+themselves.  The utils/crow_status_poller_sh.py script starts a
+poller, and exits if another one already writes the cache file.
+
+Commands are run by a StatusBackend.  The SubprocessStatusBackend runs
+real programs, while the FakeStatusBackend returns canned text, for
+tests.
+
+Parsers exist for LSF (bjobs), Slurm (squeue) and Moab (showq --xml).
+The status_format_for function maps the names of CROW schedulers to
+them."""
+
+f'This module requires python 3.6 or newer.'
+
+import os, json, time, fcntl, socket, logging, threading, subprocess, \
+       socketserver, tempfile
+import xml.etree.ElementTree as ET
+from abc import abstractmethod
+from collections import namedtuple, OrderedDict
+
+from crow.sysenv.exceptions import SysEnvConfigError
+
+__all__=[ 'JobStatus', 'JOB_STATES', 'StatusFormat', 'STATUS_FORMATS',
+          'status_format_for', 'parse_lsf_status', 'parse_slurm_status',
+          'parse_moab_status', 'StatusBackend', 'SubprocessStatusBackend',
+          'FakeStatusBackend', 'StatusPoller', 'read_status_file',
+          'query_status_socket' ]
+
+_logger=logging.getLogger('crow')
+
+## The states of a JobStatus, in the order of a job's life.
+JOB_STATES=[ 'QUEUED', 'HELD', 'RUNNING', 'SUSPENDED', 'DONE', 'FAILED',
+             'UNKNOWN' ]
+
+class JobStatus(namedtuple('JobStatus',[ 'jobid', 'name', 'state', 'queue',
+                                         'user', 'native_state' ])):
+    """!The state of one batch job.  The state is one of JOB_STATES,
+    while native_state is the scheduler's own name for it."""
+    __slots__=()
+
+    def to_dict(self):
+        return OrderedDict(zip(self._fields,self))
+
+    @staticmethod
+    def from_dict(d):
+        return JobStatus(**{ key:d.get(key,None) for key in JobStatus._fields })
+
+########################################################################
+
+_LSF_STATES={ 'PEND':'QUEUED', 'WAIT':'QUEUED', 'PROV':'QUEUED',
+              'PSUSP':'HELD', 'RUN':'RUNNING', 'USUSP':'SUSPENDED',
+              'SSUSP':'SUSPENDED', 'DONE':'DONE', 'EXIT':'FAILED',
+              'ZOMBI':'FAILED', 'UNKWN':'UNKNOWN' }
+
+## bjobs output fields, separated by semicolons.
+LSF_STATUS_FIELDS='jobid stat queue job_name user delimiter=\';\''
+
+def parse_lsf_status(text):
+    """!Parses "bjobs -a -o 'jobid stat queue job_name user
+    delimiter=;'" output.  The first line holds the column names.
+    Returns an OrderedDict mapping job id to JobStatus."""
+    jobs=OrderedDict()
+    keys=None
+    for line in text.splitlines():
+        if not line.strip() or 'No job found' in line: continue
+        values=line.split(';')
+        if keys is None:
+            keys=[ key.strip().upper() for key in values ]
+            continue
+        fields=dict(zip(keys,[ value.strip() for value in values ]))
+        jobid=fields.get('JOBID','')
+        if not jobid: continue
+        native=fields.get('STAT','')
+        jobs[jobid]=JobStatus(jobid,fields.get('JOB_NAME',None),
+                              _LSF_STATES.get(native,'UNKNOWN'),
+                              fields.get('QUEUE',None),
+                              fields.get('USER',None),native)
+    return jobs
+
+_SLURM_STATES={ 'PENDING':'QUEUED', 'CONFIGURING':'QUEUED',
+                'REQUEUED':'QUEUED', 'RESV_DEL_HOLD':'HELD',
+                'REQUEUE_HOLD':'HELD', 'RUNNING':'RUNNING',
+                'COMPLETING':'RUNNING', 'SUSPENDED':'SUSPENDED',
+                'STOPPED':'SUSPENDED', 'COMPLETED':'DONE',
+                'FAILED':'FAILED', 'CANCELLED':'FAILED',
+                'TIMEOUT':'FAILED', 'NODE_FAIL':'FAILED',
+                'PREEMPTED':'FAILED', 'BOOT_FAIL':'FAILED',
+                'DEADLINE':'FAILED', 'OUT_OF_MEMORY':'FAILED' }
+
+## squeue --format with the fields parse_slurm_status expects
+SLURM_STATUS_FORMAT='%i|%T|%P|%j|%u|%r'
+
+def parse_slurm_status(text):
+    """!Parses "squeue -h -o '%i|%T|%P|%j|%u|%r'" output.  Returns an
+    OrderedDict mapping job id to JobStatus.  Pending jobs held by
+    the user or administrator, whose reason is JobHeldUser or
+    JobHeldAdmin, are HELD.  The reason column may be omitted."""
+    jobs=OrderedDict()
+    for line in text.splitlines():
+        if not line.strip(): continue
+        values=[ value.strip() for value in line.split('|',5) ]
+        if len(values)<5:
+            _logger.warning(f'{line!r}: not squeue {SLURM_STATUS_FORMAT} '
+                            'output; ignoring')
+            continue
+        jobid,native,queue,name,user=values[0:5]
+        reason=values[5] if len(values)>5 else ''
+        native=native.split()[0] if native else native
+        state=_SLURM_STATES.get(native,'UNKNOWN')
+        if state=='QUEUED' and reason.startswith('JobHeld'):
+            state='HELD'
+        jobs[jobid]=JobStatus(jobid,name,state,queue,user,native)
+    return jobs
+
+_MOAB_STATES={ 'Idle':'QUEUED', 'Staging':'QUEUED', 'Starting':'QUEUED',
+               'Deferred':'HELD', 'Hold':'HELD', 'BatchHold':'HELD',
+               'SystemHold':'HELD', 'UserHold':'HELD', 'Blocked':'HELD',
+               'NotQueued':'HELD', 'Running':'RUNNING',
+               'Suspended':'SUSPENDED', 'Completed':'DONE',
+               'Removed':'FAILED', 'Vacated':'FAILED' }
+
+def parse_moab_status(text):
+    """!Parses "showq --xml" output.  Returns an OrderedDict mapping job
+    id to JobStatus."""
+    jobs=OrderedDict()
+    if not text.strip(): return jobs
+    try:
+        root=ET.fromstring(text)
+    except ET.ParseError as pe:
+        raise ValueError(f'showq output is not valid XML: {pe}')
+    for job in root.iter('job'):
+        jobid=job.get('JobID',None)
+        if not jobid: continue
+        native=job.get('State','')
+        jobs[jobid]=JobStatus(jobid,job.get('JobName',None),
+                              _MOAB_STATES.get(native,'UNKNOWN'),
+                              job.get('Class',None),job.get('User',None),
+                              native)
+    return jobs
+
+class StatusFormat(namedtuple('StatusFormat',[ 'name', 'command',
+                                               'parser' ])):
+    """!How to ask one kind of batch system for its jobs.  The command
+    is a function of the user name that returns the argument list,
+    and the parser turns the command's output into an OrderedDict of
+    JobStatus objects."""
+    __slots__=()
+
+## Status commands and parsers, keyed by batch system.
+STATUS_FORMATS={
+    'LSF': StatusFormat(
+        'LSF',lambda user: [ 'bjobs', '-a', '-o', LSF_STATUS_FIELDS,
+                             '-u', user ],
+        parse_lsf_status),
+    'Slurm': StatusFormat(
+        'Slurm',lambda user: [ 'squeue', '-h', '-o', SLURM_STATUS_FORMAT,
+                               '-u', user ],
+        parse_slurm_status),
+    'Moab': StatusFormat(
+        'Moab',lambda user: [ 'showq', '--xml', '-u', user ],
+        parse_moab_status),
+}
+
+def status_format_for(scheduler_name):
+    """!Returns the StatusFormat for a CROW scheduler name, such as
+    LSFAlps or MoabTorque.
+
+    @raise SysEnvConfigError if the scheduler has no status format"""
+    for name,fmt in STATUS_FORMATS.items():
+        if scheduler_name.startswith(name):
+            return fmt
+    raise SysEnvConfigError(f'{scheduler_name}: no job status parser for '
+                            'this scheduler')
+
+########################################################################
+
+class StatusBackend(object):
+    """!Runs a status command.  Subclasses implement run(), which
+    receives the argument list and returns the command's output."""
+    @abstractmethod
+    def run(self,args):
+        """!Runs the status command with the given arguments and
+        returns its output."""
+
+class SubprocessStatusBackend(StatusBackend):
+    """!Runs status commands as subprocesses.
+
+    @param timeout seconds to wait for the command"""
+    def __init__(self,timeout=60):
+        self.timeout=timeout
+    def run(self,args):
+        _logger.debug(' '.join(args))
+        result=subprocess.run(args,stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,timeout=self.timeout,
+                              universal_newlines=True,check=False)
+        if result.returncode:
+            # bjobs exits non-zero when there are no jobs.
+            _logger.info(f'{args[0]}: exit status {result.returncode}: '
+                         f'{result.stderr.strip()}')
+        return result.stdout
+
+class FakeStatusBackend(StatusBackend):
+    """!Returns canned output instead of running commands, and keeps the
+    argument lists in the commands list.  Each call returns the next
+    item of outputs; the last one is repeated once they run out.  An
+    item that is an exception is raised instead."""
+    def __init__(self,outputs):
+        self.outputs=list(outputs)
+        self.commands=list()
+    def run(self,args):
+        self.commands.append(list(args))
+        output=self.outputs.pop(0) if len(self.outputs)>1 else self.outputs[0]
+        if isinstance(output,Exception):
+            raise output
+        return output
+
+########################################################################
+
+def _snapshot(fmt,user,jobs,polled):
+    return { 'format':fmt.name, 'user':user, 'time':polled,
+             'jobs':[ job.to_dict() for job in jobs.values() ] }
+
+def _jobs_from_snapshot(snapshot):
+    return OrderedDict([ (d['jobid'],JobStatus.from_dict(d))
+                         for d in snapshot.get('jobs',[]) ])
+
+class _StatusRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(self.server.poller.snapshot_bytes())
+
+class _StatusSocketServer(socketserver.ThreadingMixIn,
+                          socketserver.UnixStreamServer):
+    daemon_threads=True
+
+class StatusPoller(object):
+    """!Runs a batch system's status command every interval seconds and
+    publishes the parsed result.
+
+    Only one poller per cache file may run.  The lock() method takes
+    an advisory lock on cache_file+".lock" and returns False if another
+    poller holds it, so a viewer can start a poller unconditionally.
+
+    @param fmt the StatusFormat, or a CROW scheduler name
+    @param cache_file the JSON file to write after each poll
+    @param user user whose jobs to list (default: $USER)
+    @param interval seconds between polls
+    @param backend StatusBackend to run the command (default: subprocess)"""
+    def __init__(self,fmt,cache_file,user=None,interval=60,backend=None):
+        if isinstance(fmt,str):
+            fmt=status_format_for(fmt)
+        if interval<=0:
+            raise SysEnvConfigError(f'{interval}: status poll interval '
+                                    'must be positive')
+        self.format=fmt
+        self.cache_file=cache_file
+        self.user=user or os.environ.get('USER','')
+        self.interval=interval
+        self.backend=backend or SubprocessStatusBackend()
+        self.jobs=OrderedDict()
+        self.polled=None
+        self.polls=0
+        self.__snapshot=b'{}'
+        self.__mutex=threading.Lock()
+        self.__stop=threading.Event()
+        self.__lock_fd=None
+        self.__server=None
+
+    def lock(self):
+        """!Takes the per-cache-file lock.  Returns True if this poller
+        now holds it, or False if another one does."""
+        if self.__lock_fd is not None: return True
+        fd=open(self.cache_file+'.lock','a')
+        try:
+            fcntl.flock(fd,fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except OSError:
+            fd.close()
+            _logger.info(f'{self.cache_file}: another poller is running')
+            return False
+        self.__lock_fd=fd
+        return True
+
+    def unlock(self):
+        if self.__lock_fd is not None:
+            self.__lock_fd.close()
+            self.__lock_fd=None
+
+    def poll(self):
+        """!Runs the status command once, and updates the jobs, the
+        cache file, and the socket's reply.  If the command or parser
+        fails, the previous state is kept.  Returns the jobs."""
+        try:
+            text=self.backend.run(self.format.command(self.user))
+            jobs=self.format.parser(text)
+        except (OSError,ValueError,subprocess.SubprocessError) as e:
+            _logger.warning(f'{self.format.name} status: {e}')
+            return self.jobs
+        polled=time.time()
+        data=json.dumps(_snapshot(self.format,self.user,jobs,polled))
+        with self.__mutex:
+            self.jobs=jobs
+            self.polled=polled
+            self.polls+=1
+            self.__snapshot=data.encode('utf-8')
+        self._write_cache(data)
+        return jobs
+
+    def _write_cache(self,data):
+        dirname=os.path.dirname(os.path.abspath(self.cache_file))
+        with tempfile.NamedTemporaryFile(
+                'wt',dir=dirname,prefix=os.path.basename(self.cache_file)+'.',
+                delete=False) as fd:
+            fd.write(data)
+            tempname=fd.name
+        os.replace(tempname,self.cache_file)
+
+    def snapshot_bytes(self):
+        """!The JSON text of the last poll, as sent on the socket"""
+        with self.__mutex:
+            return self.__snapshot
+
+    def serve_socket(self,path):
+        """!Starts answering connections to a Unix socket at path, in a
+        background thread, with the JSON text of the last poll.  An
+        existing socket file at path is replaced."""
+        if os.path.exists(path):
+            os.unlink(path)
+        server=_StatusSocketServer(path,_StatusRequestHandler)
+        server.poller=self
+        os.chmod(path,0o600)
+        thread=threading.Thread(target=server.serve_forever,daemon=True)
+        thread.start()
+        self.__server=(server,path)
+
+    def stop(self):
+        """!Makes run() return after the current poll, and closes the
+        socket."""
+        self.__stop.set()
+        if self.__server is not None:
+            server,path=self.__server
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(path):
+                os.unlink(path)
+            self.__server=None
+
+    def run(self,max_polls=None):
+        """!Polls every interval seconds until stop() is called, or
+        until max_polls polls are done."""
+        count=0
+        while not self.__stop.is_set():
+            self.poll()
+            count+=1
+            if max_polls is not None and count>=max_polls:
+                break
+            self.__stop.wait(self.interval)
+
+def read_status_file(cache_file,max_age=None):
+    """!Reads the jobs from a StatusPoller's cache file.  Returns an
+    OrderedDict mapping job id to JobStatus, or None if the file is
+    missing, unreadable, or older than max_age seconds."""
+    try:
+        with open(cache_file,'rt') as fd:
+            snapshot=json.load(fd)
+    except (OSError,ValueError) as e:
+        _logger.debug(f'{cache_file}: {e}')
+        return None
+    if max_age is not None and time.time()-snapshot.get('time',0)>max_age:
+        return None
+    return _jobs_from_snapshot(snapshot)
+
+def query_status_socket(path,timeout=10):
+    """!Asks a StatusPoller's Unix socket for the jobs.  Returns an
+    OrderedDict mapping job id to JobStatus."""
+    with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        chunks=list()
+        while True:
+            chunk=sock.recv(65536)
+            if not chunk: break
+            chunks.append(chunk)
+    return _jobs_from_snapshot(json.loads(b''.join(chunks).decode('utf-8')))
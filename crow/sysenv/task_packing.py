@@ -0,0 +1,222 @@
+"""!Packs many small serial and OpenMP programs onto a few nodes.
+
+A serial or OpenMP JobResourceSpec normally gets a whole exclusive
+node, so hundreds of small commands, such as per-forecast-hour post
+jobs, use hundreds of nodes.  The pack_tasks function instead places
+them side by side on the cores of as few nodes as possible, or of a
+fixed number of nodes, using the capacity of a GenericNodeSpec.  The
+resulting TaskPacking can:
+
+* launch all programs at once as one MPMD program, with one MPI rank
+  per command, through any Parallelism (make_ShellCommand)
+* write a plain command file with one line per program, for CFP-style
+  launchers that run each line on its own rank (command_file)
+* write one batch card for the whole set (batch_resources)
+* report how much of the nodes it uses (efficiency, report)
+
+Each program occupies whole cores, as SrunMPI's CPU masks do, and its
+memory is its "memory" setting, or its memory_per_rank."""
+
+f'This module requires python 3.6 or newer.'
+
+import math, shlex, inspect, logging
+from io import StringIO
+from collections import namedtuple
+
+import crow.tools as tools
+from crow.tools import typecheck
+from crow.sysenv.exceptions import *
+from crow.sysenv.jobs import JobResourceSpec, megabytes
+from crow.sysenv.nodes import GenericNodeSpec, NodePlacement
+
+__all__=[ 'PackedTask', 'TaskPacking', 'pack_tasks' ]
+
+_logger=logging.getLogger('crow')
+
+class PackedTask(namedtuple('PackedTask',[ 'index', 'spec', 'node',
+                                           'first_core', 'cores',
+                                           'memory' ])):
+    """!Where one program went: the index of its JobResourceSpec in the
+    list given to pack_tasks, the node number, its cores on that node,
+    and its memory in megabytes."""
+    __slots__=()
+
+def _task_rank(spec):
+    if not isinstance(spec,JobResourceSpec):
+        spec=JobResourceSpec(spec)
+    if len(spec)!=1 or spec[0].is_mpi() and spec[0]['mpi_ranks']>1:
+        raise InvalidJobResourceSpec(
+            f'{spec!r}: only serial and OpenMP programs can be packed')
+    return spec[0]
+
+class TaskPacking(object):
+    """!A layout of serial and OpenMP programs on nodes, from pack_tasks.
+
+    @param nodes the GenericNodeSpec
+    @param specs the JobRankSpec of each program
+    @param tasks list of PackedTask, in node order
+    @param node_count number of nodes"""
+    def __init__(self,nodes,specs,tasks,node_count):
+        self.nodes=nodes
+        self.specs=list(specs)
+        self.tasks=list(tasks)
+        self.node_count=int(node_count)
+
+    def cores_used(self):
+        return sum([ task.cores for task in self.tasks ])
+
+    def memory_used(self):
+        return sum([ task.memory for task in self.tasks ])
+
+    def efficiency(self):
+        """!Fraction of the nodes' cores used by the programs"""
+        return self.cores_used()/float(self.node_count*self.nodes.cores_per_node)
+
+    def memory_efficiency(self):
+        """!Fraction of the nodes' memory used by the programs, or None
+        if the node memory is unknown"""
+        if not self.nodes.memory_per_node: return None
+        return self.memory_used()/float(self.node_count*
+                                        self.nodes.memory_per_node)
+
+    def report(self):
+        """!One line describing the packing and the nodes it saves over
+        giving each program an exclusive node"""
+        text=f'{len(self.tasks)} programs on {self.node_count} nodes ' \
+             f'(instead of {len(self.tasks)} exclusive nodes): ' \
+             f'{self.efficiency()*100:.1f}% of cores'
+        mem=self.memory_efficiency()
+        if mem is not None:
+            text+=f', {mem*100:.1f}% of memory'
+        return text
+
+    def mpmd_spec(self,**first_block):
+        """!Returns the JobResourceSpec of an MPMD program with one rank
+        per packed program, in node order.  Each block keeps its
+        program's threads and memory, and has its memory in
+        memory_per_rank.  The first block also gets the longest
+        walltime of the programs, and any keys given as arguments,
+        such as jobname."""
+        ranks=[ dict(self.specs[task.index],mpi_ranks=1,exclusive=True,
+                     memory_per_rank=task.memory) for task in self.tasks ]
+        walltimes=[ tools.to_timedelta(rank['walltime'])
+                    for rank in ranks if rank.get('walltime','') ]
+        if walltimes:
+            ranks[0]['walltime']=max(walltimes)
+        ranks[0].update(first_block)
+        return JobResourceSpec(ranks)
+
+    def placement(self,spec=None):
+        """!Returns the NodePlacement of mpmd_spec(), or of spec, which
+        must be a spec returned by mpmd_spec."""
+        if spec is None: spec=self.mpmd_spec()
+        layouts=[ list() for node in range(self.node_count) ]
+        for rank,task in enumerate(self.tasks):
+            layouts[task.node].append((rank,1))
+        return NodePlacement(spec,[ (1,layout) for layout in layouts ])
+
+    def make_ShellCommand(self,parallelism):
+        """!Returns the Parallelism's ShellCommand that runs all programs
+        at once, one MPI rank each, on the packed nodes."""
+        spec=self.mpmd_spec()
+        return parallelism.make_ShellCommand(spec,
+                                             placement=self.placement(spec))
+
+    def command_file(self):
+        """!Returns the text of a command file with one sh command per
+        program, in rank order, for CFP-style launchers."""
+        sio=StringIO()
+        for task in self.tasks:
+            rank=self.specs[task.index]
+            if rank.is_openmp():
+                sio.write('OMP_NUM_THREADS=%d '%(
+                    self.nodes.omp_threads_for(rank)))
+            words=[ rank['exe'] ] + [ str(arg) for arg in rank['args'] ]
+            sio.write(' '.join([ shlex.quote(word) for word in words ]))
+            sio.write('\n')
+        ret=sio.getvalue()
+        sio.close()
+        return ret
+
+    def batch_resources(self,scheduler,**first_block):
+        """!Returns the scheduler's batch card for all programs as one
+        job on the packed nodes.  Keyword arguments are added to the
+        first block of mpmd_spec()."""
+        spec=self.mpmd_spec(**first_block)
+        if 'placement' in inspect.signature(
+                scheduler.batch_resources).parameters:
+            return scheduler.batch_resources(
+                spec,placement=self.placement(spec))
+        return scheduler.batch_resources(spec)
+
+    def __repr__(self):
+        return f'TaskPacking({len(self.tasks)} programs on ' \
+               f'{self.node_count} nodes)'
+
+def pack_tasks(nodes,specs,node_count=None):
+    """!Places serial and OpenMP programs on nodes, largest first.
+    Each program gets whole cores: its threads times the node's CPUs
+    per core, divided among the hyperthreads it may use.
+
+    @param nodes a GenericNodeSpec
+    @param specs list of JobResourceSpec objects, or lists of dicts
+      that can be made into one, each with one serial or OpenMP block
+    @param node_count number of nodes to spread the programs over.
+      Default: as few as possible.  No more nodes than programs are
+      used.
+    @returns a TaskPacking
+    @raise MachineTooSmallError if the programs do not fit on
+      node_count nodes, or one program does not fit on a node"""
+    typecheck('nodes',nodes,GenericNodeSpec)
+    ranks=[ _task_rank(spec) for spec in specs ]
+    needs=list()
+    for index,rank in enumerate(ranks):
+        cores=int(math.ceil(nodes.cpus_per_rank(rank)/nodes.cpus_per_core))
+        if rank.want_max_threads():
+            cores=nodes.cores_per_node
+        memory=int(math.ceil(megabytes(rank['memory']))) \
+               if rank.get('memory','') else rank.memory_per_rank
+        if cores>nodes.cores_per_node or \
+           nodes.memory_per_node and memory>nodes.memory_per_node:
+            raise MachineTooSmallError(
+                f'{rank!r}: needs {cores} cores and {memory} MB; too big '
+                f'for one node')
+        needs.append((index,cores,memory))
+
+    # Free [cores,memory] on each node.  A fixed number of nodes is
+    # filled evenly; otherwise each program goes on the first node
+    # that fits, and a new node is added when none does.
+    free=list()
+    if node_count is not None and node_count>len(ranks):
+        _logger.info(f'{len(ranks)} programs cannot use {node_count} '
+                     'nodes; using one node per program')
+        node_count=len(ranks)
+    if node_count is not None:
+        free=[ [ nodes.cores_per_node, nodes.memory_per_node ]
+               for node in range(node_count) ]
+    placed=list()
+    for index,cores,memory in sorted(needs,key=lambda n: (-n[1],-n[2],n[0])):
+        fits=[ node for node,(free_cores,free_memory) in enumerate(free)
+               if cores<=free_cores and ( not nodes.memory_per_node or
+                                          memory<=free_memory ) ]
+        if fits and node_count is not None:
+            node=max(fits,key=lambda node: (free[node][0],-node))
+        elif fits:
+            node=fits[0]
+        elif node_count is not None:
+            raise MachineTooSmallError(
+                f'{len(ranks)} programs do not fit on {node_count} nodes')
+        else:
+            free.append([ nodes.cores_per_node, nodes.memory_per_node ])
+            node=len(free)-1
+        first_core=nodes.cores_per_node-free[node][0]
+        free[node][0]-=cores
+        free[node][1]-=memory
+        placed.append(PackedTask(index,ranks[index],node,first_core,
+                                 cores,memory))
+
+    placed.sort(key=lambda t: (t.node,t.first_core))
+    packing=TaskPacking(nodes,ranks,placed,
+                        node_count if node_count is not None else len(free))
+    _logger.info(packing.report())
+    return packing
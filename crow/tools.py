@@ -1,13 +1,21 @@
-import subprocess, os, re, logging, tempfile, datetime, shutil, math
+import subprocess, os, re, logging, tempfile, datetime, shutil, math, json, \
+       hashlib, concurrent.futures, errno
 from datetime import timedelta
 from copy import deepcopy, copy
 from contextlib import suppress, contextmanager
+from collections import OrderedDict
 from collections.abc import Mapping
 
+try:
+    import fcntl
+except ImportError:
+    fcntl=None # not on POSIX; reflinks are unavailable
+
 __all__=['panasas_gb','gpfs_gb','to_timedelta','deliver_file','NamedConstant',
          'Clock','str_timedelta','memory_in_bytes','to_printf_octal',
          'str_to_posix_sh','typecheck','ZERO_DT','shell_to_python_type',
-         'MISSING','chdir','make_dict_from']
+         'MISSING','chdir','make_dict_from','write_files_if_changed',
+         'FileWriteReport','DELIVERY_METHODS']
 
 _logger=logging.getLogger('crow.tools')
 
@@ -29,25 +37,134 @@ def chdir(dir):
     yield
     os.chdir(olddir)
 
+class _Unsupported(Exception):
+    """!Raised by a delivery method that cannot copy this file, so the
+    next method in the chain is tried."""
+
+_FALLBACK_ERRNOS=set([ errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP,
+                       errno.ENOTTY, errno.EINVAL, errno.EBADF,
+                       errno.ENOTSUP, errno.EPERM ])
+
+## ioctl request that clones a file's extents on Linux (reflink)
+_FICLONE=0x40049409
+
+def _reflink(in_fd,out_fd,size,blocksize):
+    if fcntl is None: raise _Unsupported('no fcntl module')
+    try:
+        fcntl.ioctl(out_fd.fileno(),_FICLONE,in_fd.fileno())
+    except OSError as e:
+        if e.errno in _FALLBACK_ERRNOS: raise _Unsupported(str(e))
+        raise
+
+def _copy_file_range(in_fd,out_fd,size,blocksize):
+    if not hasattr(os,'copy_file_range'):
+        raise _Unsupported('no os.copy_file_range')
+    _kernel_copy(lambda i,o,n: os.copy_file_range(i,o,n),in_fd,out_fd,
+                 size,blocksize)
+
+def _sendfile(in_fd,out_fd,size,blocksize):
+    if not hasattr(os,'sendfile'):
+        raise _Unsupported('no os.sendfile')
+    offset=[0]
+    def send(i,o,n):
+        sent=os.sendfile(o,i,offset[0],n)
+        offset[0]+=sent
+        return sent
+    _kernel_copy(send,in_fd,out_fd,size,blocksize)
+
+def _kernel_copy(copy,in_fd,out_fd,size,blocksize):
+    # Copies in chunks much larger than blocksize, since no data
+    # passes through Python.
+    chunk=max(blocksize,1<<30)
+    copied=0
+    while copied<size:
+        try:
+            count=copy(in_fd.fileno(),out_fd.fileno(),min(chunk,size-copied))
+        except OSError as e:
+            if e.errno in _FALLBACK_ERRNOS: raise _Unsupported(str(e))
+            raise
+        if not count:
+            # Some filesystems report success without copying, and the
+            # file may have shrunk.  Either way, let the next method try.
+            raise _Unsupported(f'copied only {copied} of {size} bytes')
+        copied+=count
+
+def _copy_loop(in_fd,out_fd,size,blocksize):
+    shutil.copyfileobj(in_fd,out_fd,length=blocksize)
+
+## Ways deliver_file can copy data, in the order they are tried.
+## Each is skipped when the platform or filesystem cannot do it.
+DELIVERY_METHODS=OrderedDict([ ( 'reflink', _reflink ),
+                               ( 'copy_file_range', _copy_file_range ),
+                               ( 'sendfile', _sendfile ),
+                               ( 'copy', _copy_loop ) ])
+
+def _copy_data(in_fd,out_fd,size,blocksize,methods):
+    for name in methods:
+        try:
+            DELIVERY_METHODS[name](in_fd,out_fd,size,blocksize)
+            return name
+        except _Unsupported as u:
+            _logger.debug(f'{out_fd.name}: cannot {name}: {u}')
+            in_fd.seek(0)
+            out_fd.seek(0)
+            out_fd.truncate()
+    raise OSError(f'{out_fd.name}: none of the delivery methods '
+                  f'{", ".join(methods)} worked')
+
 def deliver_file(from_file: str,to_file: str,*,blocksize: int=1048576,
                  permmask: int=2,preserve_perms: bool=True,
                  preserve_times: bool=True,preserve_group: bool=True,
-                 mkdir: bool=True) -> None:
+                 mkdir: bool=True,hardlink: bool=False,
+                 methods=None) -> str:
+    """!Copies from_file to to_file.  The data goes to a temporary file
+    in the destination directory, which is then renamed, so readers
+    never see a partial file.
+
+    The data is copied by the first of the DELIVERY_METHODS that
+    works: a reflink (copy-on-write clone), then the kernel's
+    copy_file_range or sendfile, and last a loop through Python in
+    blocksize chunks.  If hardlink is True and both files are on the
+    same device, to_file is instead a hard link to from_file.  A hard
+    link shares the source's permissions, times, and group, so
+    permmask is not applied to it.
+
+    @param methods names of DELIVERY_METHODS to try, in order
+      (default: all)
+    @returns "hardlink" or the name of the method that copied the data"""
     to_dir=os.path.dirname(to_file)
     to_base=os.path.basename(to_file)
     if mkdir and to_dir and not os.path.isdir(to_dir):
         _logger.info(f'{to_dir}: makedirs')
-        os.makedirs(to_dir)
+        os.makedirs(to_dir,exist_ok=True)
+    methods=list(DELIVERY_METHODS) if methods is None else list(methods)
     temppath=None # type: str
     _logger.info(f'{to_file}: deliver from {from_file}')
     try:
+        if hardlink and os.stat(from_file).st_dev== \
+           os.stat(to_dir or '.').st_dev:
+            linkpath=os.path.join(to_dir,
+                                  f'_tmp_{to_base}.link.{os.getpid()}')
+            with suppress(FileNotFoundError): os.unlink(linkpath)
+            try:
+                os.link(from_file,linkpath)
+            except OSError as e:
+                _logger.debug(f'{to_file}: cannot hardlink: {e}')
+            else:
+                # rename does nothing if to_file is already a link to
+                # from_file, so the finally block removes the temp link.
+                temppath=linkpath
+                os.rename(temppath,to_file)
+                _logger.debug(f'{to_file}: hardlink to {from_file}')
+                return 'hardlink'
         with open(from_file,'rb') as in_fd:
             istat=os.fstat(in_fd.fileno())
             with tempfile.NamedTemporaryFile(
                     prefix=f"_tmp_{to_base}.part.",
                     delete=False,dir=to_dir) as out_fd:
                 temppath=out_fd.name
-                shutil.copyfileobj(in_fd,out_fd,length=blocksize)
+                method=_copy_data(in_fd,out_fd,istat.st_size,blocksize,
+                                  methods)
         assert(temppath)
         assert(os.path.exists(temppath))
         if preserve_perms:
@@ -58,12 +175,116 @@ def deliver_file(from_file: str,to_file: str,*,blocksize: int=1048576,
             os.chown(temppath,-1,istat.st_gid)
         os.rename(temppath,to_file)
         temppath=None
+        _logger.debug(f'{to_file}: copied with {method}')
+        return method
     except Exception as e:
         _logger.warning(f'{to_file}: {e}')
         raise
     finally: # Delete file on error
         if temppath and os.path.exists(temppath): os.unlink(temppath)
 
+class FileWriteReport(object):
+    """!Result of write_files_if_changed: lists of the file names that
+    were new, changed, unchanged, or are in the manifest but were not
+    written this time (removed)."""
+    def __init__(self):
+        self.new=list()
+        self.changed=list()
+        self.unchanged=list()
+        self.removed=list()
+    def __str__(self):
+        return f'{len(self.new)} new, {len(self.changed)} changed, ' \
+               f'{len(self.unchanged)} unchanged, {len(self.removed)} removed'
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _write_if_changed(filename: str,data: bytes,digest: str,
+                      known_digest: str) -> str:
+    """!Writes one file for write_files_if_changed.  Returns "new",
+    "changed" or "unchanged"."""
+    try:
+        if known_digest is None:
+            # Not in the manifest, so compare with the file itself.
+            with open(filename,'rb') as fd:
+                if _sha256(fd.read())==digest:
+                    return 'unchanged'
+        elif known_digest==digest and os.path.exists(filename):
+            return 'unchanged'
+        status='changed' if os.path.exists(filename) else 'new'
+    except FileNotFoundError:
+        status='new'
+    with open(filename,'wb') as fd:
+        fd.write(data)
+    return status
+
+def write_files_if_changed(files: Mapping,manifest: str=None,*,
+                           max_workers: int=8,complete: bool=True,
+                           delete_removed: bool=False) -> FileWriteReport:
+    """!Writes text files, skipping those whose content is unchanged
+    so their modification times stay the same.
+
+    @param files mapping from file path to the text content
+    @param manifest path to a JSON file of content hashes from the
+      last write.  Files whose hash matches the manifest are not read
+      or written.  Files absent from it are compared with the content
+      on disk.  The manifest is rewritten to describe this write.
+    @param max_workers number of threads writing files
+    @param complete if True, the files are the whole set described
+      by the manifest, and manifest files not in them are removed.
+      If False, the files are added to the set: their hashes are
+      merged into the manifest, and no files are removed.
+    @param delete_removed if True, removed files are deleted.
+      Otherwise they are only reported.
+    @returns a FileWriteReport"""
+    known=dict()
+    if manifest and os.path.exists(manifest):
+        with open(manifest,'rt') as fd:
+            known=json.load(fd)
+
+    files=OrderedDict([ ( os.path.abspath(filename), content.encode('utf-8') )
+                        for filename,content in files.items() ])
+    digests={ filename:_sha256(data) for filename,data in files.items() }
+
+    # Make each directory once, rather than once per file:
+    for dirname in sorted(set([ os.path.dirname(f) for f in files ])):
+        if dirname and not os.path.isdir(dirname):
+            _logger.info(f'{dirname}: makedirs')
+            os.makedirs(dirname,exist_ok=True)
+
+    report=FileWriteReport()
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        futures=[ ( filename, pool.submit(
+            _write_if_changed,filename,data,digests[filename],
+            known.get(filename,None)) )
+                  for filename,data in files.items() ]
+        for filename,future in futures:
+            status=future.result()
+            getattr(report,status).append(filename)
+            if status!='unchanged':
+                _logger.debug(f'{filename}: write ({status})')
+
+    for filename in known:
+        if filename in files: continue
+        if not complete:
+            digests[filename]=known[filename]
+            continue
+        report.removed.append(filename)
+        if delete_removed:
+            _logger.info(f'{filename}: delete; no longer generated')
+            with suppress(FileNotFoundError): os.unlink(filename)
+
+    if manifest:
+        manifest_dir=os.path.dirname(os.path.abspath(manifest))
+        os.makedirs(manifest_dir,exist_ok=True)
+        with tempfile.NamedTemporaryFile('wt',dir=manifest_dir,delete=False,
+                prefix=f'_tmp_{os.path.basename(manifest)}.') as fd:
+            json.dump(digests,fd,indent=0,sort_keys=True)
+            tempname=fd.name
+        os.replace(tempname,manifest)
+    _logger.info(f'wrote files: {report}')
+    return report
+
 def panasas_gb(dir,pan_df='pan_df'):
     rdir=os.path.realpath(dir)
     stdout=subprocess.check_output([pan_df,'-B','1G','-P',rdir])
@@ -2,9 +2,10 @@
 
 import unittest
 from context import crow
-from crow.sysenv import ShellCommand
+from crow.sysenv import ShellCommand, CommandPool, GenericNodeSpec
+from crow.sysenv.exceptions import MachineTooSmallError
 
-import os, subprocess
+import os, subprocess, asyncio, tempfile, shutil
 
 class TestShellCommand(unittest.TestCase):
 
@@ -21,3 +22,74 @@ class TestShellCommand(unittest.TestCase):
 
         if os.path.exists('file1'): os.unlink('file1')
         if os.path.exists('file2'): os.unlink('file2')
+
+    def test_run_async(self):
+        cmd=ShellCommand('echo $WORD',env={ 'WORD':'hello' })
+        loop=asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            result=loop.run_until_complete(cmd.run_async(
+                stdout=subprocess.PIPE,encoding='ascii'))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertEqual(result.stdout,'hello\n')
+        self.assertEqual(result.returncode,0)
+
+class TestCommandPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.nodes=GenericNodeSpec({ 'physical_cores_per_node':4,
+                                     'logical_cpus_per_core':2,
+                                     'memory_per_node':'1G' })
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_budget(self):
+        pool=CommandPool(self.nodes,self.tempdir)
+        self.assertEqual((pool.cpus,pool.memory),(4,1024))
+        with self.assertRaises(MachineTooSmallError):
+            pool.add('true',cpus=5)
+        with self.assertRaises(MachineTooSmallError):
+            pool.add('true',memory='2G')
+
+    def test_run(self):
+        pool=CommandPool(self.nodes,self.tempdir)
+        for i in range(6):
+            pool.add(f'echo out{i} ; echo err{i} 1>&2 ; exit {i%2}',
+                     name=f'job{i}',cpus=2,memory='300M')
+        results=pool.run()
+        self.assertEqual([ r.returncode for r in results ],[0,1,0,1,0,1])
+        for i,result in enumerate(results):
+            self.assertEqual(result.stdout,
+                             os.path.join(self.tempdir,f'job{i}.out'))
+            with open(result.stdout,'rt') as fd:
+                self.assertEqual(fd.read(),f'out{i}\n')
+            with open(result.stderr,'rt') as fd:
+                self.assertEqual(fd.read(),f'err{i}\n')
+        with self.assertRaises(subprocess.CalledProcessError):
+            pool.run(check=True)
+
+    def test_concurrency_limit(self):
+        # Each command records how many are running when it starts.
+        pool=CommandPool(self.nodes,self.tempdir,cpus=2)
+        counter=os.path.join(self.tempdir,'running')
+        script=f'echo x >> {counter} ; wc -l < {counter} ; sleep 0.2 ; ' \
+               f'sed -i 1d {counter}'
+        for i in range(4):
+            pool.add(script,name=f'job{i}')
+        for result in pool.run(check=True):
+            with open(result.stdout,'rt') as fd:
+                self.assertLessEqual(int(fd.read()),2)
+
+    def test_timeout(self):
+        pool=CommandPool(self.nodes,self.tempdir)
+        pool.add('sleep 30',name='slow')
+        pool.add('echo fast',name='fast')
+        results=pool.run(timeout=1)
+        self.assertEqual(pool.timed_out,[ 'slow' ])
+        self.assertEqual([ r.returncode for r in results ],[ -9, 0 ])
+        with open(results[1].stdout,'rt') as fd:
+            self.assertEqual(fd.read(),'fast\n')
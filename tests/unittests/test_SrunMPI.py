@@ -65,3 +65,74 @@ class TestAprunCrayMPI(unittest.TestCase):
 
         logging.info("assertions not set yet")
         self.assertTrue( 'True' == 'True' )
+
+class TestSrunMPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        settings={ 'physical_cores_per_node':24,
+                   'logical_cpus_per_core':2,
+                   'hyperthreading_allowed':True }
+        self.par=get_parallelism('SrunMPI',settings)
+        self.het=get_parallelism('SrunMPI',dict(settings,hetjob=True))
+
+    def test_SrunMPI_single_block(self):
+        jr=JobResourceSpec([ { 'mpi_ranks':30, 'OMP_NUM_THREADS':2,
+                               'exe':'doit' } ])
+        cmd=self.par.make_ShellCommand(jr)
+        self.assertEqual(cmd.command,[ 'srun', '-n', '30',
+            '--cpus-per-task=2', '/usr/bin/env', 'OMP_NUM_THREADS=2', 'doit' ])
+        self.assertFalse(cmd.files)
+
+    def test_SrunMPI_pure_openmp(self):
+        jr=JobResourceSpec([ { 'OMP_NUM_THREADS':6, 'exe':'doit',
+                               'args':[ '-v', 'a b' ] } ])
+        cmd=self.par.make_ShellCommand(jr)
+        self.assertEqual(cmd.command,[ '/usr/bin/env', 'OMP_NUM_THREADS=6',
+                                       'doit', '-v', 'a b' ])
+
+    def multi_block_spec(self):
+        return JobResourceSpec([
+            { 'mpi_ranks':2, 'OMP_NUM_THREADS':4, 'exe':'exe1',
+              'args':[ 'a b' ], 'SrunMPI_extra':'--kill-on-bad-exit' },
+            { 'mpi_ranks':6, 'exe':'exe2' },
+            { 'mpi_ranks':3, 'exe':'exe3' } ])
+
+    def test_SrunMPI_multi_prog(self):
+        cmd=self.par.make_ShellCommand(self.multi_block_spec())
+        self.assertEqual(cmd.command,[ 'srun', '--kill-on-bad-exit', '-n',
+            '11', '--multi-prog', 'crow_multi_prog.conf' ])
+        self.assertEqual(cmd.files['crow_multi_prog.conf']['content'],
+                         "0-1 /usr/bin/env OMP_NUM_THREADS=4 exe1 'a b'\n"
+                         "2-7 exe2\n"
+                         "8-10 exe3\n")
+
+    def test_SrunMPI_het_groups(self):
+        cmd=self.het.make_ShellCommand(self.multi_block_spec())
+        self.assertEqual(cmd.command,[ 'srun', '--kill-on-bad-exit',
+            '--het-group=0', '-n', '2', '--cpus-per-task=4', '/usr/bin/env',
+            'OMP_NUM_THREADS=4', 'exe1', 'a b', ':', '--het-group=1', '-n',
+            '9', '--multi-prog', 'crow_multi_prog.conf.1' ])
+        self.assertEqual(list(cmd.files),[ 'crow_multi_prog.conf.1' ])
+        self.assertEqual(cmd.files['crow_multi_prog.conf.1']['content'],
+                         "0-5 exe2\n6-8 exe3\n")
+
+    def test_SrunMPI_shared_threads(self):
+        jr=JobResourceSpec([
+            { 'mpi_ranks':2, 'OMP_NUM_THREADS':3, 'exe':'exe1' },
+            { 'mpi_ranks':4, 'OMP_NUM_THREADS':3, 'exe':'exe2' } ])
+        cmd=self.par.make_ShellCommand(jr)
+        self.assertEqual(cmd.command,[ 'srun', '-n', '6',
+            '--cpus-per-task=3', '--multi-prog', 'crow_multi_prog.conf' ])
+        self.assertEqual(cmd.files['crow_multi_prog.conf']['content'],
+                         "0-1 /usr/bin/env OMP_NUM_THREADS=3 exe1\n"
+                         "2-5 /usr/bin/env OMP_NUM_THREADS=3 exe2\n")
+
+    def test_SrunMPI_cpu_masks(self):
+        jr=JobResourceSpec([
+            { 'mpi_ranks':2, 'OMP_NUM_THREADS':2, 'exe':'exe1' },
+            { 'mpi_ranks':2, 'OMP_NUM_THREADS':2, 'hyperthreads':2,
+              'exe':'exe2' } ])
+        placement=self.par.nodes.pack_ranks(jr)
+        cmd=self.par.make_ShellCommand(jr,placement=placement)
+        self.assertEqual(cmd.command[1],
+                         '--cpu-bind=mask_cpu:0x3,0xc,0x10000010,0x20000020')
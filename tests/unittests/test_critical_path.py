@@ -0,0 +1,47 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest, json
+from context import crow
+import crow.config
+from datetime import timedelta, datetime
+from crow.metascheduler.critical_path import critical_path_for_suite
+
+class TestCriticalPath(unittest.TestCase):
+
+    def setUp(self):
+        self.conf=crow.config.from_file('../test_data/taskarray/taskarray.yaml')
+        self.suite=crow.config.Suite(self.conf.suite)
+        self.cycle=datetime(2018,1,1,18)
+        self.clock=crow.tools.Clock(start=self.cycle,end=self.cycle,
+                                    step=timedelta(hours=6))
+
+    def test_walltime_makespan(self):
+        analysis=critical_path_for_suite(self.suite,self.clock)
+        self.assertEqual(analysis.makespan,timedelta(minutes=6))
+        path=[ t.name for t in analysis.critical_path(self.cycle) ]
+        self.assertEqual(path[0],'simple_task')
+        self.assertEqual(len(path),3)
+        self.assertTrue(all(t.is_critical() for t in analysis.each_task()))
+
+    def test_runtimes_and_slack(self):
+        analysis=critical_path_for_suite(
+            self.suite,self.clock,runtimes={ 'simple_task':600,
+                                             'my_array.task_b':'00:01:00' })
+        self.assertEqual(analysis.makespan,timedelta(minutes=14))
+        timings={ t.name:t for t in analysis.each_task() }
+        self.assertEqual(timings['my_array.task_b'].slack,timedelta(minutes=1))
+        self.assertEqual(timings['my_array.tusk_02_c'].earliest_start,
+                         timedelta(minutes=12))
+        self.assertEqual(timings['simple_task'].duration_source,'runtimes')
+
+    def test_json(self):
+        analysis=critical_path_for_suite(self.suite,self.clock)
+        data=json.loads(analysis.to_json())
+        self.assertEqual(data['makespan'],360)
+        self.assertEqual(data['cycles'][0]['makespan'],360)
+        self.assertEqual(len(data['tasks']),13)
+        self.assertIn('critical path',analysis.report())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,334 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import os, time, unittest, tempfile, shutil, sqlite3, hashlib, threading, \
+       multiprocessing
+from datetime import datetime, timedelta
+from context import crow
+import crow.config
+from crow.dataflow import Dataflow, DataNotAvailable, AmbiguousMessage, \
+     NoSuchSlot, DataflowError, BlobStore, wait_for
+from crow.dataflow.wait import _Inotify, _OUTPUT_MASK
+
+CYCLE=datetime(2018,1,1,6)
+
+def deliver_many(args):
+    dbfile,worker,count=args
+    db=Dataflow(dbfile)
+    slot=db.get_slot('O','fcst','history')
+    local=os.path.join(os.path.dirname(dbfile),f'local{worker}')
+    with open(local,'wt') as fd:
+        fd.write(f'{worker}\n')
+    for i in range(count):
+        slot.at(CYCLE+timedelta(hours=6*(worker*count+i)),
+                { 'fhr':0 }).deliver(local)
+    return count
+
+class TestDataflow(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.dbfile=os.path.join(self.tempdir,'dataflow.db')
+        self.db=Dataflow(self.dbfile)
+        self.history=self.db.add_output_slot(
+            'fcst','history',
+            os.path.join(self.tempdir,'{cycle:%Y%m%d%H}/hist.f{fhr:03d}'),
+            { 'fhr':[ 0, 3, 6 ], 'grid':'gaussian' })
+        self.hist_in=self.db.add_input_slot('post','hist_in',
+                                            { 'fhr':[ 0, 3 ] })
+        self.hist_in.connect_to(self.history)
+        self.local=os.path.join(self.tempdir,'local')
+        with open(self.local,'wt') as fd:
+            fd.write('hello\n')
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_write_ahead_logging(self):
+        mode=self.db._execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode,'wal')
+        self.assertIs(Dataflow(self.dbfile)._con(),self.db._con())
+
+    def test_find(self):
+        self.assertEqual(list(self.db.find_output_slot(meta={ 'fhr':3 })),
+                         [ self.history ])
+        self.assertEqual(list(self.db.find_output_slot(
+            meta={ 'grid':'gaussian' })),[ self.history ])
+        self.assertFalse(list(self.db.find_output_slot(meta={ 'fhr':9 })))
+        self.assertEqual(list(self.db.find_input_slot('post')),
+                         [ self.hist_in ])
+        self.assertFalse(list(self.db.find_input_slot('fcst')))
+
+    def test_deliver_and_obtain(self):
+        message=self.hist_in.at(CYCLE,{ 'fhr':3 })
+        self.assertIsNone(message.availability_time())
+        with self.assertRaises(DataNotAvailable):
+            message.obtain(self.local+'.out')
+        self.history.at(CYCLE,{ 'fhr':3 }).deliver(self.local)
+        self.assertTrue(message.availability_time())
+        self.assertEqual(message.location(),
+                         os.path.join(self.tempdir,'2018010106/hist.f003'))
+        message.obtain(self.local+'.out')
+        with open(self.local+'.out','rt') as fd:
+            self.assertEqual(fd.read(),'hello\n')
+        self.assertIsNone(self.hist_in.at(CYCLE,{ 'fhr':0 })
+                          .availability_time())
+
+    def test_lists_need_one_value(self):
+        message=self.history.at(CYCLE)
+        with self.assertRaises(AmbiguousMessage):
+            message.deliver(self.local)
+        self.assertEqual([ m.get_meta()['fhr'] for m in message.expand() ],
+                         [ 0, 3, 6 ])
+        with self.assertRaises(NoSuchSlot):
+            self.history.at(CYCLE,{ 'fhr':9 })
+
+    def test_cycles(self):
+        self.db.add_cycle(CYCLE)
+        count='SELECT COUNT(*) FROM messages WHERE cycle=?'
+        key=int((CYCLE-datetime(1970,1,1)).total_seconds())
+        self.assertEqual(self.db._execute(count,(key,)).fetchone()[0],3)
+        self.db.del_cycle(CYCLE)
+        self.assertEqual(self.db._execute(count,(key,)).fetchone()[0],0)
+
+    def test_concurrent_delivery(self):
+        workers=6
+        count=10
+        with multiprocessing.Pool(workers) as pool:
+            done=pool.map(deliver_many,[ ( self.dbfile, worker, count )
+                                         for worker in range(workers) ])
+        self.assertEqual(sum(done),workers*count)
+        available='SELECT COUNT(*) FROM messages WHERE available IS NOT NULL'
+        self.assertEqual(self.db._execute(available).fetchone()[0],
+                         workers*count)
+
+    def local_files(self,fhrs):
+        deliveries=list()
+        for fhr in fhrs:
+            local=os.path.join(self.tempdir,f'local{fhr}')
+            with open(local,'wt') as fd:
+                fd.write(f'{fhr}\n')
+            deliveries.append(( self.history, { 'fhr':fhr }, local ))
+        return deliveries
+
+    def test_deliver_many(self):
+        messages=self.db.deliver_many(CYCLE,self.local_files([ 0, 3, 6 ]),
+                                      max_workers=3)
+        self.assertEqual(len(messages),3)
+        times=self.db.availability_times(
+            [ self.hist_in.at(CYCLE,{ 'fhr':fhr }) for fhr in [ 0, 3 ] ])
+        self.assertTrue(all(times))
+        self.assertEqual(len(set(times)),1) # one transaction
+        obtains=[ ( self.hist_in.at(CYCLE,{ 'fhr':fhr }),
+                    os.path.join(self.tempdir,f'obtained{fhr}') )
+                  for fhr in [ 0, 3 ] ]
+        self.db.obtain_many(obtains)
+        for message,local in obtains:
+            with open(local,'rt') as fd:
+                self.assertEqual(fd.read(),f'{message.get_meta()["fhr"]}\n')
+
+    def test_deliver_many_partial_failure(self):
+        deliveries=self.local_files([ 0, 3 ])
+        deliveries.append(( self.history, { 'fhr':6 },
+                            os.path.join(self.tempdir,'missing') ))
+        with self.assertRaises(DataflowError):
+            self.db.deliver_many(CYCLE,deliveries)
+        times=self.db.availability_times(
+            [ self.history.at(CYCLE,{ 'fhr':fhr }) for fhr in [ 0, 3, 6 ] ])
+        self.assertEqual([ bool(t) for t in times ],[ True, True, False ])
+        with self.assertRaises(DataNotAvailable):
+            self.db.obtain_many([ ( self.hist_in.at(CYCLE-timedelta(hours=6),
+                                                    { 'fhr':0 }),
+                                    self.local+'.out' ) ])
+
+    def deliver_later(self,fhrs,delay):
+        def deliver():
+            time.sleep(delay)
+            db=Dataflow(self.dbfile)
+            for fhr in fhrs:
+                db.get_slot('O','fcst','history').at(
+                    CYCLE,{ 'fhr':fhr }).deliver(self.local)
+            db.close()
+        thread=threading.Thread(target=deliver)
+        thread.start()
+        return thread
+
+    def test_wait_for_available(self):
+        self.history.at(CYCLE,{ 'fhr':0 }).deliver(self.local)
+        self.history.at(CYCLE,{ 'fhr':3 }).deliver(self.local)
+        times=wait_for([ self.hist_in ],timeout=0,cycle=CYCLE)
+        self.assertEqual(len(times),2)
+        with self.assertRaises(DataNotAvailable):
+            wait_for([ self.history ],timeout=0.2,cycle=CYCLE,
+                     min_interval=0.05)
+        with self.assertRaises(TypeError):
+            wait_for([ self.hist_in ])
+
+    def test_wait_for_polls(self):
+        thread=self.deliver_later([ 0, 3 ],0.2)
+        wait_for([ self.hist_in.at(CYCLE) ],timeout=10,min_interval=0.05,
+                 max_interval=0.1,use_inotify=False)
+        thread.join()
+
+    def test_wait_for_wakes_on_delivery(self):
+        try:
+            _Inotify().close()
+        except OSError:
+            self.skipTest('no inotify')
+        thread=self.deliver_later([ 0, 3 ],0.2)
+        start=time.monotonic()
+        wait_for([ self.hist_in.at(CYCLE) ],timeout=20,min_interval=10)
+        self.assertLess(time.monotonic()-start,5)
+        thread.join()
+
+    def test_inotify_output_events(self):
+        try:
+            inotify=_Inotify()
+        except OSError:
+            self.skipTest('no inotify')
+        outdir=os.path.join(self.tempdir,'out')
+        try:
+            # A missing directory's parent is watched for its creation.
+            inotify.watch(outdir,_OUTPUT_MASK)
+            self.assertIn(self.tempdir,inotify.watched)
+            os.makedirs(outdir)
+            self.assertTrue(inotify.wait(5))
+            inotify.watch(outdir,_OUTPUT_MASK)
+            # Partial writes do not wake the waiter; a finished file does.
+            with open(os.path.join(outdir,'file'),'wb') as fd:
+                fd.write(b'data')
+                fd.flush()
+                self.assertFalse(inotify.wait(0.1))
+            self.assertTrue(inotify.wait(5))
+        finally:
+            inotify.close()
+
+class TestDataflowBlobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.dbfile=os.path.join(self.tempdir,'dataflow.db')
+        self.db=Dataflow(self.dbfile)
+        self.blobdir=os.path.join(self.tempdir,'blobs')
+        self.db.use_blob_store(self.blobdir)
+        self.fix=self.db.add_output_slot(
+            'prep','fix',os.path.join(self.tempdir,'{cycle:%H}/fix.{n}'),
+            { 'n':[ 1, 2, 3 ] })
+        self.local=os.path.join(self.tempdir,'local')
+        with open(self.local,'wt') as fd:
+            fd.write('climatology\n')
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_setting_is_stored(self):
+        store=Dataflow(self.dbfile).blob_store
+        self.assertEqual(store.directory,self.blobdir)
+        self.assertEqual(store.link,'hardlink')
+
+    def test_identical_files_stored_once(self):
+        self.fix.at(CYCLE,{ 'n':1 }).deliver(self.local)
+        self.db.deliver_many(CYCLE,[ ( self.fix, { 'n':2 }, self.local ) ])
+        with self.fix.at(CYCLE,{ 'n':3 }).open('wt') as fd:
+            fd.write('climatology\n')
+        digests=list(self.db.blob_store.digests())
+        self.assertEqual(len(digests),1)
+        blob=os.stat(self.db.blob_store.path(digests[0]))
+        for n in [ 1, 2, 3 ]:
+            location=self.fix.at(CYCLE,{ 'n':n }).location()
+            self.assertEqual(os.stat(location).st_ino,blob.st_ino)
+            self.assertTrue(self.fix.at(CYCLE,{ 'n':n }).availability_time())
+        self.assertFalse(blob.st_mode&0o222)
+
+    def test_obtained_copy_is_writable(self):
+        self.fix.at(CYCLE,{ 'n':1 }).deliver(self.local)
+        fix_in=self.db.add_input_slot('fcst','fix_in',{ 'n':[ 1 ] })
+        fix_in.connect_to(self.fix)
+        obtained=os.path.join(self.tempdir,'obtained')
+        fix_in.at(CYCLE,{ 'n':1 }).obtain(obtained)
+        self.assertTrue(os.stat(obtained).st_mode&0o200)
+        self.db.obtain_many([ ( fix_in.at(CYCLE,{ 'n':1 }),
+                                obtained+'.many' ) ])
+        self.assertTrue(os.stat(obtained+'.many').st_mode&0o200)
+        with open(obtained,'at') as fd:
+            fd.write('changed\n')
+        blob=self.db.blob_store.path(
+            hashlib.sha256(b'climatology\n').hexdigest())
+        self.assertFalse(os.stat(blob).st_mode&0o222)
+
+    def test_symlink(self):
+        store=BlobStore(self.blobdir,'symlink')
+        digest=store.deliver(self.local,os.path.join(self.tempdir,'link'))
+        self.assertEqual(os.readlink(os.path.join(self.tempdir,'link')),
+                         store.path(digest))
+        with self.assertRaises(DataflowError):
+            BlobStore(self.blobdir,'copy')
+
+    def test_garbage_collection(self):
+        self.fix.at(CYCLE,{ 'n':1 }).deliver(self.local)
+        later=CYCLE+timedelta(hours=6)
+        other=os.path.join(self.tempdir,'other')
+        with open(other,'wt') as fd:
+            fd.write('other\n')
+        self.fix.at(later,{ 'n':1 }).deliver(other)
+        self.assertEqual(len(list(self.db.blob_store.digests())),2)
+        self.assertFalse(self.db.collect_garbage(min_age=0))
+        self.db.del_cycle(CYCLE)
+        self.assertFalse(self.db.collect_garbage()) # too new
+        self.assertEqual(len(self.db.collect_garbage(min_age=0,
+                                                     dry_run=True)),1)
+        removed=self.db.collect_garbage(min_age=0)
+        self.assertEqual(len(removed),1)
+        self.assertEqual(list(self.db.blob_store.digests()),
+                         [ hashlib.sha256(b'other\n').hexdigest() ])
+        # The hard link of the deleted cycle keeps its data.
+        with open(self.fix.at(CYCLE,{ 'n':1 }).location(),'rt') as fd:
+            self.assertEqual(fd.read(),'climatology\n')
+
+    def test_upgrade_schema(self):
+        dbfile=os.path.join(self.tempdir,'old.db')
+        con=sqlite3.connect(dbfile)
+        con.execute('CREATE TABLE crow_dataflow_info ( name TEXT PRIMARY '
+                    'KEY, value TEXT NOT NULL )')
+        con.execute("INSERT INTO crow_dataflow_info VALUES "
+                    "( 'schema_version', '1' )")
+        con.execute('CREATE TABLE messages ( cycle INTEGER NOT NULL, '
+                    'actor TEXT NOT NULL, slot TEXT NOT NULL, flow TEXT NOT '
+                    'NULL, meta TEXT NOT NULL, output INTEGER NOT NULL, '
+                    'location TEXT NOT NULL, available REAL, PRIMARY KEY '
+                    '( cycle, actor, slot, flow, meta ) )')
+        con.commit()
+        con.close()
+        db=Dataflow(dbfile)
+        self.assertEqual(db._get_info('schema_version'),'2')
+        self.assertIsNone(db.blob_store)
+        self.assertFalse(db._execute('SELECT blob FROM messages').fetchall())
+        db.close()
+
+class TestDataflowFromSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        conf=crow.config.from_file('../test_data/dataflow/dataflow.yaml')
+        self.suite=crow.config.Suite(conf.suite)
+        self.db=Dataflow(os.path.join(self.tempdir,'dataflow.db'))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_add_suite(self):
+        self.assertEqual(self.db.add_suite(self.suite),4)
+        history=self.db.get_slot('O','fcst','history')
+        self.assertEqual(history.get_meta(),{ 'fhr':[ 0, 3, 6 ] })
+        output,rel_time=self.db.get_slot('I','post','prior_restart') \
+                               .get_output_slot()
+        self.assertEqual(str(output),'O:fcst.restart')
+        self.assertEqual(rel_time,timedelta(hours=-6))
+        message=self.db.get_slot('I','post','prior_restart').at(CYCLE)
+        self.assertEqual(message.location(),'com/2018010100/restart')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest, os, stat, tempfile
+from unittest import mock
+from context import crow
+from crow.tools import deliver_file, DELIVERY_METHODS
+
+class TestDeliverFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir=tempfile.TemporaryDirectory()
+        self.dir=self.tmpdir.name
+        self.source=os.path.join(self.dir,'source')
+        self.data=os.urandom(3*1048576+17)
+        with open(self.source,'wb') as fd:
+            fd.write(self.data)
+        os.chmod(self.source,0o664)
+        os.utime(self.source,(1000000000,1000000000))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def check_copy(self,target):
+        with open(target,'rb') as fd:
+            self.assertEqual(fd.read(),self.data)
+        st=os.stat(target)
+        self.assertEqual(stat.S_IMODE(st.st_mode),0o664&~2)
+        self.assertEqual(int(st.st_mtime),1000000000)
+        self.assertNotEqual(st.st_ino,os.stat(self.source).st_ino)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(target))),
+                         [ os.path.basename(target) ])
+
+    def test_each_method(self):
+        for name in DELIVERY_METHODS:
+            target=os.path.join(self.dir,name,'target')
+            used=deliver_file(self.source,target,methods=[ name, 'copy' ])
+            self.assertIn(used,[ name, 'copy' ])
+            self.check_copy(target)
+
+    def test_default_chain(self):
+        target=os.path.join(self.dir,'chain','target')
+        self.assertIn(deliver_file(self.source,target),DELIVERY_METHODS)
+        self.check_copy(target)
+
+    def test_short_kernel_copy(self):
+        # A copy_file_range that stops early must not leave a partial
+        # file; the next method starts over.
+        def short_copy(i,o,n):
+            if short_copy.called: return 0
+            short_copy.called=True
+            return os.write(o,os.read(i,min(n,1048576)))
+        short_copy.called=False
+        target=os.path.join(self.dir,'short','target')
+        with mock.patch('os.copy_file_range',short_copy,create=True):
+            used=deliver_file(self.source,target,
+                              methods=[ 'copy_file_range', 'copy' ])
+        self.assertEqual(used,'copy')
+        self.check_copy(target)
+
+    def test_hardlink(self):
+        target=os.path.join(self.dir,'target')
+        self.assertEqual(deliver_file(self.source,target,hardlink=True),
+                         'hardlink')
+        self.assertEqual(os.stat(target).st_ino,os.stat(self.source).st_ino)
+        # Replacing an existing file is atomic too.
+        self.assertEqual(deliver_file(self.source,target,hardlink=True),
+                         'hardlink')
+        self.assertEqual(sorted(os.listdir(self.dir)),[ 'source', 'target' ])
+
+    def test_missing_source(self):
+        target=os.path.join(self.dir,'out','target')
+        with self.assertRaises(FileNotFoundError):
+            deliver_file(self.source+'.missing',target)
+        self.assertEqual(os.listdir(os.path.join(self.dir,'out')),[])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 #! /usr/bin/env python3
 import unittest
 from context import crow
-import os
+import os, shutil, tempfile
 import crow.config
 from datetime import timedelta, date, datetime
 from collections import OrderedDict
@@ -14,8 +14,10 @@ class TestEcFlowTaskarray(unittest.TestCase):
         self.suite=crow.config.Suite(self.conf.suite)
         self.ecflow_suite = to_ecflow(self.suite)
         safe,self.name,self.ecf_files,self.suite_defs = self.ecflow_suite.each_suite()
+        self.tempdir=tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.tempdir)
         for defname in self.suite_defs:
-            filename=defname
+            filename=os.path.join(self.tempdir,defname)
             print(filename)
             dirname=os.path.dirname(filename)
             if dirname and not os.path.exists(dirname):
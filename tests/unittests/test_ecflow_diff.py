@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest, os, io, tempfile
+from context import crow
+from crow.metascheduler.ecflow_diff import parse_suite_def, diff_suite_defs, \
+    plan_suite_updates, EcflowClient, DryRunEcflowClient
+
+OLD='''extern /prod00/family2/task21
+suite prod06
+  edit QUEUE 'debug'
+  task task0
+  family family1 # /prod06/family1
+    trigger /prod00/family2/task21 == complete
+    task task11
+      event 1 some_event
+    task task12
+      trigger ./task11:some_event
+  endfamily # /prod06/family1
+  family family2 # /prod06/family2
+    task task21
+    task task22
+  endfamily # /prod06/family2
+endsuite # /prod06
+'''
+
+NEW='''extern /prod00/family2/task21
+suite prod06
+  edit QUEUE 'debug'
+  task task0
+  family family1 # /prod06/family1
+    trigger /prod00/family2/task21 == complete
+    task task11
+      event 1 some_event
+    task task12
+      trigger ./task11:some_event and ./task11 == complete
+  endfamily # /prod06/family1
+  family family2 # /prod06/family2
+    task task21
+    task task23
+  endfamily # /prod06/family2
+endsuite # /prod06
+suite prod12
+  task task0
+endsuite # /prod12
+'''
+
+class FakeEcflowClient(EcflowClient):
+    """Keeps the server's suites as DefNode trees."""
+    def __init__(self,text):
+        self.suites=parse_suite_def(text)
+    def run(self,args):
+        raise AssertionError(f'unexpected command {args}')
+    def load(self,filename):
+        with open(filename,'rt') as fd:
+            self.suites.update(parse_suite_def(fd.read()))
+    def replace(self,path,filename):
+        with open(filename,'rt') as fd:
+            suites=parse_suite_def(fd.read())
+        suite=path.strip('/').split('/')[0]
+        node=suites[suite].find(path)
+        if node.parent is None:
+            self.suites[suite]=node
+            return
+        parent=self.suites[suite].find(node.parent.path)
+        node.parent=parent
+        parent.children[node.name]=node
+    def delete(self,path):
+        suite=path.strip('/').split('/')[0]
+        node=self.suites[suite].find(path)
+        del node.parent.children[node.name]
+
+class TestEcflowDiff(unittest.TestCase):
+
+    def test_parse(self):
+        suites=parse_suite_def(OLD)
+        self.assertEqual(list(suites),['prod06'])
+        task12=suites['prod06'].find('/prod06/family1/task12')
+        self.assertEqual(task12.kind,'task')
+        self.assertEqual(task12.attributes,['trigger ./task11:some_event'])
+        self.assertEqual(suites['prod06'].attributes,["edit QUEUE 'debug'"])
+        self.assertEqual(len(list(suites['prod06'].walk())),8)
+
+    def test_plan(self):
+        plan=diff_suite_defs(OLD,NEW,'prod06.def')
+        self.assertEqual(plan.load,[('prod12','prod06.def')])
+        self.assertEqual(plan.delete,['/prod06/family2/task22'])
+        self.assertEqual([ path for path,filename in plan.replace ],
+                         ['/prod06/family1/task12','/prod06/family2/task23'])
+        self.assertFalse(diff_suite_defs(NEW,NEW,'prod06.def'))
+
+    def test_reordered_children(self):
+        new=OLD.replace('    task task21\n    task task22\n',
+                        '    task task22\n    task task21\n')
+        plan=diff_suite_defs(OLD,new,'prod06.def')
+        self.assertEqual(plan.replace,[('/prod06/family2','prod06.def')])
+
+    def test_fake_client(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename=os.path.join(tmpdir,'prod06.def')
+            with open(filename,'wt') as fd: fd.write(NEW)
+            plan=plan_suite_updates({'prod06':filename},{'prod06':OLD})
+            client=FakeEcflowClient(OLD)
+            plan.execute(client)
+            expected=parse_suite_def(NEW)
+            self.assertEqual(list(client.suites),list(expected))
+            for name,suite in expected.items():
+                self.assertTrue(client.suites[name].same_as(suite))
+            self.assertEqual(list(plan.suites_to_load()),['prod12'])
+
+    def test_dry_run(self):
+        plan=diff_suite_defs(OLD,NEW,'prod06.def')
+        fd=io.StringIO()
+        commands=plan.dry_run(fd)
+        self.assertEqual(len(commands),4)
+        self.assertEqual(fd.getvalue().splitlines()[0],
+                         'ecflow_client --delete=force yes /prod06/family2/task22')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest, os, tempfile
+from context import crow
+import crow.config
+from datetime import timedelta, datetime
+from crow.tools import Clock
+from crow.metascheduler import to_ecflow
+from crow.metascheduler.ecflow_state import EcflowGraphState, fingerprint_text
+
+class TestEcflowState(unittest.TestCase):
+
+    def setUp(self):
+        conf=crow.config.from_file('../test_data/taskarray/taskarray.yaml')
+        self.suite=crow.config.Suite(conf.suite)
+        self.ecflow_suite=to_ecflow(self.suite)
+        self.fingerprint=fingerprint_text('taskarray')
+
+    def test_record_and_reload(self):
+        state=EcflowGraphState(self.fingerprint,boundary_cycles=2)
+        self.assertEqual(state.check_references(self.ecflow_suite),[])
+        state.record(self.ecflow_suite)
+        self.assertEqual(len(state),5)
+        self.assertEqual(len(state.cycle_states),2)
+        node=state.cycle_states[datetime(2018,1,2,18)]['my_array.task_b']
+        self.assertEqual(node['state'],'runs')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename=os.path.join(tmpdir,'state.json')
+            state.save(filename)
+            same=EcflowGraphState.load(filename,self.fingerprint)
+            changed=EcflowGraphState.load(filename,fingerprint_text('other'))
+        self.assertEqual(same.generated,state.generated)
+        self.assertEqual(same.cycle_states,state.cycle_states)
+        self.assertEqual(len(changed),0)
+
+        clock=Clock(start=datetime(2018,1,2,12),end=datetime(2018,1,3,6),
+                    step=timedelta(hours=6))
+        self.assertEqual(list(same.new_cycles(clock)),
+                         [ datetime(2018,1,3,0), datetime(2018,1,3,6) ])
+
+    def test_new_cycle_ranges(self):
+        state=EcflowGraphState(self.fingerprint)
+        state.generated={ datetime(2018,1,1,6), datetime(2018,1,1,18) }
+        clock=Clock(start=datetime(2018,1,1,0),end=datetime(2018,1,2,0),
+                    step=timedelta(hours=6))
+        self.assertEqual(list(state.new_cycle_ranges(clock)),[
+            ( datetime(2018,1,1,0), datetime(2018,1,1,0) ),
+            ( datetime(2018,1,1,12), datetime(2018,1,1,12) ),
+            ( datetime(2018,1,2,0), datetime(2018,1,2,0) ) ])
+
+    def test_reference_to_missing_node(self):
+        state=EcflowGraphState(self.fingerprint)
+        state.record(self.ecflow_suite)
+        cycle=datetime(2018,1,2,18)
+        state.cycle_states[cycle]['simple_task']={ 'state':'never_run' }
+        class NewCycle(object):
+            def each_cycle_state(self):
+                yield cycle+timedelta(hours=6), { 'simple_task': {
+                    'state':'runs', 'refs':[ [ -6*3600, 'simple_task' ] ] } }
+        problems=state.check_references(NewCycle())
+        self.assertEqual(len(problems),1)
+        self.assertIn('never run',problems[0])
+
+if __name__ == '__main__':
+    unittest.main()
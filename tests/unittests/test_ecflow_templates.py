@@ -0,0 +1,48 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest
+from context import crow
+import crow.config
+from datetime import timedelta, datetime
+from crow.tools import ZERO_DT
+from crow.metascheduler.ecflow import ToEcflow, DatePlaceholders, \
+    SuiteDefTemplate
+
+class TestEcflowTemplates(unittest.TestCase):
+
+    def test_instantiate(self):
+        dater=DatePlaceholders()
+        text=f'extern /{dater(timedelta(hours=-6),"prod%H")}/a\n' \
+             f'suite {dater(ZERO_DT,"prod%H")}\n' \
+             f'  time {dater(timedelta(hours=3),"%H:%M")}\n'
+        template=SuiteDefTemplate(text,dater)
+        self.assertEqual(template.instantiate(datetime(2018,1,1,6),'prod%H'),
+                         'extern /prod00/a\nsuite prod06\n  time 09:00\n')
+
+    def test_identical_suite_names(self):
+        dater=DatePlaceholders()
+        text=f'extern /{dater(timedelta(hours=-24),"prod%H")}/a\n' \
+             f'suite {dater(ZERO_DT,"prod%H")}\n'
+        template=SuiteDefTemplate(text,dater)
+        self.assertIsNone(template.instantiate(datetime(2018,1,2,6),'prod%H'))
+
+    def test_matches_direct_rendering(self):
+        conf=crow.config.from_file('../test_data/taskarray/taskarray.yaml')
+        suite=crow.config.Suite(conf.suite)
+        to_ecflow=ToEcflow(suite)
+        to_ecflow._initialize_graph()
+        suite_name_format=suite.ecFlow.suite_name
+        count=0
+        for cycle in to_ecflow._foreach_cycle(to_ecflow._cycles_to_write()):
+            suite_name,suite_def=to_ecflow._make_suite_def(cycle)
+            direct=to_ecflow._render_suite_def(
+                to_ecflow._suite_def_records(cycle),suite_name_format,
+                lambda dt,format: (cycle+dt).strftime(format))
+            self.assertEqual(suite_def,direct)
+            self.assertEqual(suite_name,cycle.strftime('prod%H'))
+            count+=1
+        self.assertEqual(count,5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest, os, tempfile
+from context import crow
+import crow.config
+from datetime import timedelta, datetime
+from crow.metascheduler.graph import make_simplified_graph
+from crow.metascheduler.graph_export import flatten_graph, load_npz, \
+    FlatGraph, NODE_RUNS, EDGE_COMPLETED
+
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+class TestGraphExport(unittest.TestCase):
+
+    def setUp(self):
+        conf=crow.config.from_file('../test_data/taskarray/taskarray.yaml')
+        suite=crow.config.Suite(conf.suite)
+        start=datetime(2018,1,1,18)
+        clock=crow.tools.Clock(start=start,end=start+timedelta(hours=6),
+                               step=timedelta(hours=6))
+        self.flat=flatten_graph(make_simplified_graph(suite,clock))
+
+    def test_nodes(self):
+        # simple_task, my_array, and twelve array elements per cycle
+        self.assertEqual(len(self.flat),28)
+        self.assertEqual(self.flat.cycle_index.count(1),14)
+        self.assertEqual(self.flat.path[0],'simple_task')
+        self.assertTrue(all(s==NODE_RUNS for s in self.flat.state))
+
+    def test_csr(self):
+        array=list(self.flat.node_ids('my_array'))[1]
+        self.assertEqual(len(self.flat.children(array)),12)
+        for child in self.flat.children(array):
+            self.assertEqual(self.flat.parent[child],array)
+        task_a=list(self.flat.node_ids('my_array.task_a'))[1]
+        simple=list(self.flat.node_ids('simple_task'))[1]
+        self.assertIn((simple,EDGE_COMPLETED),
+                      self.flat.trigger_edges(array))
+        tusk=list(self.flat.node_ids('my_array.tusk_02_b'))[1]
+        self.assertIn((task_a,EDGE_COMPLETED),self.flat.trigger_edges(tusk))
+        self.assertEqual(self.flat.complete_edges(tusk),[])
+
+    def test_round_trip(self):
+        lists=self.flat.as_lists()
+        # 2018-01-01 18:00 UTC, whatever the local time zone is
+        self.assertEqual(lists['cycles'],[ 1514829600, 1514851200 ])
+        copy=FlatGraph.from_arrays(lists)
+        for name in lists:
+            self.assertEqual(getattr(copy,name),getattr(self.flat,name),name)
+        self.assertEqual(copy.trigger_edges(1),self.flat.trigger_edges(1))
+
+    @unittest.skipIf(numpy is None,'numpy is not installed')
+    def test_npz(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename=os.path.join(tmpdir,'graph.npz')
+            self.flat.save_npz(filename)
+            arrays=load_npz(filename)
+        self.assertEqual(len(arrays['path']),28)
+        self.assertEqual(list(arrays['trigger_indptr']),
+                         self.flat.trigger_indptr)
+        self.assertEqual(FlatGraph.from_arrays(arrays).cycles,
+                         self.flat.cycles)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest
+from context import crow
+import crow.config
+from crow.sysenv import get_scheduler
+from crow.sysenv.schedulers.base import array_index_ranges
+from crow.metascheduler.job_arrays import find_array_groups
+
+class TestJobArrays(unittest.TestCase):
+
+    def setUp(self):
+        conf=crow.config.from_file('../test_data/taskarray/taskarray.yaml')
+        self.settings=conf.scheduler_settings
+        self.suite=crow.config.Suite(conf.suite)
+
+    def test_index_ranges(self):
+        self.assertEqual(array_index_ranges(3),'1-3')
+        self.assertEqual(array_index_ranges([7,1,2,3,5,8,9]),'1-3,5,7-9')
+
+    def test_groups(self):
+        groups=find_array_groups(self.suite)
+        self.assertEqual([ len(group) for group in groups ],[ 3, 9 ])
+        self.assertEqual(groups[1].indices(),list(range(1,10)))
+        self.assertEqual(groups[1].tasks[4].task_path_var,
+                         'my_array.tusk_02_b')
+
+    def test_batch_cards(self):
+        group=find_array_groups(self.suite)[0]
+        card=group.batch_card(get_scheduler('Slurm',self.settings),
+                              jobname='letters',max_running=2)
+        self.assertTrue(card.endswith('#SBATCH --array=1-3%2\n'))
+        self.assertEqual(card.count('#SBATCH -J'),1)
+        self.assertIn('#SBATCH -J letters\n',card)
+        card=group.batch_card(get_scheduler('Slurm_Xsede',self.settings),
+                              jobname='letters')
+        self.assertTrue(card.endswith('#SBATCH --array=1-3\n'))
+        self.assertEqual(card.count('#SBATCH -J'),1)
+        card=group.batch_card(get_scheduler('LSF',self.settings))
+        self.assertTrue(card.endswith("#BSUB -J 'crow_array[1-3]'\n"))
+        card=group.batch_card(get_scheduler('LSFAlps',self.settings))
+        self.assertTrue(card.endswith("\n#BSUB -J 'crow_array[1-3]'\n"))
+        card=group.batch_card(get_scheduler('MoabTorque',self.settings))
+        self.assertTrue(card.endswith('#PBS -t 1-3\n'))
+
+    def test_dimension_script(self):
+        group=find_array_groups(self.suite)[0]
+        script=group.dimension_script(get_scheduler('Slurm',self.settings))
+        self.assertIn('  2) export CROW_ARRAY_TASK=my_array.task_b '
+                      'CROW_DIMVAL_letter=b CROW_DIMIDX_letter=1 ;;\n',script)
+        self.assertTrue(script.startswith('case "${SLURM_ARRAY_TASK_ID}" in'))
+
+if __name__ == '__main__':
+    unittest.main()
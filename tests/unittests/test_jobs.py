@@ -4,6 +4,7 @@ f'This script requires python 3.6 or later'
 import unittest
 from context import crow
 from crow.sysenv import jobs
+from crow.sysenv.schedulers import get_scheduler
 class TestBoth(unittest.TestCase):
 
     def setUp(self):
@@ -100,5 +101,108 @@ class TestOpenMP(unittest.TestCase):
     def test_individual_spec_is_not_mpi(self):
         self.assertFalse(self.spec1[0].is_mpi())
 
+class TestHashable(unittest.TestCase):
+
+    def setUp(self):
+        self.input=[ {'mpi_ranks':5, 'OMP_NUM_THREADS':12,
+                      'exe':'a.x', 'args':['-v']},
+                     {'mpi_ranks':7} ]
+        self.spec1=jobs.JobResourceSpec(self.input)
+
+    def test_equal_specs_hash_equal(self):
+        spec2=jobs.JobResourceSpec(self.input)
+        self.assertEqual(self.spec1,spec2)
+        self.assertEqual(hash(self.spec1),hash(spec2))
+        self.assertEqual(len({self.spec1,spec2}),1)
+
+    def test_different_specs_differ(self):
+        spec2=jobs.JobResourceSpec([ {'mpi_ranks':5, 'OMP_NUM_THREADS':12,
+                                      'exe':'a.x', 'args':['-w']},
+                                     {'mpi_ranks':7} ])
+        self.assertNotEqual(self.spec1,spec2)
+
+    def test_not_equal_to_dict(self):
+        rank=self.spec1[1]
+        self.assertNotEqual(rank,dict(rank))
+        self.assertNotIn(rank,[ dict(rank) ])
+        self.assertEqual(rank.__eq__(dict(rank)),NotImplemented)
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            self.spec1[0].mpi_ranks=3
+        with self.assertRaises(TypeError):
+            self.spec1[0]['mpi_ranks']=3
+        with self.assertRaises(AttributeError):
+            self.spec1[0]['args'].append('-x')
+
+    def test_simplify_makes_new_spec(self):
+        def merge(ranks):
+            ranks[0]=ranks[0].new_with(mpi_ranks=12)
+            del ranks[1]
+        merged=self.spec1.simplify(merge,lambda rank: None)
+        self.assertEqual(merged.total_ranks(),12)
+        self.assertEqual(self.spec1.total_ranks(),12)
+        self.assertEqual(len(self.spec1),2)
+
+class TestSchedulerMemo(unittest.TestCase):
+
+    def test_identical_specs_render_once(self):
+        sched=get_scheduler('Slurm',{ 'physical_cores_per_node':24,
+                                      'logical_cpus_per_core':2,
+                                      'hyperthreading_allowed':True })
+        input1=[ {'mpi_ranks':5, 'OMP_NUM_THREADS':12},
+                 {'mpi_ranks':7, 'OMP_NUM_THREADS':12},
+                 {'mpi_ranks':7} ]
+        expected='<nodes>6:ppn=2+1:ppn=7</nodes>\n'
+        for i in range(3):
+            self.assertEqual(sched.rocoto_resources(input1),expected)
+        self.assertEqual(sched.rocoto_resources(
+            jobs.JobResourceSpec(input1)),expected)
+        self.assertEqual(sched.rocoto_resources(input1,indent=1),
+                         '  '+expected)
+        self.assertEqual(sched.render_counts(),(2,5))
+
+class TestSlurmHetjob(unittest.TestCase):
+
+    settings={ 'physical_cores_per_node':24,
+               'logical_cpus_per_core':2,
+               'hyperthreading_allowed':True }
+    input1=[ {'mpi_ranks':5, 'OMP_NUM_THREADS':12, 'walltime':'00:30:00',
+              'memory':'3G'},
+             {'mpi_ranks':7, 'OMP_NUM_THREADS':12},
+             {'mpi_ranks':7} ]
+
+    def test_one_component_per_block(self):
+        sched=get_scheduler('Slurm',dict(self.settings,hetjob=True))
+        self.assertEqual(sched.batch_resources(self.input1),
+                         '#SBATCH -t 00:30:00\n'
+                         '#SBATCH --mem=3072M\n'
+                         '#SBATCH -N 6 -n 12 --cpus-per-task=12\n'
+                         '#SBATCH hetjob\n'
+                         '#SBATCH -N 1 -n 7\n')
+
+    def test_component_memory(self):
+        sched=get_scheduler('Slurm',dict(self.settings,hetjob=True))
+        spec=[ {'mpi_ranks':4, 'OMP_NUM_THREADS':12,
+                'memory_per_rank':'2G'},
+               {'mpi_ranks':6, 'memory_per_rank':'1G'} ]
+        self.assertEqual(sched.batch_resources(spec),
+                         '#SBATCH --mem=4096M\n'
+                         '#SBATCH -N 2 -n 4 --cpus-per-task=12\n'
+                         '#SBATCH hetjob\n'
+                         '#SBATCH --mem=6144M\n'
+                         '#SBATCH -N 1 -n 6\n')
+
+    def test_hetjob_disabled(self):
+        sched=get_scheduler('Slurm',dict(self.settings,hetjob=False))
+        self.assertEqual(sched.batch_resources(self.input1),
+                         '#SBATCH -t 00:30:00\n'
+                         '#SBATCH --mem=3072M\n'
+                         '#SBATCH -N 6 -n 2+1 -n 7\n')
+
+    def test_hetjob_off_by_default(self):
+        sched=get_scheduler('Slurm',self.settings)
+        self.assertNotIn('hetjob',sched.batch_resources(self.input1))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest
+from context import crow
+from crow.sysenv import JobResourceSpec, GenericNodeSpec, get_scheduler, \
+    get_parallelism
+from crow.sysenv.exceptions import SysEnvConfigError
+
+SETTINGS={ 'mpi_runner':'mpiexec',
+           'physical_cores_per_node':24,
+           'logical_cpus_per_core':2,
+           'hyperthreading_allowed':True }
+
+class TestNodePacking(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes=GenericNodeSpec(SETTINGS)
+
+    def test_adjacent_blocks_share_nodes(self):
+        spec=JobResourceSpec([ { 'mpi_ranks':6, 'OMP_NUM_THREADS':2 },
+                               { 'mpi_ranks':12 } ])
+        self.assertEqual(self.nodes.to_nodes_ppn(spec),[ (1,6), (1,12) ])
+        placement=self.nodes.pack_ranks(spec)
+        self.assertEqual(placement.node_count(),1)
+        self.assertEqual(placement.nodes_ppn(),[ (1,18) ])
+        self.assertEqual(placement.nodes,( (1,((0,6),(1,12))), ))
+
+    def test_separate_node(self):
+        spec=JobResourceSpec([ { 'mpi_ranks':6, 'OMP_NUM_THREADS':2 },
+                               { 'mpi_ranks':2, 'separate_node':True },
+                               { 'mpi_ranks':12 } ])
+        placement=self.nodes.pack_ranks(spec,reorder=True)
+        self.assertEqual(placement.node_count(),2)
+        self.assertEqual(placement.nodes_ppn(),[ (1,18), (1,2) ])
+
+    def test_max_ppn(self):
+        spec=JobResourceSpec([ { 'mpi_ranks':30 },
+                               { 'mpi_ranks':7, 'max_ppn':2 } ])
+        placement=self.nodes.pack_ranks(spec)
+        self.assertEqual(placement.nodes,(
+            (1,((0,24),)), (1,((0,6),(1,2))), (2,((1,2),)), (1,((1,1),)) ))
+
+    def test_reorder(self):
+        spec=JobResourceSpec([ { 'mpi_ranks':16, 'exe':'a' },
+                               { 'mpi_ranks':1, 'OMP_NUM_THREADS':24,
+                                 'exe':'b' },
+                               { 'mpi_ranks':8, 'exe':'c' } ])
+        self.assertEqual(self.nodes.pack_ranks(spec).node_count(),3)
+        placement=self.nodes.pack_ranks(spec,reorder=True)
+        self.assertEqual(placement.node_count(),2)
+        self.assertEqual([ rank.exe for rank in placement.spec ],
+                         [ 'a', 'c', 'b' ])
+
+        sched=get_scheduler('MoabTorque',SETTINGS)
+        self.assertEqual(sched.rocoto_resources(spec,placement=placement),
+                         '<nodes>1:ppn=24+1:ppn=1</nodes>\n')
+        par=get_parallelism('HydraIMPI',SETTINGS)
+        cmd=par.make_ShellCommand(spec,placement=placement)
+        self.assertEqual(cmd.command,[ 'mpiexec', '-np', '16', 'a', ':',
+            '-np', '8', 'c', ':', '-np', '1', '/usr/bin/env',
+            'OMP_NUM_THREADS=24', 'b' ])
+        par=get_parallelism('AprunCrayMPI',dict(SETTINGS,aprun='aprun'))
+        cmd=par.make_ShellCommand(spec,placement=placement)
+        self.assertEqual([ arg for arg in cmd.command if arg in 'abc' ],
+                         [ 'a', 'c', 'b' ])
+
+    def test_packing_setting(self):
+        nodes=GenericNodeSpec(dict(SETTINGS,node_packing='ordered'))
+        spec=JobResourceSpec([ { 'mpi_ranks':6, 'OMP_NUM_THREADS':2 },
+                               { 'mpi_ranks':12 } ])
+        self.assertEqual(nodes.to_nodes_ppn(spec),[ (1,18) ])
+        self.assertEqual(GenericNodeSpec(dict(SETTINGS,node_packing=True))
+                         .node_packing,'ordered')
+        with self.assertRaises(SysEnvConfigError):
+            GenericNodeSpec(dict(SETTINGS,node_packing='best'))
+
+class TestMemoryPacking(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes=GenericNodeSpec({ 'physical_cores_per_node':24,
+                                     'memory_per_node':'64G' })
+
+    def test_heavy_ranks_not_merged_with_light(self):
+        spec=JobResourceSpec([ { 'mpi_ranks':24, 'memory_per_rank':'8G' },
+                               { 'mpi_ranks':24, 'memory_per_rank':1000 } ])
+        self.assertFalse(self.nodes.same_except_exe(spec[0],spec[1]))
+        self.assertEqual(self.nodes.to_nodes_ppn(
+            spec,can_merge_ranks=self.nodes.same_except_exe),
+            [ (3,8), (1,24) ])
+
+    def test_mixed_memory_node(self):
+        spec=JobResourceSpec([ { 'mpi_ranks':8, 'memory_per_rank':'6G' },
+                               { 'mpi_ranks':20, 'memory_per_rank':'1G' } ])
+        placement=self.nodes.pack_ranks(spec)
+        self.assertEqual(placement.nodes,(
+            (1,((0,8),(1,16))), (1,((1,4),)) ))
+        memory=self.nodes.memory_map(placement)
+        self.assertEqual([ m['used'] for m in memory ],[ 65536, 4096 ])
+        self.assertEqual([ m['free'] for m in memory ],[ 0, 61440 ])
+
+    def test_memory_map_in_batch_card(self):
+        spec=JobResourceSpec([ { 'mpi_ranks':8, 'memory_per_rank':'6G' },
+                               { 'mpi_ranks':20, 'memory_per_rank':'1G' } ])
+        sched=get_scheduler('MoabTorque',{ 'physical_cores_per_node':24,
+                                           'memory_per_node':'64G',
+                                           'node_packing':'ordered' })
+        card=sched.batch_resources(spec)
+        self.assertIn('# 1 node(s): 8 of block 0 (49152M), 16 of block 1 '
+                      '(16384M); 65536M used, 0M free\n',card)
+        self.assertIn('# 1 node(s): 4 of block 1 (4096M); 4096M used, '
+                      '61440M free\n',card)
+        unpacked=get_scheduler('MoabTorque',{ 'physical_cores_per_node':24,
+                                              'memory_per_node':'64G' })
+        self.assertNotIn('node(s)',unpacked.batch_resources(spec))
+
+if __name__ == '__main__':
+    unittest.main()
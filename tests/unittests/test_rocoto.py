@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest, io, re, os, tempfile, threading
+import xml.etree.ElementTree as ET
+from context import crow
+import crow.config
+from crow.metascheduler import to_rocoto, write_rocoto
+from crow.config.eval_tools import expand
+from crow.metascheduler.rocoto_cache import EvaluationTracker
+
+# Matches a metatask made by to_rocoto from TaskArray tasks.
+ARRAY_METATASK=re.compile(r'( *)<metatask name="[^"]*crow_array_\d+">\n'
+                          r'((?: *<var name="\w+">[^<]*</var>\n)+)'
+                          r'(.*?)\n\1</metatask>\n',re.DOTALL)
+VAR=re.compile(r'<var name="(\w+)">([^<]*)</var>')
+
+def expand_array_metatasks(xml,space='  '):
+    """Expands TaskArray metatasks as Rocoto would"""
+    def expand(match):
+        variables=[ (name,values.split())
+                    for name,values in VAR.findall(match.group(2)) ]
+        tasks=list()
+        for i in range(len(variables[0][1])):
+            text=match.group(3)+'\n'
+            for name,values in variables:
+                text=text.replace(f'#{name}#',values[i])
+            tasks.append(re.sub(f'(?m)^{space}','',text))
+        return ''.join(tasks)
+    return ARRAY_METATASK.sub(expand,xml)
+
+def canonical_xml(xml):
+    """Parses XML, expanding entities, into nested tuples with
+    insignificant whitespace removed"""
+    def canon(e):
+        return ( e.tag, sorted(e.attrib.items()), (e.text or '').strip(),
+                 (e.tail or '').strip(), [ canon(c) for c in e ] )
+    return canon(ET.fromstring(xml))
+
+class TestRocoto(unittest.TestCase):
+
+    def setUp(self):
+        conf=crow.config.from_file('../test_data/rocoto/rocoto.yaml')
+        self.suite=crow.config.Suite(conf.suite)
+
+    def test_write_rocoto(self):
+        fd=io.StringIO()
+        write_rocoto(self.suite,fd)
+        streamed=fd.getvalue()
+        self.assertTrue(streamed.startswith('<?xml version="1.0"?>\n'))
+        self.assertTrue(streamed.endswith('</workflow>\n'))
+        self.assertIn('<task name="fam.b"',streamed)
+        self.assertIn('<task name="final" final="true"',streamed)
+        self.assertEqual(streamed,to_rocoto(self.suite))
+
+    def test_array_metatasks(self):
+        conf=crow.config.from_file('../test_data/rocoto/rocoto.yaml')
+        conf.suite.Rocoto['task_array_metatasks']=True
+        compressed=to_rocoto(crow.config.Suite(conf.suite))
+        self.assertIn('<var name="crow_array_2_1">tusk_01_a tusk_01_b',
+                      compressed)
+        expanded=to_rocoto(self.suite)
+        self.assertNotIn('crow_array',expanded)
+        self.assertIn('<task name="my_array.tusk_03_c">',expanded)
+        self.assertEqual(expand_array_metatasks(compressed),expanded)
+
+    def test_array_metatask_words(self):
+        same_but_words=crow.metascheduler.rocoto._same_but_words
+        tokenize=crow.metascheduler.rocoto._tokenize
+        def same(a,b):
+            return same_but_words(tokenize(a),tokenize(b))
+        self.assertTrue(same('<command>run a &amp; b</command>',
+                             '<command>run c &amp; d</command>'))
+        self.assertTrue(same('<task name="a_1">','<task name="a_2">'))
+        self.assertFalse(same('<and>x</and>','<or>x</or>'))
+        self.assertFalse(same('<task name="a">','<task id="a">'))
+        self.assertFalse(same('<c>a &amp; b</c>','<c>a &lt; b</c>'))
+
+    def test_entities(self):
+        conf=crow.config.from_file('../test_data/rocoto/rocoto.yaml')
+        conf.suite.Rocoto['entity_threshold']=40
+        factored=to_rocoto(crow.config.Suite(conf.suite))
+        self.assertIn('<!ENTITY crow_fragment_1 "<queue>batch</queue>\n'
+                      '<account>GFS-T2O</account>">',factored)
+        self.assertIn('\n    &crow_fragment_1;\n',factored)
+        plain=to_rocoto(self.suite)
+        self.assertLess(len(factored),len(plain))
+        self.assertEqual(canonical_xml(factored),canonical_xml(plain))
+
+    def test_task_cache(self):
+        def generate(cache_file,max_tries=None):
+            conf=crow.config.from_file('../test_data/rocoto/rocoto.yaml')
+            conf.suite.Rocoto['task_cache_file']=cache_file
+            if max_tries:
+                conf.suite.fam.a['max_tries']=max_tries
+            generator=crow.metascheduler.rocoto.ToRocoto(
+                crow.config.Suite(conf.suite),True)
+            with io.StringIO() as sio:
+                generator.write_workflow_xml(sio)
+                cache=generator._ToRocoto__task_cache
+                return sio.getvalue(), cache.hits, cache.misses
+
+        plain=to_rocoto(self.suite)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_file=os.path.join(tmpdir,'cache.json')
+            first=generate(cache_file)
+            self.assertEqual(first,(plain,0,16))
+            self.assertEqual(generate(cache_file),(plain,16,0))
+            changed,hits,misses=generate(cache_file,max_tries=3)
+        self.assertEqual((hits,misses),(15,1))
+        self.assertIn('<task name="fam.a" maxtries="3">',changed)
+
+    def test_task_cache_outside_reads(self):
+        def generate(cache_file):
+            conf=crow.config.from_file('../test_data/rocoto/rocoto.yaml')
+            conf.suite.Rocoto['task_cache_file']=cache_file
+            conf.suite.fam.b['note']='from b'
+            conf.suite.fam.a['Rocoto']=expand('<command>{up.b.note}</command>')
+            conf.suite.simple_task['Rocoto']=expand(
+                '<command>{ENV.get("HOME","")}</command>')
+            generator=crow.metascheduler.rocoto.ToRocoto(
+                crow.config.Suite(conf.suite),True)
+            with io.StringIO() as sio:
+                generator.write_workflow_xml(sio)
+                cache=generator._ToRocoto__task_cache
+                return sio.getvalue(), cache.hits, cache.misses
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_file=os.path.join(tmpdir,'cache.json')
+            xml,hits,misses=generate(cache_file)
+            self.assertIn('<command>from b</command>',xml)
+            self.assertEqual(generate(cache_file),(xml,14,2))
+
+    def test_evaluation_tracker(self):
+        conf=crow.config.from_string('a: 1\nb: !calc a+1\nc: !calc b*2\n')
+        self.assertEqual(conf.c,4) # cached before tracking
+        with EvaluationTracker() as tracker:
+            # Reads in other threads are not recorded.
+            thread=threading.Thread(target=lambda: conf.b)
+            thread.start()
+            thread.join()
+            self.assertEqual(tracker.reads,[])
+            self.assertEqual(conf.c,4)
+        self.assertEqual([ key for container,key,raw in tracker.reads ],
+                         [ 'c', 'b', 'a' ])
+        self.assertEqual(conf._raw_cache()['c'],4)
+        with EvaluationTracker() as again:
+            conf.c
+        self.assertEqual(again.reads,tracker.reads)
+
+    def test_final_tasks_for_alarms(self):
+        conf=crow.config.from_file('../test_data/rocoto/alarms.yaml')
+        xml=to_rocoto(crow.config.Suite(conf.suite))
+        def dependency(task):
+            start=xml.index(f'<task name="{task}"')
+            body=xml[start:xml.index('</task>',start)]
+            return re.sub(r'\s+',' ',body[body.index('<dependency>'):])
+        self.assertEqual(dependency('final_for_six_at_00'),
+            '<dependency> <and> <taskdep task="big.sub2.z"/> '
+            '<metataskdep metatask="big.sub3"/> </and> </dependency> ')
+        self.assertEqual(dependency('final_for_twelve_hourly'),
+            '<dependency> <and> <taskdep task="post"/> '
+            '<taskdep task="big.sub1.x"/> <or> <taskdep task="big.sub1.y"/> '
+            '<taskdep task="simple_task"/> </or> </and> </dependency> ')
+        no_alarm=dependency('final_no_alarm')
+        self.assertIn('<taskdep task="big.sub2.w"/>',no_alarm)
+        self.assertNotIn('big.sub2.skipped',no_alarm)
+        self.assertNotIn('big.sub3',no_alarm)
+
+    def test_defvar_literal(self):
+        to_rocoto=crow.metascheduler.rocoto.ToRocoto(self.suite,False)
+        self.assertEqual(to_rocoto.defvar('x','say "100%"',literal=True),
+                         '<!ENTITY x "say &#34;100&#37;&#34;">')
+
+if __name__ == '__main__':
+    unittest.main()
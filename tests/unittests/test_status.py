@@ -0,0 +1,109 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import os, unittest, tempfile, shutil
+from context import crow
+from crow.sysenv.exceptions import SysEnvConfigError
+from crow.sysenv.status import *
+
+BJOBS='''JOBID;STAT;QUEUE;JOB_NAME;USER
+101;RUN;dev;gfs_fcst;alice
+102;PEND;dev;gfs_post;alice
+103;EXIT;dev;gfs_anal;alice
+'''
+
+SQUEUE='''2001|RUNNING|batch|gfs_fcst|alice|None
+2002|PENDING|batch|gfs_post|alice|Dependency
+2003|PENDING|batch|gfs_arch|alice|JobHeldUser
+'''
+
+SHOWQ='''<Data><Object>queue</Object>
+<queue option="active"><job JobID="31" JobName="fcst" State="Running"
+  Class="batch" User="alice"/></queue>
+<queue option="blocked"><job JobID="32" JobName="post" State="BatchHold"
+  Class="batch" User="alice"/></queue>
+</Data>'''
+
+class TestStatusParsers(unittest.TestCase):
+
+    def test_lsf(self):
+        jobs=parse_lsf_status(BJOBS)
+        self.assertEqual(list(jobs),[ '101', '102', '103' ])
+        self.assertEqual([ j.state for j in jobs.values() ],
+                         [ 'RUNNING', 'QUEUED', 'FAILED' ])
+        self.assertEqual(jobs['103'].native_state,'EXIT')
+        self.assertEqual(jobs['101'].name,'gfs_fcst')
+        self.assertFalse(parse_lsf_status('No job found\n'))
+
+    def test_slurm(self):
+        jobs=parse_slurm_status(SQUEUE)
+        self.assertEqual(jobs['2001'],JobStatus(
+            '2001','gfs_fcst','RUNNING','batch','alice','RUNNING'))
+        self.assertEqual(jobs['2002'].state,'QUEUED')
+        self.assertEqual(jobs['2003'].state,'HELD')
+        self.assertEqual(parse_slurm_status(
+            '2004|PENDING|batch|gfs_post|alice\n')['2004'].state,'QUEUED')
+
+    def test_moab(self):
+        jobs=parse_moab_status(SHOWQ)
+        self.assertEqual([ j.state for j in jobs.values() ],
+                         [ 'RUNNING', 'HELD' ])
+
+    def test_format_for_scheduler(self):
+        self.assertEqual(status_format_for('LSFAlps').name,'LSF')
+        self.assertEqual(status_format_for('MoabTorque').name,'Moab')
+        self.assertEqual(status_format_for('Slurm_Xsede').name,'Slurm')
+        with self.assertRaises(SysEnvConfigError):
+            status_format_for('PBSPro')
+
+class TestStatusPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.cache=os.path.join(self.tempdir,'status.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_poll_writes_cache(self):
+        backend=FakeStatusBackend([ SQUEUE ])
+        poller=StatusPoller('Slurm',self.cache,user='alice',backend=backend)
+        poller.run(max_polls=1)
+        self.assertEqual(backend.commands,[[ 'squeue', '-h', '-o',
+            '%i|%T|%P|%j|%u|%r', '-u', 'alice' ]])
+        jobs=read_status_file(self.cache)
+        self.assertEqual(jobs,parse_slurm_status(SQUEUE))
+        self.assertIsNone(read_status_file(self.cache,max_age=-1))
+
+    def test_failed_poll_keeps_state(self):
+        backend=FakeStatusBackend([ BJOBS, OSError('bjobs: not found') ])
+        poller=StatusPoller('LSF',self.cache,user='alice',backend=backend)
+        poller.poll()
+        poller.poll()
+        self.assertEqual(poller.polls,1)
+        self.assertEqual(len(read_status_file(self.cache)),3)
+
+    def test_one_poller_per_cache(self):
+        first=StatusPoller('LSF',self.cache,backend=FakeStatusBackend(['']))
+        second=StatusPoller('LSF',self.cache,backend=FakeStatusBackend(['']))
+        self.assertTrue(first.lock())
+        self.assertFalse(second.lock())
+        first.unlock()
+        self.assertTrue(second.lock())
+        second.unlock()
+
+    def test_socket(self):
+        path=os.path.join(self.tempdir,'status.sock')
+        poller=StatusPoller('Moab',self.cache,user='alice',
+                            backend=FakeStatusBackend([ SHOWQ ]))
+        poller.poll()
+        poller.serve_socket(path)
+        try:
+            jobs=query_status_socket(path)
+        finally:
+            poller.stop()
+        self.assertEqual(jobs,parse_moab_status(SHOWQ))
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
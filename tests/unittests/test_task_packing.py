@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest
+from context import crow
+from crow.sysenv import GenericNodeSpec, get_scheduler, get_parallelism
+from crow.sysenv.exceptions import MachineTooSmallError, \
+     InvalidJobResourceSpec
+from crow.sysenv.task_packing import pack_tasks
+
+class TestTaskPacking(unittest.TestCase):
+
+    def setUp(self):
+        self.settings={ 'physical_cores_per_node':8,
+                        'logical_cpus_per_core':2,
+                        'hyperthreading_allowed':True,
+                        'memory_per_node':'16G' }
+        self.nodes=GenericNodeSpec(self.settings)
+        self.specs=[ [ { 'exe':'post', 'args':[ f'f{i:03d}' ],
+                         'walltime':'00:10:00', 'memory':'3G' } ]
+                     for i in range(10) ]
+        self.specs.append([ { 'exe':'big', 'OMP_NUM_THREADS':4,
+                              'walltime':'00:20:00' } ])
+
+    def test_fewest_nodes(self):
+        packing=pack_tasks(self.nodes,self.specs)
+        # Memory, not cores, limits each node to five 3G programs.
+        self.assertEqual(packing.node_count,3)
+        self.assertEqual(packing.cores_used(),14)
+        self.assertAlmostEqual(packing.efficiency(),14/24.)
+        self.assertEqual(packing.tasks[0].index,10)
+        self.assertEqual(packing.tasks[0].cores,4)
+        for task in packing.tasks:
+            self.assertLessEqual(task.first_core+task.cores,8)
+        self.assertIn('11 programs on 3 nodes',packing.report())
+
+    def test_fixed_nodes(self):
+        packing=pack_tasks(self.nodes,self.specs,node_count=4)
+        self.assertEqual(packing.node_count,4)
+        self.assertEqual(sorted(set([ t.node for t in packing.tasks ])),
+                         [0,1,2,3])
+        with self.assertRaises(MachineTooSmallError):
+            pack_tasks(self.nodes,self.specs,node_count=2)
+
+    def test_only_serial_and_openmp(self):
+        with self.assertRaises(InvalidJobResourceSpec):
+            pack_tasks(self.nodes,[ [ { 'exe':'mpi', 'mpi_ranks':4 } ] ])
+
+    def test_command_file(self):
+        packing=pack_tasks(self.nodes,self.specs[9:])
+        self.assertEqual(packing.command_file(),
+                         'OMP_NUM_THREADS=4 big\npost f009\n')
+
+    def test_batch_card(self):
+        packing=pack_tasks(self.nodes,self.specs)
+        sched=get_scheduler('Slurm',self.settings)
+        self.assertEqual(packing.batch_resources(sched),
+                         '#SBATCH -t 00:20:00\n'
+                         '#SBATCH --mem=15360M\n'
+                         '#SBATCH -N 3 -n 11 --exclusive\n'
+                         '# 1 node(s): 1 of block 0 (1M), 1 of block 1 '
+                         '(3072M), 1 of block 2 (3072M), 1 of block 3 '
+                         '(3072M), 1 of block 4 (3072M); 12289M used, '
+                         '4095M free\n'
+                         '# 1 node(s): 1 of block 5 (3072M), 1 of block 6 '
+                         '(3072M), 1 of block 7 (3072M), 1 of block 8 '
+                         '(3072M), 1 of block 9 (3072M); 15360M used, '
+                         '1024M free\n'
+                         '# 1 node(s): 1 of block 10 (3072M); 3072M used, '
+                         '13312M free\n')
+
+    def test_lsf_batch_card(self):
+        packing=pack_tasks(self.nodes,self.specs[7:])
+        sched=get_scheduler('LSF',self.settings)
+        post='1*{span[ptile=1]affinity[core(1)]rusage[mem=3072]}'
+        self.assertEqual(packing.batch_resources(sched),
+                         '#BSUB -W 0:20\n'
+                         '#BSUB -x\n'
+                         "#BSUB -R '1*{span[ptile=1]affinity[core(4)]"
+                         f"rusage[mem=2000]}} + {post} + {post} + {post}'\n")
+
+    def test_hydra_launch(self):
+        packing=pack_tasks(self.nodes,self.specs[8:])
+        cmd=packing.make_ShellCommand(get_parallelism('HydraIMPI',
+                                                      self.settings))
+        self.assertEqual(cmd.command,[ 'mpirun', '-np', '1', '/usr/bin/env',
+            'OMP_NUM_THREADS=4', 'big', ':', '-np', '1', 'post', 'f008',
+            ':', '-np', '1', 'post', 'f009' ])
+
+    def test_mpmd_launch(self):
+        packing=pack_tasks(self.nodes,self.specs[8:])
+        cmd=packing.make_ShellCommand(get_parallelism('SrunMPI',
+                                                      self.settings))
+        self.assertEqual(cmd.command,[ 'srun',
+            '--cpu-bind=mask_cpu:0xf,0x10,0x20', '-n', '3', '--multi-prog',
+            'crow_multi_prog.conf' ])
+        self.assertEqual(cmd.files['crow_multi_prog.conf']['content'],
+                         '0 /usr/bin/env OMP_NUM_THREADS=4 big\n'
+                         '1 post f008\n2 post f009\n')
+
+if __name__ == '__main__':
+    unittest.main()
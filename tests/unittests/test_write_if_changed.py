@@ -0,0 +1,70 @@
+#! /usr/bin/env python3
+f'This script requires python 3.6 or later'
+
+import unittest, os, tempfile, json
+from context import crow
+from crow.tools import write_files_if_changed
+
+class TestWriteIfChanged(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir=tempfile.TemporaryDirectory()
+        self.dir=self.tmpdir.name
+        self.manifest=os.path.join(self.dir,'manifest.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self,*names):
+        return os.path.join(self.dir,*names)
+
+    def test_counts(self):
+        files={ self.path('a','one'):'1\n', self.path('a','two'):'2\n',
+                self.path('b','c','three'):'3\n' }
+        report=write_files_if_changed(files,self.manifest)
+        self.assertEqual(len(report.new),3)
+        self.assertEqual(len(report.changed)+len(report.unchanged),0)
+        with open(self.path('b','c','three'),'rt') as fd:
+            self.assertEqual(fd.read(),'3\n')
+
+        old_time=1000000000
+        for filename in files:
+            os.utime(filename,(old_time,old_time))
+
+        del files[self.path('a','one')]
+        files[self.path('a','two')]='two\n'
+        report=write_files_if_changed(files,self.manifest)
+        self.assertEqual(report.changed,[self.path('a','two')])
+        self.assertEqual(report.unchanged,[self.path('b','c','three')])
+        self.assertEqual(report.removed,[self.path('a','one')])
+        self.assertEqual(os.stat(self.path('b','c','three')).st_mtime,old_time)
+        self.assertTrue(os.path.exists(self.path('a','one')))
+        with open(self.manifest,'rt') as fd:
+            self.assertEqual(len(json.load(fd)),2)
+
+    def test_no_manifest(self):
+        filename=self.path('same')
+        with open(filename,'wt') as fd: fd.write('same\n')
+        os.utime(filename,(1000000000,1000000000))
+        report=write_files_if_changed({ filename:'same\n' })
+        self.assertEqual(report.unchanged,[filename])
+        self.assertEqual(os.stat(filename).st_mtime,1000000000)
+
+    def test_incremental(self):
+        write_files_if_changed({ self.path('x'):'x' },self.manifest)
+        report=write_files_if_changed({ self.path('y'):'y' },self.manifest,
+                                      complete=False,delete_removed=True)
+        self.assertEqual(str(report),'1 new, 0 changed, 0 unchanged, 0 removed')
+        self.assertTrue(os.path.exists(self.path('x')))
+        with open(self.manifest,'rt') as fd:
+            self.assertEqual(sorted(json.load(fd)),
+                             [ self.path('x'), self.path('y') ])
+
+    def test_delete_removed(self):
+        write_files_if_changed({ self.path('x'):'x' },self.manifest)
+        report=write_files_if_changed({},self.manifest,delete_removed=True)
+        self.assertEqual(str(report),'0 new, 0 changed, 0 unchanged, 1 removed')
+        self.assertFalse(os.path.exists(self.path('x')))
+
+if __name__ == '__main__':
+    unittest.main()
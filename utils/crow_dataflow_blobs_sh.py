@@ -0,0 +1,57 @@
+#! /usr/bin/env python3.6
+
+import sys, logging
+from getopt import getopt
+from crow.dataflow import Dataflow
+from crow.dataflow.blobs import GC_MIN_AGE, BLOB_LINKS
+
+def usage(why):
+    sys.stderr.write(f'''Format: crow_dataflow_blobs_sh.py [-v] file.db use directory [hardlink|symlink]
+        crow_dataflow_blobs_sh.py [-v] [-n] [-a age] file.db gc
+-v = be verbose
+-n = dry run: list blobs that gc would delete, but keep them
+-a age = keep blobs modified in the last age seconds (default {GC_MIN_AGE})
+file.db = sqlite3 database with state information
+use = deliver files through a content-addressed store in directory,
+      linking slot locations to it by hardlink (default) or symlink
+gc = delete blobs no longer used by any cycle in the database
+''')
+    sys.stderr.write(why+'\n')
+    exit(1)
+
+def main():
+    (optval, args) = getopt(sys.argv[1:],'vna:')
+    options=dict(optval)
+
+    level=logging.DEBUG if '-v' in options else logging.INFO
+    logging.basicConfig(stream=sys.stderr,level=level)
+    logger=logging.getLogger('crow_dataflow_sh')
+
+    if len(args)<2: usage('give the database file and a command')
+    dbfile, command = args[0:2]
+
+    if command=='use':
+        if len(args) not in [ 3, 4 ]:
+            usage('use: give the blob store directory and, optionally, '
+                  'the link type')
+        link=args[3] if len(args)>3 else 'hardlink'
+        if link not in BLOB_LINKS: usage(f'{link}: unknown link type')
+        store=Dataflow(dbfile).use_blob_store(args[2],link)
+        logger.info(f'{dbfile}: deliver files through {store}')
+    elif command=='gc':
+        if len(args)!=2: usage('gc: no arguments after "gc"')
+        try:
+            min_age=float(options.get('-a',GC_MIN_AGE))
+        except ValueError:
+            usage(f'{options["-a"]}: age must be a number of seconds')
+        db=Dataflow(dbfile)
+        if db.blob_store is None:
+            logger.error(f'{dbfile}: no blob store; see "use"')
+            exit(1)
+        for digest in db.collect_garbage(min_age,'-n' in options):
+            print(db.blob_store.path(digest))
+    else:
+        usage(f'{command}: specify "use" or "gc"')
+
+if __name__ == '__main__':
+    main()
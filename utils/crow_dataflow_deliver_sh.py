@@ -29,24 +29,23 @@ def usage(why):
     sys.stderr.write(why+'\n')
     exit(1)
 
+def print_availability(message,avail):
+    when='0'
+    if avail:
+        when=datetime.fromtimestamp(avail).strftime('%Y-%m-%dt%H:%M:%S')
+    localmeta=message.get_meta()
+    if localmeta:
+        metas=[ f'{k}={v}' for k,v in localmeta.items() ]
+        print(f'{bool(avail)} ({when}) - {message.flow} {message.actor} '
+              f'{message.slot} {" ".join(metas)}')
+    else:
+        print(f'{bool(avail)} ({when}) - {message.flow} {message.actor} '
+              f'{message.slot}')
+
 def deliver_by_name(logger,flow,local,message,check):
     logger.debug(f'{message.actor}.{message.slot} (meta={locals}): deliver by name from {local}')
     if check:
-        strloc=local
-        if local == '-' and flow=='O': strloc='(stdin)'
-        if local == '-' and flow=='I': strloc='(stdout)'
-        avail=message.availability_time()
-        when='0'
-        if avail:
-            when=datetime.fromtimestamp(avail).strftime('%Y-%m-%dt%H:%M:%S')
-        localmeta=message.get_meta()
-        if localmeta:
-            metas=[ f'{k}={v}' for k,v in localmeta.items() ]
-            print(f'{bool(avail)} ({when}) - {message.flow} {message.actor} '
-                  f'{message.slot} {" ".join(metas)}')
-        else:
-            print(f'{bool(avail)} ({when}) - {message.flow} {message.actor} '
-                  f'{message.slot}')
+        print_availability(message,message.availability_time())
     elif local != '-':
         if flow == 'O':
             message.deliver(local)
@@ -62,28 +61,41 @@ def deliver_by_name(logger,flow,local,message,check):
             #shutil.copyfileobj(sys.stdin.buffer,out_fd)
             out_fd.write(data)
 
-def slot_meta_iter(slot,meta):
-    for k,v in meta.items():
-        if isinstance(v,list):
-            for item in v:
-                newmeta=dict(meta)
-                newmeta[k]=item
-                for s,m in slot_meta_iter(slot,newmeta):
-                    yield s,m
-            return
-    yield slot,meta
-
-def deliver_by_format(logger,flow,format,message,check):
+def local_files(logger,format,message):
+    """Yields (message,local_file) for each combination of metadata
+    values, with the local file name from the format."""
     if "'''" in format:
         raise ValueError(f"{format}: cannot contain three single quotes "
                          "in a row '''")
     globals={ 'actor':message.actor, 'slot':message.slot, 'flow':message.flow, 
               'cycle':message.cycle }
-    for slot,meta in slot_meta_iter(message,message.get_meta()):
+    for one_message in message.expand():
+        meta=one_message.get_meta()
         logger.debug(f'{message.actor}.{message.slot} (meta={meta}): filename format {format}')
         local_file=eval("f'''"+format+"'''",globals,meta)
-        logger.debug(f'{message.actor}.{message.slot} (meta={meta}): deliver by format from {local_file}')
-        deliver_by_name(logger,flow,local_file,message,check)
+        yield one_message,local_file
+
+def deliver_by_format(logger,flow,format,message,check):
+    for one_message,local_file in local_files(logger,format,message):
+        logger.debug(f'{message.actor}.{message.slot} (meta={one_message.get_meta()}): deliver by format from {local_file}')
+        deliver_by_name(logger,flow,local_file,one_message,check)
+
+def deliver_in_bulk(logger,db,flow,format,cycle,slots,check):
+    """Delivers, obtains, or checks all messages of all slots at once:
+    one database transaction, and files copied in parallel."""
+    pairs=list()
+    for slot in slots:
+        pairs.extend(local_files(logger,format,slot.at(cycle)))
+    logger.info(f'{len(pairs)} messages')
+    if check:
+        times=db.availability_times([ message for message,local in pairs ])
+        for (message,local),avail in zip(pairs,times):
+            print_availability(message,avail)
+    elif flow=='O':
+        db.deliver_many(cycle,[ ( message.slot_object, message.get_meta(),
+                                  local ) for message,local in pairs ])
+    else:
+        db.obtain_many(pairs)
 
 def has_meta_lists(slot):
     meta=slot.get_meta()
@@ -169,8 +181,11 @@ def main():
         logger.error('Single match but -m was specified.  Abort.')
         exit(1)
 
-    for slot in slots:
-        deliver_by_format(logger,flow,local,slot.at(cycle),'-c' in options)
+    if '-m' in options and local != '-':
+        deliver_in_bulk(logger,db,flow,local,cycle,slots,'-c' in options)
+    else:
+        for slot in slots:
+            deliver_by_format(logger,flow,local,slot.at(cycle),'-c' in options)
 
 
 if __name__ == '__main__':
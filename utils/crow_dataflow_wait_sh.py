@@ -0,0 +1,88 @@
+#! /usr/bin/env python3.6
+
+import sys, logging
+from getopt import getopt
+from contextlib import suppress
+from datetime import datetime
+from crow.dataflow import Dataflow, DataNotAvailable, wait_for
+from crow.tools import shell_to_python_type
+
+ALLOWED_DATE_FORMATS=[ '%Y-%m-%dt%H:%M:%S', '%Y-%m-%dT%H:%M:%S',
+                       '%Y-%m-%d %H:%M:%S', '%Y%m%d%H', '%Y%m%d%H%M' ]
+
+USAGE='''Format: crow_dataflow_wait_sh.py [-v] [-O] [-t timeout] \\
+  dataflow.db cycle actor [var=value [...]]
+Blocks until all matching slots are available at the cycle.
+  -v = verbose (set logging level to logging.DEBUG)
+  -O = wait for output slots instead of input slots
+  -t timeout = give up after this many seconds, with exit status 1
+  dataflow.db = sqlite3 database file with state information
+  cycle = forecast cycle in ISO format: 2019-08-15t13:08:14
+  actor = actor (job) whose slots to wait for (path.to.actor)
+  slot=slotname = name of the slot; default: all slots of the actor
+  var=type::value = specify type of value: int, float, bool, str
+'''
+
+def usage(why):
+    sys.stderr.write(USAGE)
+    sys.stderr.write(why+'\n')
+    exit(1)
+
+def main():
+    (optval, args) = getopt(sys.argv[1:],'vOt:')
+    options=dict(optval)
+
+    level=logging.DEBUG if '-v' in options else logging.INFO
+    logging.basicConfig(stream=sys.stderr,level=level)
+    logger=logging.getLogger('crow_dataflow_sh')
+
+    if len(args)<3:
+        usage('specify dataflow db file, cycle, and actor')
+
+    timeout=None
+    if '-t' in options:
+        try:
+            timeout=float(options['-t'])
+        except ValueError:
+            usage(f'{options["-t"]}: timeout must be a number of seconds')
+
+    ( dbfile, cyclestr, actor ) = args[0:3]
+    cycle=None
+    for fmt in ALLOWED_DATE_FORMATS:
+        with suppress(ValueError):
+            cycle=datetime.strptime(cyclestr,fmt)
+            break
+    if cycle is None: usage(f'unknown cycle format: {cyclestr}')
+
+    slot=None
+    meta={}
+    for arg in args[3:]:
+        split=arg.split('=',1)
+        if len(split)!=2:
+            usage(f'{arg}: arguments must be var=value')
+        ( var, strvalue ) = split
+        value=shell_to_python_type(strvalue)
+        if var=='slot':
+            slot=value
+        else:
+            meta[var]=value
+
+    db=Dataflow(dbfile)
+    find=db.find_output_slot if '-O' in options else db.find_input_slot
+    messages=[ one for found in find(actor,slot,meta)
+               for one in found.at(cycle).expand()
+               if all([ one.get_meta().get(k)==v for k,v in meta.items() ]) ]
+    if not messages:
+        logger.error('No match for query.  Such a slot does not exist.')
+        exit(1)
+
+    logger.info(f'{dbfile}: wait for {len(messages)} messages')
+    try:
+        wait_for(messages,timeout)
+    except DataNotAvailable as e:
+        logger.error(str(e))
+        exit(1)
+    logger.info('all messages are available')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#! /usr/bin/env python3.6
+
+import sys, signal, logging
+from getopt import getopt
+from crow.sysenv.exceptions import SysEnvConfigError
+from crow.sysenv.status import StatusPoller
+
+USAGE='''Format: crow_status_poller_sh.py [-v] [-i interval] [-u user] \\
+  [-s socket] scheduler cache.json
+Polls the batch system for the user's jobs until killed, and writes
+them to a cache file that workflow viewers read instead of running
+the status command themselves.  Exits at once, with status 0, if
+another poller already writes the cache file, so it is safe to start
+one from every viewer.
+  -v = verbose (set logging level to logging.DEBUG)
+  -i interval = seconds between polls; default: 60
+  -u user = user whose jobs to list; default: $USER
+  -s socket = also answer queries on this Unix socket
+  scheduler = CROW scheduler name, such as LSFAlps, Slurm or MoabTorque
+  cache.json = JSON file to write after each poll
+'''
+
+def usage(why):
+    sys.stderr.write(USAGE)
+    sys.stderr.write(why+'\n')
+    exit(1)
+
+def main():
+    (optval, args) = getopt(sys.argv[1:],'vi:u:s:')
+    options=dict(optval)
+
+    level=logging.DEBUG if '-v' in options else logging.INFO
+    logging.basicConfig(stream=sys.stderr,level=level)
+    logger=logging.getLogger('crow_status_poller_sh')
+
+    if len(args)!=2:
+        usage('specify scheduler and cache file')
+    ( scheduler, cache_file ) = args
+
+    interval=60
+    if '-i' in options:
+        try:
+            interval=float(options['-i'])
+        except ValueError:
+            usage(f'{options["-i"]}: interval must be a number of seconds')
+
+    try:
+        poller=StatusPoller(scheduler,cache_file,user=options.get('-u',None),
+                            interval=interval)
+    except SysEnvConfigError as e:
+        usage(str(e))
+
+    if not poller.lock():
+        logger.info(f'{cache_file}: already polled by another process')
+        exit(0)
+    try:
+        if '-s' in options:
+            poller.serve_socket(options['-s'])
+        for signum in [ signal.SIGTERM, signal.SIGINT, signal.SIGHUP ]:
+            signal.signal(signum,lambda signum,frame: poller.stop())
+        logger.info(f'{cache_file}: poll {scheduler} every {interval} '
+                    'seconds')
+        poller.run()
+    finally:
+        poller.stop()
+        poller.unlock()
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 #! /usr/bin/env python3
 f'This python module requires python 3.6 or newer'
 
-import logging, os, io, sys, datetime, glob, shutil, subprocess, re, itertools, collections
+import logging, os, io, sys, datetime, glob, shutil, subprocess, re, itertools, collections, json
 from collections import OrderedDict
 from copy import copy
 from getopt import getopt
@@ -26,7 +26,11 @@ def init_logging(verbose=False,debug=False):
     logging.basicConfig(stream=sys.stderr,level=level)
 
 import crow.tools, crow.config
-from crow.metascheduler import to_ecflow, to_rocoto, to_dummy
+from crow.metascheduler import to_ecflow, to_rocoto, write_rocoto, to_dummy
+from crow.metascheduler.critical_path import critical_path_for_suite
+from crow.metascheduler.ecflow_state import EcflowGraphState, fingerprint_text
+from crow.metascheduler.ecflow_diff import plan_suite_updates, \
+     SubprocessEcflowClient
 from crow.config import from_dir, Suite, from_file, to_yaml
 from crow.tools import Clock
 
@@ -400,18 +404,17 @@ def make_log_directories(conf,suite,first_cycle,last_cycle):
         if now <= first_cycle:
             logger.error(f'Suite clock step is zero or negative.  Abort.')
 
-def write_ecflow_suite_to_disk(defdir, scriptdir, ecflow_suite):
+def write_ecflow_suite_to_disk(defdir, scriptdir, ecflow_suite,
+                               complete=True):
     written_suite_defs=OrderedDict()
+    files=OrderedDict()
 
     print(f'   suite definition files: {defdir}')
     for defname,deffile,defcontents in ecflow_suite.each_suite():
         filename=os.path.realpath(os.path.join(defdir,deffile))
-        make_parent_dir(filename)
-        logger.info(f'{defname}: {filename}: write suite definition')
-        with open(os.path.join(defdir,filename),'wt') as fd:
-            fd.write(defcontents)
+        logger.info(f'{defname}: {filename}: suite definition')
+        files[filename]=defcontents
         written_suite_defs[defname]=filename
-    del defname,deffile,defcontents,filename
 
     for setname,setpath in ecflow_suite.each_ecf_file_set():
         print(f'   ecf files for "{setname}" node: {setpath}')
@@ -419,13 +422,19 @@ def write_ecflow_suite_to_disk(defdir, scriptdir, ecflow_suite):
         for filename,filedata in ecflow_suite.each_ecf_file(setname):
             count+=1
             full_fn=os.path.realpath(os.path.join(setpath,filename)+'.ecf')
-            logger.debug(f'{full_fn}: write ecf file')
-            make_parent_dir(full_fn)
-            with open(full_fn,'wt') as fd:
-                fd.write(filedata)
+            files[full_fn]=filedata
         if not count:
             logger.warning(f'{setpath}: no files to write for {setname}!')
 
+    # Only files whose contents changed since the last write are
+    # rewritten, so ecFlow does not see new timestamps on the rest.
+    # Writes of some cycles (complete=False) add to the manifest
+    # rather than replacing it.
+    manifest=os.path.join(defdir,'crow_write_manifest.json')
+    report=crow.tools.write_files_if_changed(files,manifest,
+                                             complete=complete)
+    print(f'   wrote files: {report}')
+
     return written_suite_defs
 
 def get_target_dir_and_check_ecflow_env(ECFNETS_INCLUDE='/ecf/ecfnets/include'):
@@ -482,7 +491,23 @@ def check_or_populate_ecf_include(conf):
         with open(filename,'wt') as fd:
             fd.write(content)
 
-def create_new_ecflow_workflow(conf,suite,surrounding_cycles=2):
+def ecflow_state_file(conf):
+    return conf.places.get('ecflow_state_file',os.path.join(
+        conf.places.ecflow_def_dir,'crow_ecflow_state.json'))
+
+def yaml_fingerprint(yamldir):
+    with io.StringIO() as fd:
+        crow.config.follow_main(fd,yamldir)
+        return fingerprint_text(fd.getvalue())
+
+def record_ecflow_state(state,state_file,ecflow_suite):
+    for problem in state.check_references(ecflow_suite):
+        logger.warning(problem)
+    state.record(ecflow_suite)
+    state.save(state_file)
+
+def create_new_ecflow_workflow(conf,suite,surrounding_cycles=2,
+                               fingerprint=None):
     ECF_HOME=get_target_dir_and_check_ecflow_env()
     if not ECF_HOME: return None,None,None,None
     first_cycle=suite.Clock.start
@@ -496,46 +521,88 @@ def create_new_ecflow_workflow(conf,suite,surrounding_cycles=2):
     check_or_populate_ecf_include(conf)
     make_log_directories(conf,suite,first_cycle,last_cycle)
     make_ecflow_job_and_out_directories(ECF_HOME, ECF_OUT, ecflow_suite)
+    record_ecflow_state(EcflowGraphState(fingerprint),
+                        ecflow_state_file(conf),ecflow_suite)
     return ECF_HOME, suite_def_files, first_cycle, last_cycle
 
-def update_existing_ecflow_workflow(suite,first_cycle,last_cycle,
-                                    surrounding_cycles=2):
+def update_existing_ecflow_workflow(conf,suite,first_cycle,last_cycle,
+                                    surrounding_cycles=2,fingerprint=None):
     ECF_HOME=get_target_dir_and_check_ecflow_env()
-    if first_cycle > conf.suite.Clock.end:
+    if first_cycle > suite.Clock.end:
         print('First cycle is after end of suite.  Nothing to do.')
         exit(0)
-    ecflow_suite, first_cycle, last_cycle = generate_ecflow_suite_in_memory(
-        suite,first_cycle,last_cycle,surrounding_cycles)
+
+    # Skip cycles generated by prior calls.  Their simplified states
+    # stand in for the surrounding cycles, so none are reanalyzed.
+    # Runs of new cycles separated by generated ones are generated
+    # separately, so the generated ones are not rewritten.
+    state_file=ecflow_state_file(conf)
+    state=EcflowGraphState.load(state_file,fingerprint)
+    cycle_ranges=[ ( first_cycle, last_cycle ) ]
+    if len(state):
+        cycle_ranges=list(state.new_cycle_ranges(Clock(
+            start=first_cycle,end=last_cycle,step=suite.Clock.step)))
+        if not cycle_ranges:
+            print('All requested cycles were already generated.  Nothing to do.')
+            return ECF_HOME, OrderedDict(), OrderedDict()
+        surrounding_cycles=0
+
     defdir=conf.places.ecflow_def_dir
     ECF_OUT=conf.places.ECF_OUT
-    make_log_directories(conf,suite,first_cycle,last_cycle)
-    make_ecflow_job_and_out_directories(ECF_HOME, ECF_OUT, ecflow_suite)
-    suite_def_files = write_ecflow_suite_to_disk(
-        defdir,ECF_HOME,ecflow_suite)
-    return ECF_HOME, suite_def_files
-
-def load_ecflow_suites(ECF_HOME,suite_def_files):
+    suite_def_files=OrderedDict()
+    old_suite_defs=OrderedDict()
+    for first_cycle,last_cycle in cycle_ranges:
+        ecflow_suite, first_cycle, last_cycle = \
+            generate_ecflow_suite_in_memory(
+                suite,first_cycle,last_cycle,surrounding_cycles)
+        make_log_directories(conf,suite,first_cycle,last_cycle)
+        make_ecflow_job_and_out_directories(ECF_HOME, ECF_OUT, ecflow_suite)
+        for defname,old_def in read_old_suite_defs(
+                defdir,ecflow_suite).items():
+            old_suite_defs.setdefault(defname,old_def)
+        suite_def_files.update(write_ecflow_suite_to_disk(
+            defdir,ECF_HOME,ecflow_suite,complete=False))
+        record_ecflow_state(state,state_file,ecflow_suite)
+    return ECF_HOME, suite_def_files, old_suite_defs
+
+def read_old_suite_defs(defdir, ecflow_suite):
+    """!Reads the suite definitions that are about to be overwritten, so
+    load_ecflow_suites can send only the differences to the server."""
+    old_suite_defs=OrderedDict()
+    for defname,deffile,defcontents in ecflow_suite.each_suite():
+        filename=os.path.realpath(os.path.join(defdir,deffile))
+        with suppress(FileNotFoundError):
+            with open(filename,'rt') as fd:
+                old_suite_defs[defname]=fd.read()
+    return old_suite_defs
+
+def load_ecflow_suites(ECF_HOME,suite_def_files,old_suite_defs=None,
+                       client=None):
+    """!Loads new suites into the server.  Suites with an entry in
+    old_suite_defs were loaded before; only their changed nodes are
+    replaced or deleted.  Returns the suites that were loaded, which
+    are the ones that must be begun."""
     logger.info(f'{ECF_HOME}: load suites: '
                 f'{", ".join(suite_def_files.keys())}')
+    if client is None: client=SubprocessEcflowClient()
     with crow.tools.chdir(ECF_HOME):
-        for file in suite_def_files.values():
-            cmd=f'ecflow_client --load {file}'
-            logger.info(cmd)
-            subprocess.run(cmd,check=False,shell=True)
+        plan=plan_suite_updates(suite_def_files,old_suite_defs or {})
+        print(f'ecflow server update: {plan}')
+        plan.execute(client)
+    return plan.suites_to_load()
 
-def begin_ecflow_suites(ECF_HOME,suite_def_files):
+def begin_ecflow_suites(ECF_HOME,suite_def_files,client=None):
     logger.info(f'{ECF_HOME}: begin suites: '
                 f'{", ".join(suite_def_files.keys())}')
+    if client is None: client=SubprocessEcflowClient()
     with crow.tools.chdir(ECF_HOME):
         for suite in suite_def_files.keys():
-            cmd=f'ecflow_client --begin {suite}'
-            logger.info(cmd)
-            subprocess.run(cmd,check=False,shell=True)
+            client.begin(suite)
 
 def make_rocoto_xml(suite,filename):
     with open(filename,'wt') as fd:
         logger.info(f'{filename}: create Rocoto XML document')
-        fd.write(to_rocoto(suite))
+        write_rocoto(suite,fd)
     print(f'{filename}: Rocoto XML document created here.')
     
 ########################################################################
@@ -565,7 +632,7 @@ def make_ecflow_files_for_cycles(
     make_log_directories(conf,suite,first_cycle,last_cycle)
     make_ecflow_job_and_out_directories(ECF_HOME, ECF_OUT, ecflow_suite)
     written_suite_defs = write_ecflow_suite_to_disk(
-        defdir, ECF_HOME, ecflow_suite)
+        defdir, ECF_HOME, ecflow_suite, complete=False)
     print(f'''Suite definition files and ecf files have been written to:
 
   {ECF_HOME}
@@ -581,7 +648,8 @@ def create_and_load_ecflow_workflow(yamldir,surrounding_cycles=2,begin=False):
     conf,suite=read_yaml_suite(yamldir)
     loudly_make_dir_if_missing(f'{conf.places.ROTDIR}/logs')
     ECF_HOME, suite_def_files, first_cycle, last_cycle = \
-        create_new_ecflow_workflow(conf,suite,surrounding_cycles)
+        create_new_ecflow_workflow(conf,suite,surrounding_cycles,
+                                   yaml_fingerprint(yamldir))
     if not ECF_HOME:
         logger.error('Could not create workflow files.  See prior errors for details.')
         return False
@@ -590,7 +658,7 @@ def create_and_load_ecflow_workflow(yamldir,surrounding_cycles=2,begin=False):
         begin_ecflow_suites(ECF_HOME,suite_def_files)
         
 def add_cycles_to_running_ecflow_workflow_at(
-        yamldir,first_cycle_str,last_cycle_str,surrounding_cycles=2): 
+        yamldir,first_cycle_str,last_cycle_str,surrounding_cycles=2):
     init_logging()
     conf,suite=read_yaml_suite(yamldir)
     first_cycle=datetime.datetime.strptime(first_cycle_str,'%Y%m%d%H')
@@ -601,10 +669,12 @@ def add_cycles_to_running_ecflow_workflow_at(
         print("Diligently doing nothing, as requested.")
         exit(0)
 
-    ECF_HOME, suite_def_files = update_existing_ecflow_workflow(
-        conf,suite,first_cycle,last_cycle,surrounding_cycles)
-    load_ecflow_suites(ECF_HOME,suite_def_files)    
-    begin_ecflow_suites(ECF_HOME,suite_def_files)    
+    ECF_HOME, suite_def_files, old_suite_defs = \
+        update_existing_ecflow_workflow(
+            conf,suite,first_cycle,last_cycle,surrounding_cycles,
+            yaml_fingerprint(yamldir))
+    loaded=load_ecflow_suites(ECF_HOME,suite_def_files,old_suite_defs)
+    begin_ecflow_suites(ECF_HOME,loaded)
 
 def make_rocoto_xml_for(yamldir):
     init_logging()
@@ -619,6 +689,27 @@ def make_rocoto_xml_for(yamldir):
     make_rocoto_xml(suite,f'{yamldir}/workflow.xml')
     create_crontab(conf)
     
+def report_critical_path_for(yamldir,first_cycle_str,last_cycle_str,
+                             runtimes_file=None,json_file=None):
+    init_logging()
+    conf,suite=read_yaml_suite(yamldir)
+    first_cycle=datetime.datetime.strptime(first_cycle_str,'%Y%m%d%H')
+    first_cycle=max(suite.Clock.start,first_cycle)
+    last_cycle=datetime.datetime.strptime(last_cycle_str,'%Y%m%d%H')
+    last_cycle=max(first_cycle,min(suite.Clock.end,last_cycle))
+    runtimes=None
+    if runtimes_file:
+        with open(runtimes_file,'rt') as fd:
+            runtimes=json.load(fd)
+    analysis=critical_path_for_suite(
+        suite,Clock(start=first_cycle,end=last_cycle,step=suite.Clock.step),
+        runtimes)
+    analysis.report(sys.stdout)
+    if json_file:
+        with open(json_file,'wt') as fd:
+            analysis.to_json(fd)
+        print(f'{json_file}: critical path analysis written here.')
+
 def create_crontab(conf,cronint=5):
     '''
         Create crontab to execute rocotorun every cronint (5) minutes